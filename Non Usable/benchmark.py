@@ -0,0 +1,75 @@
+"""
+Benchmark of the cold import time of the mesh handlers. Every module is
+imported in a fresh interpreter, so nothing is cached by previous imports,
+and the startup time of an empty interpreter is subtracted. It also checks
+that no plotting or CAD kernel module is loaded by the import.
+"""
+import subprocess
+import sys
+from timeit import default_timer as timer
+
+MODULES = [
+    'pygem.khandler', 'pygem.unvhandler', 'pygem.openfhandler',
+    'pygem.stlhandler', 'pygem.vtkhandler', 'pygem.nurbshandler',
+    'pygem.igshandler', 'pygem.stephandler'
+]
+HEAVY = ['vtk', 'matplotlib', 'mpl_toolkits', 'OCC', 'stl']
+BUDGET = {'pygem.khandler': 0.1}
+
+
+def run(statement):
+    """
+    Runs `statement` in a new interpreter.
+
+    :param string statement: the python code to run.
+    :return: elapsed, output: the wall clock time in seconds and the
+        standard output of the interpreter.
+    :rtype: float, string
+    """
+    start = timer()
+    output = subprocess.check_output([sys.executable, '-c', statement])
+    return timer() - start, output.decode().strip()
+
+
+def cold_import(module, repeat=5):
+    """
+    Measures the import time of `module`, best of `repeat` runs.
+
+    :param string module: the name of the module.
+    :param int repeat: the number of runs.
+    :return: elapsed, heavy: the import time in seconds and the heavy
+        modules loaded by the import.
+    :rtype: float, list
+    """
+    statement = ('import sys\nimport {0}\nprint(" ".join(sorted(set('
+                 'name.split(".")[0] for name in sys.modules) & set({1!r}))))'
+                ).format(module, HEAVY)
+    baseline = min(run('import sys')[0] for _ in range(repeat))
+    best = None
+    for _ in range(repeat):
+        elapsed, output = run(statement)
+        best = elapsed if best is None else min(best, elapsed)
+    return best - baseline, output.split()
+
+
+def main():
+    failed = False
+    print('{0:<22}{1:>10}  {2}'.format('module', 'ms', 'heavy modules'))
+    for module in MODULES:
+        try:
+            elapsed, heavy = cold_import(module)
+        except subprocess.CalledProcessError:
+            print('{0:<22}{1:>10}'.format(module, 'error'))
+            continue
+        budget = BUDGET.get(module)
+        over = budget is not None and elapsed > budget
+        failed = failed or over or bool(heavy)
+        print('{0:<22}{1:>10.1f}  {2}{3}'.format(
+            module, 1000 * elapsed, ' '.join(heavy) or '-',
+            '  over the {0:.0f} ms budget'.format(1000 * budget)
+            if over else ''))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
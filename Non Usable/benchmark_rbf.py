@@ -0,0 +1,87 @@
+"""
+Benchmark of the error and of the time of the hierarchical backend of the RBF
+against the dense one, for bases with global support. The control points and
+the mesh points are random points in the unit cube; the error is the maximum
+distance between the points deformed by the two backends.
+"""
+import sys
+import warnings
+from timeit import default_timer as timer
+
+import numpy as np
+
+from pygem.radial import RBF
+
+# the multiquadrics with a radius comparable with the unit cube are flat: the
+# interpolant is ill posed away from the control points, so the error against
+# the dense backend is large, and GMRES stagnates at the smaller tolerances
+BASES = [('thin_plate_spline', 0.5), ('multi_quadratic_biharmonic_spline', 0.1),
+         ('multi_quadratic_biharmonic_spline', 0.5),
+         ('multi_quadratic_biharmonic_spline', 1.0)]
+TOLERANCES = [1e-4, 1e-6, 1e-8]
+
+
+class Parameters(object):
+    """
+    The RBF parameters of the benchmark.
+    """
+
+    def __init__(self, basis, radius, original_control_points):
+        self.basis = basis
+        self.radius = radius
+        self.power = 2
+        self.original_control_points = original_control_points
+        self.deformed_control_points = original_control_points + 0.02 * np.sin(
+            4. * original_control_points)
+
+
+def deform(parameters, mesh_points, **kwargs):
+    """
+    Deforms `mesh_points` with a new RBF.
+
+    :param Parameters parameters: the parameters of the RBF.
+    :param numpy.ndarray mesh_points: the points to deform.
+    :return: elapsed, modified_mesh_points, stagnated: the time in seconds to
+        solve the system and to deform the points, the deformed points and
+        if the solver warned that it stopped above the tolerance.
+    :rtype: float, numpy.ndarray, bool
+    """
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter('always', RuntimeWarning)
+        start = timer()
+        deformation = RBF(parameters, mesh_points, **kwargs)
+        deformation.perform()
+        elapsed = timer() - start
+    stagnated = any(
+        issubclass(warning.category, RuntimeWarning) for warning in caught)
+    return elapsed, deformation.modified_mesh_points, stagnated
+
+
+def main(n_controls=4000, n_points=50000):
+    random = np.random.RandomState(0)
+    control_points = random.uniform(size=(n_controls, 3))
+    mesh_points = random.uniform(size=(n_points, 3))
+    print('{0} control points, {1} mesh points'.format(n_controls, n_points))
+    print('{0:<40}{1:>10}{2:>10}{3:>12}'.format('basis', 'tolerance', 's',
+                                                'error'))
+    for name, radius in BASES:
+        parameters = Parameters(name, radius, control_points)
+        basis = '{0} {1}'.format(name, radius)
+        elapsed, dense, _ = deform(parameters, mesh_points)
+        print('{0:<40}{1:>10}{2:>10.2f}{3:>12}'.format(basis, 'dense', elapsed,
+                                                        '-'))
+        for tolerance in TOLERANCES:
+            elapsed, hierarchical, stagnated = deform(
+                parameters,
+                mesh_points,
+                backend='hierarchical',
+                tolerance=tolerance)
+            print('{0:<40}{1:>10.0e}{2:>10.2f}{3:>12.1e}{4}'.format(
+                basis, tolerance, elapsed,
+                np.abs(hierarchical - dense).max(),
+                '  stagnated' if stagnated else ''))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:]]))
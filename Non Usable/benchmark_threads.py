@@ -0,0 +1,88 @@
+"""
+Benchmark of the scaling of the tiled execution of FFD, RBF and IDW with the
+number of threads. The mesh points and the control points are random points in
+the unit cube; every deformation is run with 1, 2, 4, ... threads, up to 32,
+and the deformed points are checked against the ones of a single thread. The
+threads of BLAS are capped if threadpoolctl is installed; without it the
+timings include the oversubscription of the cores by BLAS.
+"""
+import os
+import sys
+from timeit import default_timer as timer
+
+import numpy as np
+
+from pygem.freeform import FFD
+from pygem.idw import IDW
+from pygem.radial import RBF
+from pygem.tiled import TiledExecutor
+
+THREADS = [1, 2, 4, 8, 16, 32]
+
+
+class Parameters(object):
+    """
+    The FFD, RBF and IDW parameters of the benchmark.
+    """
+
+    def __init__(self, original_control_points):
+        self.origin_box = np.zeros(3)
+        self.position_vertices = np.array([[0., 0., 0.], [1., 0., 0.],
+                                           [0., 1., 0.], [0., 0., 1.]])
+        random = np.random.RandomState(1)
+        self.array_mu_x = 0.05 * random.uniform(size=(5, 5, 5))
+        self.array_mu_y = 0.05 * random.uniform(size=(5, 5, 5))
+        self.array_mu_z = 0.05 * random.uniform(size=(5, 5, 5))
+        self.basis = 'gaussian_spline'
+        self.radius = 0.5
+        self.power = 2
+        self.original_control_points = original_control_points
+        self.deformed_control_points = original_control_points + 0.02 * np.sin(
+            4. * original_control_points)
+
+
+def perform(deformation, n_threads, repeat=3):
+    """
+    Performs `deformation` with `n_threads` threads, best of `repeat` runs.
+
+    :param deformation: the FFD, RBF or IDW.
+    :param int n_threads: the number of threads.
+    :param int repeat: the number of runs.
+    :return: elapsed, modified_mesh_points: the time in seconds and the
+        deformed points.
+    :rtype: float, numpy.ndarray
+    """
+    executor = TiledExecutor(n_threads)
+    best = None
+    for _ in range(repeat):
+        start = timer()
+        deformation.perform(executor=executor)
+        elapsed = timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, deformation.modified_mesh_points
+
+
+def main(n_points=1000000, n_controls=500):
+    random = np.random.RandomState(0)
+    mesh_points = random.uniform(size=(n_points, 3))
+    parameters = Parameters(random.uniform(size=(n_controls, 3)))
+    print('{0} mesh points, {1} control points, {2} cores'.format(
+        n_points, n_controls, os.cpu_count()))
+    print('{0:<6}{1:>8}{2:>10}{3:>10}{4:>12}'.format('', 'threads', 's',
+                                                     'speedup', 'difference'))
+    for name, deformation in [('FFD', FFD(parameters, mesh_points)),
+                              ('RBF', RBF(parameters, mesh_points)),
+                              ('IDW', IDW(parameters, mesh_points))]:
+        serial, reference = None, None
+        for n_threads in THREADS:
+            elapsed, modified = perform(deformation, n_threads)
+            if reference is None:
+                serial, reference = elapsed, modified.copy()
+            print('{0:<6}{1:>8}{2:>10.3f}{3:>10.2f}{4:>12.1e}'.format(
+                name, n_threads, elapsed, serial / elapsed,
+                np.abs(modified - reference).max()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(*[int(arg) for arg in sys.argv[1:]]))
@@ -38,8 +38,13 @@ Utilities for performing Free Form Deformation (FFD)
     involved transformations.
 """
 import numpy as np
-from scipy import special
+from scipy import special, sparse
 import pygem.affine as at
+from pygem.tiled import TiledExecutor
+
+# number of points deformed at once by perform and perform_chunked: a few
+# megabytes of coordinates, and enough tiles to keep the threads busy
+CHUNK_SIZE = 2**16
 
 
 class FFD(object):
@@ -71,12 +76,178 @@ class FFD(object):
         self.original_mesh_points = original_mesh_points
         self.modified_mesh_points = None
 
-    def perform(self):
+    def perform(self, chunk_size=CHUNK_SIZE, executor=None):
         """
         This method performs the deformation on the mesh points. After the
-        execution it sets `self.modified_mesh_points`.
+        execution it sets `self.modified_mesh_points`. The points are deformed
+        in tiles of `chunk_size` points, run in parallel by the `executor`, as
+        in `perform_chunked`.
+        :param int chunk_size: number of points of a tile. Default is
+            `CHUNK_SIZE`.
+        :param TiledExecutor executor: the executor of the tiles. Default is
+            None, that is a single thread.
+        """
+        self.perform_chunked(chunk_size, executor=executor)
+
+    def perform_chunked(self, chunk_size=CHUNK_SIZE, out=None, executor=None):
+        """
+        This method performs the deformation on the mesh points `chunk_size`
+        points at a time, so that the memory needed is proportional to the
+        chunk and not to the mesh; `self.original_mesh_points` can be a memory
+        map, e.g. from `numpy.load` with `mmap_mode='r'`. The points outside
+        the bounding box of the lattice in the physical space are copied
+        without being transformed. After the execution it sets
+        `self.modified_mesh_points` to the output.
+        :param int chunk_size: number of points processed at once. Default is
+            `CHUNK_SIZE`.
+        :param out: where the deformed points are written: a `n_points`-by-3
+            array (also a memory map), the name of a .npy file that is created
+            as a memory map, or None to allocate a new array. Default is None.
+        :type out: numpy.ndarray or string
+        :param TiledExecutor executor: the executor of the chunks, which
+            writes each one in its part of `out`. Default is None, that is a
+            single thread.
+        """
+        n_points = self.original_mesh_points.shape[0]
+        if out is None:
+            out = np.empty((n_points, 3))
+        elif isinstance(out, str):
+            out = np.lib.format.open_memmap(
+                out, mode='w+', dtype=np.float64, shape=(n_points, 3))
+        elif out.shape != (n_points, 3):
+            raise ValueError(
+                'The output must have shape ({0!s}, 3).'.format(n_points))
+        executor = TiledExecutor() if executor is None else executor
+
+        (translation, transformation,
+         inverse_transformation) = self._transformations()
+        array_mu = self._array_mu()
+
+        # bounding box of the lattice in the physical space, slightly enlarged
+        # so that the rounding of the transformation does not matter
+        corners = self._transform_points(
+            np.array([[i, j, k] for i in (0., 1.) for j in (0., 1.)
+                      for k in (0., 1.)]), inverse_transformation) + translation
+        margin = 1e-9 * np.ptp(corners, axis=0).max()
+        lower = corners.min(axis=0) - margin
+        upper = corners.max(axis=0) + margin
+
+        def kernel(start, stop):
+            points = np.asarray(self.original_mesh_points[start:stop])
+            block = out[start:stop]
+            block[:] = points
+
+            candidates = np.flatnonzero(
+                np.all((points >= lower) & (points <= upper), axis=1))
+            if candidates.size == 0:
+                return
+            reference_points = self._transform_points(
+                points[candidates] - translation, transformation)
+            inside = np.all((reference_points >= 0.) &
+                            (reference_points <= 1.),
+                            axis=1)
+            reference_points = reference_points[inside]
+            block[candidates[inside]] = self._transform_points(
+                self._shift(reference_points, array_mu) + reference_points,
+                inverse_transformation) + translation
+
+        executor.run(kernel, n_points, chunk_size)
+
+        if isinstance(out, np.memmap):
+            out.flush()
+        self.modified_mesh_points = out
+
+    def prepare(self, controls=None):
+        """
+        This method computes once what does not depend on the displacements
+        of the control points, to deform `self.original_mesh_points` for many
+        different `array_mu_x`, `array_mu_y` and `array_mu_z`.
+        :param numpy.ndarray controls: boolean array with the shape of
+            `array_mu_x` which selects the control points that can move; the
+            displacements of the others are ignored. Default is None, that is
+            all the control points.
+        :return: prepared: the prepared deformation.
+        :rtype: PreparedFFD
+        """
+        return PreparedFFD(self, controls)
+
+    def influence(self, threshold=0., chunk_size=None):
+        """
+        This method assembles the sparse linear operator from the
+        displacements of the control points to the displacements of the mesh
+        points inside the lattice. Only the products of the basis functions
+        that can be nonzero at each point are computed, so with local bases
+        the memory is proportional to their support.
+        :param float threshold: the products of the basis functions smaller
+            than it are dropped. Default is 0.
+        :param int chunk_size: number of points assembled at once. Default is
+            None, that is about four millions of basis values at once.
+        :return: influence: the influence operator.
+        :rtype: FFDInfluence
+        """
+        shape = self.parameters.array_mu_x.shape
+        n_controls = int(np.prod(shape))
+
+        (translation, transformation,
+         inverse_transformation) = self._transformations()
+        reference_points = self._transform_points(
+            self.original_mesh_points - translation, transformation)
+        inside = np.flatnonzero(
+            np.all((reference_points >= 0.) & (reference_points <= 1.),
+                   axis=1))
+        origin = self._transform_points(np.zeros((1, 3)),
+                                        inverse_transformation)
+        linear = self._transform_points(np.eye(3),
+                                        inverse_transformation) - origin
+
+        if chunk_size is None:
+            n_support = np.prod([
+                indices.shape[1]
+                for indices, __ in self._support(reference_points[:0])
+            ])
+            chunk_size = max(1, 2**22 // int(n_support))
+
+        blocks = []
+        for start in range(0, inside.shape[0], chunk_size):
+            chunk = reference_points[inside[start:start + chunk_size]]
+            ((index_x, basis_x), (index_y, basis_y),
+             (index_z, basis_z)) = self._support(chunk)
+            columns = ((index_x[:, :, np.newaxis, np.newaxis] * shape[1] +
+                        index_y[:, np.newaxis, :, np.newaxis]) * shape[2] +
+                       index_z[:, np.newaxis, np.newaxis, :]).reshape(
+                           chunk.shape[0], -1)
+            values = np.einsum('pi,pj,pk->pijk', basis_x, basis_y,
+                               basis_z).reshape(chunk.shape[0], -1)
+            keep = (np.abs(values) >= threshold) & (values != 0.)
+            rows = np.broadcast_to(
+                np.arange(chunk.shape[0])[:, np.newaxis], values.shape)
+            blocks.append(
+                sparse.csr_matrix(
+                    (values[keep], (rows[keep], columns[keep])),
+                    shape=(chunk.shape[0], n_controls)))
+        basis = sparse.vstack(blocks, format='csr') if blocks else \
+            sparse.csr_matrix((0, n_controls))
+
+        # row 3 * point + physical component, column n_controls * reference
+        # component + control point
+        matrix = sparse.kron(basis, linear.T, format='csr')
+        order = (np.arange(n_controls)[np.newaxis, :] +
+                 n_controls * np.arange(3)[:, np.newaxis]).T.ravel()
+        permutation = np.empty_like(order)
+        permutation[order] = np.arange(order.shape[0])
+        matrix = matrix[:, permutation]
+        matrix.eliminate_zeros()
+        return FFDInfluence(matrix, inside, shape,
+                            self.original_mesh_points.shape[0])
+
+    def _transformations(self):
+        """
+        This private method returns the translation of the lattice and the
+        affine maps from the physical frame, translated to the origin, to the
+        reference unit cube and back.
+        :return: translation, transformation, inverse_transformation
+        :rtype: numpy.ndarray, function, function
         """
-        # translation and then affine transformation
         translation = self.parameters.origin_box
 
         physical_frame = self.parameters.position_vertices - translation
@@ -85,77 +256,107 @@ class FFD(object):
         transformation = at.affine_points_fit(physical_frame, reference_frame)
         inverse_transformation = at.affine_points_fit(reference_frame,
                                                       physical_frame)
+        return translation, transformation, inverse_transformation
 
-        # apply transformation to original mesh points
-        reference_frame_mesh_points = self._transform_points(
-            self.original_mesh_points - translation, transformation)
+    def _array_mu(self):
+        """
+        This private method returns the displacements of the control points of
+        the three directions stacked together.
+        :return: array_mu: array with shape (3, `dim_n_mu`, `dim_m_mu`,
+            `dim_t_mu`).
+        :rtype: numpy.ndarray
+        """
+        return np.stack((self.parameters.array_mu_x,
+                         self.parameters.array_mu_y,
+                         self.parameters.array_mu_z))
 
-        # select mesh points inside bounding box
-        mesh_points = reference_frame_mesh_points[
-            (reference_frame_mesh_points[:, 0] >= 0.)
-            & (reference_frame_mesh_points[:, 0] <= 1.) &
-            (reference_frame_mesh_points[:, 1] >= 0.) &
-            (reference_frame_mesh_points[:, 1] <= 1.) &
-            (reference_frame_mesh_points[:, 2] >= 0.) &
-            (reference_frame_mesh_points[:, 2] <= 1.)]
-        (n_rows_mesh, n_cols_mesh) = mesh_points.shape
-
-        # Initialization. In order to exploit the contiguity in memory the
-        # following are transposed
-        (dim_n_mu, dim_m_mu, dim_t_mu) = self.parameters.array_mu_x.shape
-        bernstein_x = np.zeros((dim_n_mu, n_rows_mesh))
-        bernstein_y = np.zeros((dim_m_mu, n_rows_mesh))
-        bernstein_z = np.zeros((dim_t_mu, n_rows_mesh))
-        shift_mesh_points = np.zeros((n_cols_mesh, n_rows_mesh))
-
-        for i in range(0, dim_n_mu):
-            aux1 = np.power((1 - mesh_points[:, 0]), dim_n_mu - 1 - i)
-            aux2 = np.power(mesh_points[:, 0], i)
-            bernstein_x[i, :] = special.binom(dim_n_mu - 1, i) * np.multiply(
-                aux1, aux2)
-
-        for i in range(0, dim_m_mu):
-            aux1 = np.power((1 - mesh_points[:, 1]), dim_m_mu - 1 - i)
-            aux2 = np.power(mesh_points[:, 1], i)
-            bernstein_y[i, :] = special.binom(dim_m_mu - 1, i) * np.multiply(
-                aux1, aux2)
-
-        for i in range(0, dim_t_mu):
-            aux1 = np.power((1 - mesh_points[:, 2]), dim_t_mu - 1 - i)
-            aux2 = np.power(mesh_points[:, 2], i)
-            bernstein_z[i, :] = special.binom(dim_t_mu - 1, i) * np.multiply(
-                aux1, aux2)
-
-        aux_x = 0.
-        aux_y = 0.
-        aux_z = 0.
-        for j in range(0, dim_m_mu):
-            for k in range(0, dim_t_mu):
-                bernstein_yz = np.multiply(bernstein_y[j, :], bernstein_z[k, :])
-                for i in range(0, dim_n_mu):
-                    aux = np.multiply(bernstein_x[i, :], bernstein_yz)
-                    aux_x += aux * self.parameters.array_mu_x[i, j, k]
-                    aux_y += aux * self.parameters.array_mu_y[i, j, k]
-                    aux_z += aux * self.parameters.array_mu_z[i, j, k]
-        shift_mesh_points[0, :] += aux_x
-        shift_mesh_points[1, :] += aux_y
-        shift_mesh_points[2, :] += aux_z
-
-        # shift_mesh_points needs to be transposed to be summed with mesh_points
-        # apply inverse transformation to shifted mesh points
-        new_mesh_points = self._transform_points(
-            np.transpose(shift_mesh_points) + mesh_points,
-            inverse_transformation) + translation
-
-        # merge non-shifted mesh points with shifted ones
-        self.modified_mesh_points = np.copy(self.original_mesh_points)
-        self.modified_mesh_points[(reference_frame_mesh_points[:, 0] >= 0.)
-                                  & (reference_frame_mesh_points[:, 0] <= 1.) &
-                                  (reference_frame_mesh_points[:, 1] >= 0.) &
-                                  (reference_frame_mesh_points[:, 1] <= 1.) &
-                                  (reference_frame_mesh_points[:, 2] >= 0.) &
-                                  (reference_frame_mesh_points[:, 2] <=
-                                   1.)] = new_mesh_points
+    def _bases(self, mesh_points):
+        """
+        This private method returns the basis functions of the three
+        directions evaluated at the points.
+        :param numpy.ndarray mesh_points: `n_points`-by-3 matrix with the
+            reference coordinates of the points inside the lattice.
+        :return: bases: for each direction, the `n_points`-by-`dim` matrix with
+            the value of each basis function at each point.
+        :rtype: tuple(numpy.ndarray)
+        """
+        return tuple(
+            self._bernstein(mesh_points[:, direction], dim)
+            for direction, dim in enumerate(self.parameters.array_mu_x.shape))
+
+    def _support(self, mesh_points):
+        """
+        This private method returns, for each direction, the basis functions
+        that can be nonzero at the points: all of them for the Bernstein
+        polynomials.
+        :param numpy.ndarray mesh_points: `n_points`-by-3 matrix with the
+            reference coordinates of the points inside the lattice.
+        :return: support: for each direction, the two `n_points`-by-`k`
+            matrices with the indices of the control points and the values of
+            their basis functions.
+        :rtype: tuple(tuple(numpy.ndarray))
+        """
+        return tuple(
+            (np.broadcast_to(np.arange(basis.shape[1]), basis.shape), basis)
+            for basis in self._bases(mesh_points))
+
+    @staticmethod
+    def _bernstein(coordinates, dim):
+        """
+        This private static method evaluates the Bernstein polynomials of
+        degree `dim` - 1 at the given coordinates.
+        :param numpy.ndarray coordinates: the reference coordinates, in [0, 1],
+            of the points along one direction.
+        :param int dim: the number of control points along the direction.
+        :return: bernstein: `n_points`-by-`dim` matrix with the value of each
+            polynomial at each point.
+        :rtype: numpy.ndarray
+        """
+        coordinates = np.ascontiguousarray(coordinates, dtype=float)
+        complements = 1 - coordinates
+        # the powers of t and (1 - t) as running products, one degree per row
+        powers = np.empty((2, dim, coordinates.shape[0]))
+        powers[:, 0] = 1.
+        for degree in range(1, dim):
+            np.multiply(powers[0, degree - 1], coordinates,
+                        out=powers[0, degree])
+            np.multiply(powers[1, degree - 1], complements,
+                        out=powers[1, degree])
+        bernstein = np.multiply(powers[1, ::-1], powers[0])
+        bernstein *= special.binom(dim - 1, np.arange(dim))[:, np.newaxis]
+        return bernstein.T
+
+    @classmethod
+    def _shift(cls, mesh_points, array_mu, chunk_size=2**10):
+        """
+        This private class method computes the displacement of the points,
+        that is the tensor product of the Bernstein polynomials contracted with
+        the control point displacements. For `chunk_size` points at a time the
+        polynomials are evaluated, the products of the ones along y and z are
+        contracted with a single matrix product and then the ones along x.
+        :param numpy.ndarray mesh_points: `n_points`-by-3 matrix with the
+            reference coordinates of the points inside the lattice.
+        :param numpy.ndarray array_mu: the displacements of the control points,
+            with shape (3, `dim_n_mu`, `dim_m_mu`, `dim_t_mu`).
+        :param int chunk_size: number of points processed at once.
+        :return: shift: `n_points`-by-3 matrix with the displacements.
+        :rtype: numpy.ndarray
+        """
+        (__, dim_n_mu, dim_m_mu, dim_t_mu) = array_mu.shape
+        mu_yz = np.transpose(array_mu, (2, 3, 0, 1)).reshape(
+            dim_m_mu * dim_t_mu, 3 * dim_n_mu)
+        shift = np.empty((mesh_points.shape[0], 3))
+        for start in range(0, mesh_points.shape[0], chunk_size):
+            chunk = mesh_points[start:start + chunk_size]
+            bernstein_x = cls._bernstein(chunk[:, 0], dim_n_mu)
+            bernstein_yz = np.einsum('pj,pk->pjk',
+                                     cls._bernstein(chunk[:, 1], dim_m_mu),
+                                     cls._bernstein(chunk[:, 2], dim_t_mu))
+            aux = np.dot(bernstein_yz.reshape(-1, mu_yz.shape[0]),
+                         mu_yz).reshape(-1, 3, dim_n_mu)
+            shift[start:start + chunk_size] = np.einsum(
+                'pci,pi->pc', aux, bernstein_x)
+        return shift
 
     @staticmethod
     def _transform_points(original_points, transformation):
@@ -170,3 +371,396 @@ class FFD(object):
         :rtype: numpy.ndarray
         """
         return transformation(original_points)
+
+
+class BSplineFFD(FFD):
+    """
+    Class that handles the Free Form Deformation on the mesh points with a
+    B-spline lattice instead of the Bernstein one. Each point moves only
+    with the (degree + 1)^3 control points whose basis functions do not
+    vanish there, so the cost depends on the degree and not on the number
+    of control points. With degree `dim` - 1 and the default knots it is
+    the Bernstein FFD.
+    :param FFDParameters ffd_parameters: parameters of the Free Form
+        Deformation.
+    :param numpy.ndarray original_mesh_points: coordinates of the original
+        points of the mesh.
+    :param degree: the degree of the B-splines, the same for the three
+        directions or one per direction. It is lowered to `dim` - 1 when
+        there are not enough control points. Default is 3.
+    :type degree: int or tuple(int)
+    :param list knots: the three knot vectors in [0, 1], each with
+        `dim` + `degree` + 1 non decreasing values. Default is None, that is
+        uniform knots clamped at the ends.
+    :cvar tuple degree: the degree of the B-splines of each direction.
+    :cvar list knots: the knot vectors of each direction.
+    """
+
+    def __init__(self, ffd_parameters, original_mesh_points, degree=3,
+                 knots=None):
+        super(BSplineFFD, self).__init__(ffd_parameters, original_mesh_points)
+        dims = self.parameters.array_mu_x.shape
+        degrees = np.broadcast_to(degree, (3,))
+        self.degree = tuple(
+            int(min(degree, dim - 1)) for degree, dim in zip(degrees, dims))
+
+        if knots is None:
+            knots = [
+                np.concatenate((np.zeros(degree),
+                                np.linspace(0., 1., dim - degree + 1),
+                                np.ones(degree)))
+                for degree, dim in zip(self.degree, dims)
+            ]
+        self.knots = [np.asarray(knot, dtype=float) for knot in knots]
+        for knot, degree, dim in zip(self.knots, self.degree, dims):
+            if knot.shape != (dim + degree + 1,) or np.any(np.diff(knot) < 0):
+                raise ValueError(
+                    'A knot vector must have {0!s} non decreasing values.'.
+                    format(dim + degree + 1))
+
+    def _span_basis(self, coordinates, direction):
+        """
+        This private method finds the knot span of each coordinate and
+        evaluates there the nonzero B-splines with the Cox-de Boor recursion.
+        :param numpy.ndarray coordinates: the reference coordinates, in [0, 1],
+            of the points along the direction.
+        :param int direction: 0, 1 or 2 for x, y and z.
+        :return: indices, values: the two `n_points`-by-(`degree` + 1)
+            matrices with the indices of the control points of the nonzero
+            B-splines and their values.
+        :rtype: numpy.ndarray, numpy.ndarray
+        """
+        knots, degree = self.knots[direction], self.degree[direction]
+        n_control = knots.shape[0] - degree - 1
+        coordinates = np.asarray(coordinates, dtype=float)
+        # the last knot belongs to the last span
+        span = np.clip(
+            np.searchsorted(knots, coordinates, side='right') - 1, degree,
+            n_control - 1)
+
+        values = np.zeros((coordinates.shape[0], degree + 1))
+        values[:, 0] = 1.
+        left = np.empty_like(values)
+        right = np.empty_like(values)
+        for j in range(1, degree + 1):
+            left[:, j] = coordinates - knots[span + 1 - j]
+            right[:, j] = knots[span + j] - coordinates
+            saved = 0.
+            for r in range(j):
+                temp = values[:, r] / (right[:, r + 1] + left[:, j - r])
+                values[:, r] = saved + right[:, r + 1] * temp
+                saved = left[:, j - r] * temp
+            values[:, j] = saved
+        return span[:, np.newaxis] - degree + np.arange(degree + 1), values
+
+    def _bases(self, mesh_points):
+        """
+        This private method returns the B-splines of the three directions
+        evaluated at the points, zero outside their support.
+        :param numpy.ndarray mesh_points: `n_points`-by-3 matrix with the
+            reference coordinates of the points inside the lattice.
+        :return: bases: for each direction, the `n_points`-by-`dim` matrix with
+            the value of each B-spline at each point.
+        :rtype: tuple(numpy.ndarray)
+        """
+        bases = []
+        rows = np.arange(mesh_points.shape[0])[:, np.newaxis]
+        for direction, dim in enumerate(self.parameters.array_mu_x.shape):
+            indices, values = self._span_basis(mesh_points[:, direction],
+                                               direction)
+            basis = np.zeros((mesh_points.shape[0], dim))
+            basis[rows, indices] = values
+            bases.append(basis)
+        return tuple(bases)
+
+    def _support(self, mesh_points):
+        """
+        This private method returns, for each direction, the B-splines that
+        do not vanish at the points, `degree` + 1 for each point.
+        :param numpy.ndarray mesh_points: `n_points`-by-3 matrix with the
+            reference coordinates of the points inside the lattice.
+        :return: support: for each direction, the two
+            `n_points`-by-(`degree` + 1) matrices with the indices of the
+            control points and the values of their B-splines.
+        :rtype: tuple(tuple(numpy.ndarray))
+        """
+        return tuple(
+            self._span_basis(mesh_points[:, direction], direction)
+            for direction in range(3))
+
+    def _shift(self, mesh_points, array_mu, chunk_size=2**12):
+        """
+        This private method computes the displacement of the points, for
+        `chunk_size` points at a time: the displacements of the control points
+        of the nonzero B-splines are gathered through their flat indices, the
+        first one of each point plus a fixed pattern, and weighted with the
+        products of the B-splines.
+        :param numpy.ndarray mesh_points: `n_points`-by-3 matrix with the
+            reference coordinates of the points inside the lattice.
+        :param numpy.ndarray array_mu: the displacements of the control points,
+            with shape (3, `dim_n_mu`, `dim_m_mu`, `dim_t_mu`).
+        :param int chunk_size: number of points processed at once.
+        :return: shift: `n_points`-by-3 matrix with the displacements.
+        :rtype: numpy.ndarray
+        """
+        (__, dim_n_mu, dim_m_mu, dim_t_mu) = array_mu.shape
+        array_mu = np.ascontiguousarray(array_mu).reshape(3, -1)
+        (degree_x, degree_y, degree_z) = self.degree
+        pattern = ((np.arange(degree_x + 1)[:, np.newaxis, np.newaxis] *
+                    dim_m_mu + np.arange(degree_y + 1)[:, np.newaxis]) *
+                   dim_t_mu + np.arange(degree_z + 1)).ravel()
+
+        shift = np.empty((mesh_points.shape[0], 3))
+        for start in range(0, mesh_points.shape[0], chunk_size):
+            chunk = mesh_points[start:start + chunk_size]
+            (index_x, basis_x), (index_y, basis_y), (index_z, basis_z) = [
+                self._span_basis(chunk[:, direction], direction)
+                for direction in range(3)
+            ]
+            indices = ((index_x[:, :1] * dim_m_mu + index_y[:, :1]) *
+                       dim_t_mu + index_z[:, :1]) + pattern
+            weights = np.einsum(
+                'pa,pb->pab', basis_x,
+                np.einsum('pb,pc->pbc', basis_y, basis_z).reshape(
+                    chunk.shape[0], -1)).reshape(chunk.shape[0], -1)
+            for component in range(3):
+                shift[start:start + chunk_size, component] = np.einsum(
+                    'pk,pk->p', weights, array_mu[component][indices])
+        return shift
+
+
+class FFDInfluence(object):
+    """
+    Class that handles the linear operator of the Free Form Deformation, from
+    the displacements of the control points to the displacements of the mesh
+    points inside the lattice, as a sparse matrix. The displacements of the
+    control points are the vector `weights` with `array_mu_x`, `array_mu_y`
+    and `array_mu_z` raveled one after the other; the displacements of the
+    points are raveled point by point.
+    :param scipy.sparse.csr_matrix matrix: the operator, with shape
+        (3 * `n_inside`, 3 * `n_controls`).
+    :param numpy.ndarray inside: indices of the points inside the lattice.
+    :param tuple shape: the shape of the lattice.
+    :param int n_points: the number of mesh points.
+    :cvar scipy.sparse.csr_matrix matrix: the operator.
+    :cvar numpy.ndarray inside: indices of the points inside the lattice.
+    :cvar tuple shape: the shape of the lattice.
+    :cvar int n_points: the number of mesh points.
+    :Example:
+    >>> influence = ffd.FFD(ffd_parameters, original_mesh_points).influence()
+    >>> influence.save('influence.npz')
+    >>> new_mesh_points = influence.deform(original_mesh_points, array_mu_x,
+    ...                                    array_mu_y, array_mu_z)
+    """
+
+    def __init__(self, matrix, inside, shape, n_points):
+        self.matrix = matrix
+        self.inside = inside
+        self.shape = tuple(shape)
+        self.n_points = n_points
+
+    def weights(self, array_mu_x, array_mu_y, array_mu_z):
+        """
+        Returns the vector of the displacements of the control points.
+        :param numpy.ndarray array_mu_x: displacements along x.
+        :param numpy.ndarray array_mu_y: displacements along y.
+        :param numpy.ndarray array_mu_z: displacements along z.
+        :return: weights: vector with 3 * `n_controls` elements.
+        :rtype: numpy.ndarray
+        """
+        return np.concatenate(
+            (np.ravel(array_mu_x), np.ravel(array_mu_y), np.ravel(array_mu_z)))
+
+    def deform(self, original_mesh_points, array_mu_x, array_mu_y,
+               array_mu_z):
+        """
+        Deforms the mesh points with a sparse matrix-vector product.
+        :param numpy.ndarray original_mesh_points: coordinates of the
+            original points of the mesh.
+        :param numpy.ndarray array_mu_x: displacements along x.
+        :param numpy.ndarray array_mu_y: displacements along y.
+        :param numpy.ndarray array_mu_z: displacements along z.
+        :return: modified_mesh_points: the deformed points.
+        :rtype: numpy.ndarray
+        """
+        modified_mesh_points = np.array(original_mesh_points, dtype=float)
+        modified_mesh_points[self.inside] += self.matrix.dot(
+            self.weights(array_mu_x, array_mu_y, array_mu_z)).reshape(-1, 3)
+        return modified_mesh_points
+
+    def gradient(self, mesh_gradient):
+        """
+        Returns the gradient of a function of the mesh points with respect to
+        the displacements of the control points, through the transposed
+        operator.
+        :param numpy.ndarray mesh_gradient: `n_points`-by-3 gradient of the
+            function with respect to the mesh points.
+        :return: gradient_x, gradient_y, gradient_z: the gradients with
+            respect to `array_mu_x`, `array_mu_y` and `array_mu_z`.
+        :rtype: tuple(numpy.ndarray)
+        """
+        gradient = self.matrix.T.dot(
+            np.asarray(mesh_gradient, dtype=float)[self.inside].ravel())
+        return tuple(gradient.reshape((3,) + self.shape))
+
+    def save(self, filename):
+        """
+        Saves the operator to the .npz file `filename`.
+        :param string filename: name of the output file.
+        """
+        np.savez(
+            filename,
+            data=self.matrix.data,
+            indices=self.matrix.indices,
+            indptr=self.matrix.indptr,
+            matrix_shape=self.matrix.shape,
+            inside=self.inside,
+            shape=self.shape,
+            n_points=self.n_points)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Loads the operator from the .npz file `filename`.
+        :param string filename: name of the input file.
+        :return: influence: the influence operator.
+        :rtype: FFDInfluence
+        """
+        with np.load(filename) as data:
+            matrix = sparse.csr_matrix(
+                (data['data'], data['indices'], data['indptr']),
+                shape=tuple(data['matrix_shape']))
+            return cls(matrix, data['inside'], tuple(data['shape']),
+                       int(data['n_points']))
+
+
+class PreparedFFD(object):
+    """
+    Class that handles the Free Form Deformation of fixed mesh points with a
+    fixed lattice for many displacements of the control points. The points
+    inside the lattice, their Bernstein basis and the linear part of the map
+    back to the physical space are computed once: the deformation is then a
+    matrix product, or a single matrix-matrix product for a batch of
+    displacements. The basis has a column for each moving control point: for
+    fine lattices select the design control points with `controls`.
+    :param FFD ffd: the Free Form Deformation with the parameters and the
+        original mesh points.
+    :param numpy.ndarray controls: boolean array with the shape of
+        `array_mu_x` which selects the control points that can move. Default
+        is None, that is all the control points.
+    :cvar numpy.ndarray inside: indices of the points inside the lattice.
+    :cvar numpy.ndarray basis: `n_inside`-by-`n_controls` matrix with the
+        product of the Bernstein polynomials of the moving control points at
+        the points inside the lattice.
+    :cvar numpy.ndarray linear: 3-by-3 linear part of the map from the
+        reference to the physical space, acting on row vectors.
+    :cvar numpy.ndarray controls: boolean array of the moving control points.
+    :Example:
+    >>> prepared = ffd.FFD(ffd_parameters, original_mesh_points).prepare()
+    >>> new_mesh_points = prepared.deform(array_mu_x, array_mu_y, array_mu_z)
+    """
+
+    def __init__(self, ffd, controls=None):
+        shape = ffd.parameters.array_mu_x.shape
+        if controls is None:
+            controls = np.ones(shape, dtype=bool)
+        self.controls = np.asarray(controls, dtype=bool).reshape(shape)
+        self.original_mesh_points = ffd.original_mesh_points
+
+        (translation, transformation,
+         inverse_transformation) = ffd._transformations()
+        reference_points = ffd._transform_points(
+            self.original_mesh_points - translation, transformation)
+        self.inside = np.flatnonzero(
+            np.all((reference_points >= 0.) & (reference_points <= 1.),
+                   axis=1))
+        reference_points = reference_points[self.inside]
+
+        origin = ffd._transform_points(np.zeros((1, 3)), inverse_transformation)
+        self.linear = ffd._transform_points(np.eye(3),
+                                            inverse_transformation) - origin
+        self._base_points = np.array(self.original_mesh_points, dtype=float)
+        self._base_inside = ffd._transform_points(
+            reference_points, inverse_transformation) + translation
+
+        self.basis = np.ascontiguousarray(
+            np.einsum('pi,pj,pk->pijk',
+                      *ffd._bases(reference_points))[:, self.controls])
+
+    def deform(self, array_mu_x, array_mu_y, array_mu_z, out=None,
+               update=False):
+        """
+        Deforms the mesh points for the given displacements of the control
+        points.
+        :param numpy.ndarray array_mu_x: displacements along x.
+        :param numpy.ndarray array_mu_y: displacements along y.
+        :param numpy.ndarray array_mu_z: displacements along z.
+        :param numpy.ndarray out: `n_points`-by-3 array where the deformed
+            points are written. Default is None.
+        :param bool update: if True, `out` holds the points deformed by a
+            previous call and only the points inside the lattice are
+            rewritten, skipping the copy of all the original points. Default
+            is False.
+        :return: modified_mesh_points: the deformed points.
+        :rtype: numpy.ndarray
+        """
+        if out is None:
+            if update:
+                raise ValueError('update requires the array out.')
+            out = np.empty_like(self._base_points)
+        if not update:
+            out[:] = self._base_points
+        out[self.inside] = self.deform_inside(array_mu_x, array_mu_y,
+                                              array_mu_z)
+        return out
+
+    def deform_inside(self, array_mu_x, array_mu_y, array_mu_z, out=None):
+        """
+        Deforms only the mesh points inside the lattice, the only ones that
+        move, for the given displacements of the control points. It is the
+        cheapest way to evaluate a design when the caller needs only the
+        moving points, e.g. to patch a mesh file in place.
+        :param numpy.ndarray array_mu_x: displacements along x.
+        :param numpy.ndarray array_mu_y: displacements along y.
+        :param numpy.ndarray array_mu_z: displacements along z.
+        :param numpy.ndarray out: `n_inside`-by-3 array where the deformed
+            points are written. Default is None.
+        :return: modified_inside_points: the deformed points, in the order of
+            `inside`.
+        :rtype: numpy.ndarray
+        """
+        coefficients = np.dot(
+            np.stack((array_mu_x[self.controls], array_mu_y[self.controls],
+                      array_mu_z[self.controls]),
+                     axis=1), self.linear)
+        out = np.dot(self.basis, coefficients, out=out)
+        out += self._base_inside
+        return out
+
+    def deform_batch(self, arrays_mu):
+        """
+        Deforms the mesh points for a batch of displacements of the control
+        points with a single matrix-matrix product.
+        :param numpy.ndarray arrays_mu: the displacements, with shape
+            (`n_designs`, 3, `dim_n_mu`, `dim_m_mu`, `dim_t_mu`) where the
+            second axis is x, y and z.
+        :return: modified_mesh_points: array with shape (`n_designs`,
+            `n_points`, 3) with the deformed points of each design.
+        :rtype: numpy.ndarray
+        """
+        arrays_mu = np.asarray(arrays_mu)
+        n_designs = arrays_mu.shape[0]
+        # n_controls-by-(n_designs * 3) displacements in the physical space
+        coefficients = np.dot(
+            np.transpose(arrays_mu[:, :, self.controls], (0, 2, 1)),
+            self.linear)
+        coefficients = np.transpose(coefficients, (1, 0, 2)).reshape(
+            -1, 3 * n_designs)
+        shifts = np.dot(self.basis, coefficients).reshape(-1, n_designs, 3)
+        shifts += self._base_inside[:, np.newaxis]
+
+        out = np.empty((n_designs,) + self._base_points.shape)
+        out[:] = self._base_points
+        for design in range(n_designs):
+            out[design, self.inside] = shifts[:, design]
+        return out
@@ -0,0 +1,405 @@
+"""
+Module with a hierarchical matrix for the fast summation of radial basis
+functions with global support. The points are partitioned by a cluster tree;
+the blocks of far clusters are compressed with the adaptive cross
+approximation (ACA) up to a tolerance, the blocks of near clusters are kept
+dense.
+:Theoretical Insight:
+    As reference please consult M. Bebendorf, Hierarchical Matrices, volume 63
+    of Lecture Notes in Computational Science and Engineering. Springer,
+    Berlin, 2008. Two clusters :math:`s` and :math:`t` are admissible if
+    .. math::
+        \\max(\\text{diam}(s), \\text{diam}(t)) \\le \\eta\\,\\text{dist}(s, t)
+    and their block is approximated by :math:`U V` with a rank that depends
+    only on the tolerance, so the cost of a product is almost linear in the
+    number of points.
+"""
+import numpy as np
+
+from scipy import linalg, sparse
+from scipy.spatial import cKDTree
+
+# blocks with at most this number of entries are computed at once and
+# compressed with full pivoting, the larger ones with partial pivoting
+_SMALL_BLOCK = 2**14
+
+
+class ClusterTree(object):
+    """
+    Binary tree of clusters of points, obtained by splitting each cluster in
+    two halves along the longest side of its bounding box.
+    :param numpy.ndarray points: the `n_points`-by-3 points.
+    :param int leaf_size: the maximum number of points of a leaf. Default is
+        128.
+    :cvar numpy.ndarray points: the points.
+    :cvar numpy.ndarray indices: the permutation of the points that makes
+        every cluster contiguous.
+    :cvar numpy.ndarray starts: the first position in `indices` of the points
+        of each cluster.
+    :cvar numpy.ndarray ends: the position after the last point of each
+        cluster.
+    :cvar numpy.ndarray lower: the lower corner of the bounding box of each
+        cluster.
+    :cvar numpy.ndarray upper: the upper corner of the bounding box of each
+        cluster.
+    :cvar list children: the two children of each cluster, empty for the
+        leaves. The root is the cluster 0.
+    """
+
+    def __init__(self, points, leaf_size=128):
+        self.points = np.asarray(points, dtype=float)
+        self.indices = np.arange(self.points.shape[0])
+        starts, ends, lower, upper, self.children = [], [], [], [], []
+
+        def add(start, end):
+            cluster = self.points[self.indices[start:end]]
+            starts.append(start)
+            ends.append(end)
+            lower.append(cluster.min(axis=0))
+            upper.append(cluster.max(axis=0))
+            self.children.append(())
+            return len(starts) - 1
+
+        stack = [add(0, self.points.shape[0])] if self.points.shape[0] else []
+        while stack:
+            node = stack.pop()
+            start, end = starts[node], ends[node]
+            if end - start <= leaf_size:
+                continue
+            axis = np.argmax(upper[node] - lower[node])
+            indices = self.indices[start:end]
+            self.indices[start:end] = indices[np.argsort(
+                self.points[indices, axis], kind='stable')]
+            middle = (start + end) // 2
+            self.children[node] = (add(start, middle), add(middle, end))
+            stack.extend(self.children[node])
+
+        self.starts = np.array(starts, dtype=int)
+        self.ends = np.array(ends, dtype=int)
+        self.lower = np.reshape(lower, (-1, 3))
+        self.upper = np.reshape(upper, (-1, 3))
+
+    def diameter(self, node):
+        """
+        Returns the diagonal of the bounding box of the cluster `node`.
+        :param int node: the cluster.
+        :rtype: float
+        """
+        return np.linalg.norm(self.upper[node] - self.lower[node])
+
+
+class HMatrix(object):
+    """
+    Class that handles the hierarchical approximation of the matrix
+    :math:`K_{ij} = k(x_i, y_j)` between two sets of points.
+    :param ClusterTree row_tree: the cluster tree of the points of the rows.
+    :param ClusterTree column_tree: the cluster tree of the points of the
+        columns.
+    :param callable kernel: a function that takes two arrays of points and
+        returns the matrix of the kernel between them.
+    :param float tolerance: the relative tolerance of the low rank
+        approximations. Default is 1e-6.
+    :param float eta: the admissibility parameter. Default is 2.
+    :param bool store_near: if False the dense blocks are not stored but
+        computed at each product, and the far blocks too small to be
+        compressed with partial pivoting are treated as dense: this saves the
+        memory and the time of a matrix used for a single product. Default
+        is True.
+    :cvar tuple shape: the shape of the matrix.
+    :cvar list near: the dense blocks of near clusters, as tuples (row start,
+        row end, column start, column end, block) in the ordering of the
+        trees; the block is None if it is not stored.
+    :cvar list far: the low rank blocks, as tuples (row start, row end,
+        column start, column end, U, V) in the ordering of the trees.
+    :Example:
+    >>> from scipy.spatial.distance import cdist
+    >>> tree = ClusterTree(points)
+    >>> kernel = lambda x, y: np.sqrt(cdist(x, y)**2 + 1.)
+    >>> matrix = HMatrix(tree, tree, kernel, tolerance=1e-8)
+    >>> values = matrix.dot(weights)
+    """
+
+    def __init__(self,
+                 row_tree,
+                 column_tree,
+                 kernel,
+                 tolerance=1e-6,
+                 eta=2.,
+                 store_near=True):
+        self.row_tree = row_tree
+        self.column_tree = column_tree
+        self.kernel = kernel
+        self.tolerance = tolerance
+        self.shape = (row_tree.points.shape[0], column_tree.points.shape[0])
+        self.near = []
+        self.far = []
+
+        stack = [(0, 0)] if self.shape[0] and self.shape[1] else []
+        while stack:
+            row, column = stack.pop()
+            row_children = row_tree.children[row]
+            column_children = column_tree.children[column]
+            rows = row_tree.indices[row_tree.starts[row]:row_tree.ends[row]]
+            columns = column_tree.indices[column_tree.starts[column]:
+                                          column_tree.ends[column]]
+
+            bounds = (row_tree.starts[row], row_tree.ends[row],
+                      column_tree.starts[column], column_tree.ends[column])
+            if self._admissible(row, column, eta):
+                if store_near or \
+                        rows.shape[0] * columns.shape[0] > _SMALL_BLOCK:
+                    approximation = self._aca(rows, columns)
+                    if approximation is not None:
+                        self.far.append(bounds + approximation)
+                        continue
+            elif row_children and column_children:
+                stack.extend((r, c) for r in row_children
+                             for c in column_children)
+                continue
+            elif row_children:
+                stack.extend((r, column) for r in row_children)
+                continue
+            elif column_children:
+                stack.extend((row, c) for c in column_children)
+                continue
+
+            block = kernel(row_tree.points[rows],
+                           column_tree.points[columns]) if store_near else None
+            self.near.append(bounds + (block, ))
+
+    def _admissible(self, row, column, eta):
+        """
+        Tells if the clusters `row` and `column` are far enough to be
+        approximated with low rank.
+        """
+        gap = np.maximum(
+            0.,
+            np.maximum(
+                self.column_tree.lower[column] - self.row_tree.upper[row],
+                self.row_tree.lower[row] - self.column_tree.upper[column]))
+        return max(self.row_tree.diameter(row),
+                   self.column_tree.diameter(column)) <= eta * np.linalg.norm(
+                       gap)
+
+    def _aca(self, rows, columns):
+        """
+        Adaptive cross approximation with partial pivoting of the block
+        between the points `rows` and `columns`; the small blocks are
+        compressed with full pivoting.
+        :return: U, V: the `n_rows`-by-`rank` and `rank`-by-`n_columns`
+            factors, or None if the low rank form is not smaller than the
+            dense block.
+        :rtype: tuple
+        """
+        row_points = self.row_tree.points[rows]
+        column_points = self.column_tree.points[columns]
+        n_rows, n_columns = rows.shape[0], columns.shape[0]
+        max_rank = n_rows * n_columns // (n_rows + n_columns)
+        if n_rows * n_columns <= _SMALL_BLOCK:
+            return self._full_aca(
+                self.kernel(row_points, column_points), max_rank)
+
+        U = np.zeros((max_rank, n_rows))
+        V = np.zeros((max_rank, n_columns))
+        available = np.ones(n_rows, dtype=bool)
+        norm2 = 0.
+        pivot = 0
+        for rank in range(max_rank):
+            available[pivot] = False
+            row = self.kernel(row_points[pivot:pivot + 1], column_points)[0]
+            row -= np.dot(U[:rank, pivot], V[:rank])
+            column = np.argmax(np.abs(row))
+            if row[column] == 0.:
+                if not available.any():
+                    return U[:rank].T, V[:rank]
+                pivot = np.flatnonzero(available)[0]
+                continue
+            V[rank] = row / row[column]
+            U[rank] = self.kernel(row_points,
+                                  column_points[column:column + 1])[:, 0]
+            U[rank] -= np.dot(V[:rank, column], U[:rank])
+
+            # Frobenius norm of the approximation, updated with the new cross
+            step2 = np.dot(U[rank], U[rank]) * np.dot(V[rank], V[rank])
+            norm2 += step2 + 2. * np.dot(
+                np.dot(U[:rank], U[rank]), np.dot(V[:rank], V[rank]))
+            if step2 <= self.tolerance**2 * norm2:
+                return U[:rank + 1].T, V[:rank + 1]
+            if not available.any():
+                return U[:rank + 1].T, V[:rank + 1]
+            pivot = np.argmax(np.where(available, np.abs(U[rank]), -1.))
+        return None
+
+    def _full_aca(self, block, max_rank):
+        """
+        Adaptive cross approximation with full pivoting of `block`: the exact
+        residual is updated at each step.
+        :return: U, V: the `n_rows`-by-`rank` and `rank`-by-`n_columns`
+            factors, or None if the rank is larger than `max_rank`.
+        :rtype: tuple
+        """
+        residual = np.array(block, dtype=float)
+        threshold = self.tolerance**2 * np.vdot(residual, residual)
+        U = np.zeros((max_rank, residual.shape[0]))
+        V = np.zeros((max_rank, residual.shape[1]))
+        for rank in range(max_rank):
+            row, column = np.unravel_index(
+                np.argmax(np.abs(residual)), residual.shape)
+            if residual[row, column] == 0.:
+                return U[:rank].T, V[:rank]
+            U[rank] = residual[:, column]
+            V[rank] = residual[row] / residual[row, column]
+            residual -= np.outer(U[rank], V[rank])
+            if np.vdot(residual, residual) <= threshold:
+                return U[:rank + 1].T, V[:rank + 1]
+        return None
+
+    def dot(self, x):
+        """
+        Returns the product of the matrix and `x`.
+        :param numpy.ndarray x: a vector with `n_columns` elements or an
+            `n_columns`-by-`m` matrix.
+        :rtype: numpy.ndarray
+        """
+        x = np.asarray(x, dtype=float)
+        permuted = x[self.column_tree.indices]
+        product = np.zeros((self.shape[0], ) + x.shape[1:])
+        for row_start, row_end, column_start, column_end, block in self.near:
+            if block is None:
+                block = self.kernel(
+                    self.row_tree.points[
+                        self.row_tree.indices[row_start:row_end]],
+                    self.column_tree.points[
+                        self.column_tree.indices[column_start:column_end]])
+            product[row_start:row_end] += np.dot(
+                block, permuted[column_start:column_end])
+        for row_start, row_end, column_start, column_end, U, V in self.far:
+            product[row_start:row_end] += np.dot(
+                U, np.dot(V, permuted[column_start:column_end]))
+        result = np.empty_like(product)
+        result[self.row_tree.indices] = product
+        return result
+
+    def memory(self):
+        """
+        Returns the number of stored values, to compare with the
+        `n_rows` * `n_columns` values of the dense matrix.
+        :rtype: int
+        """
+        return sum(block.size for __, __, __, __, block in self.near
+                   if block is not None) + sum(
+            U.size + V.size for __, __, __, __, U, V in self.far)
+
+    def cardinal_preconditioner(self,
+                                block_size=128,
+                                overlap=64,
+                                max_condition=1e10):
+        """
+        Returns the approximate cardinal functions preconditioner of a
+        square RBF matrix with the same tree for rows and columns and with a
+        polynomial term of degree one. The points are split in the largest
+        clusters with at most `block_size` points; each cluster is extended
+        with the `overlap` nearest neighbors of its points, the local
+        interpolation system with the polynomial term is solved and the rows
+        of the points of the cluster are kept.
+
+        The local systems are solved in the space orthogonal to the local
+        polynomials, spanned by the points except four that determine the
+        polynomials, where the basis matrix is definite and is factorized
+        with Cholesky. Flat bases, e.g. a multiquadric with a radius
+        comparable with the size of the domain, give local systems that are
+        numerically singular: their cardinal functions are meaningless, so
+        no preconditioner is returned.
+        :param int block_size: the maximum number of points of a cluster.
+            Default is 128.
+        :param int overlap: the number of neighbors of each point added to
+            its cluster. Default is 64.
+        :param float max_condition: the largest condition number of a local
+            system. Default is 1e10.
+        :return: the preconditioner, or None if a local system is not
+            definite or its condition number exceeds `max_condition`.
+        :rtype: scipy.sparse.csr_matrix
+        """
+        if self.row_tree is not self.column_tree:
+            raise ValueError(
+                'The preconditioner needs a square matrix with the same '
+                'cluster tree for rows and columns.')
+        tree = self.row_tree
+        overlap = min(overlap, self.shape[0])
+        neighbors = cKDTree(tree.points).query(tree.points, overlap)[1] \
+            if overlap > 1 else None
+        rows, columns, values = [], [], []
+        stack = [0] if self.shape[0] else []
+        while stack:
+            node = stack.pop()
+            if tree.ends[node] - tree.starts[node] > block_size and \
+                    tree.children[node]:
+                stack.extend(tree.children[node])
+                continue
+            owned = tree.indices[tree.starts[node]:tree.ends[node]]
+            indices = owned if neighbors is None else np.union1d(
+                owned, neighbors[owned])
+            keep = np.isin(indices, owned)
+            cardinal = self._local_cardinal(indices, keep, max_condition)
+            if cardinal is None:
+                return None
+            rows.append(np.repeat(indices[keep], indices.shape[0]))
+            columns.append(np.tile(indices, owned.shape[0]))
+            values.append(cardinal.ravel())
+        return sparse.csr_matrix(
+            (np.concatenate(values),
+             (np.concatenate(rows), np.concatenate(columns))),
+            shape=self.shape)
+
+    def _local_cardinal(self, indices, keep, max_condition):
+        """
+        Returns the rows `keep` of the basis block of the inverse of the
+        local interpolation system of the points `indices`, with the
+        polynomial term of degree one, or None if the system is too ill
+        conditioned.
+        :param numpy.ndarray indices: the points of the local system, sorted.
+        :param numpy.ndarray keep: the mask of the rows kept.
+        :param float max_condition: the largest condition number allowed.
+        :rtype: numpy.ndarray
+        """
+        points = self.row_tree.points[indices]
+        n_points = indices.shape[0]
+        if n_points <= 4:
+            return None
+        polynomial = np.hstack((np.ones((n_points, 1)), points))
+        # the four points that determine the linear polynomials best; the
+        # null space of the transposed polynomial matrix is spanned by the
+        # columns of the identity of the other points, corrected on them
+        pivots = linalg.qr(polynomial.T, mode='r', pivoting=True)[1]
+        fixed, free = pivots[:4], pivots[4:]
+        correction = -linalg.solve(polynomial[fixed].T, polynomial[free].T)
+
+        kernel = self.kernel(points, points)
+        mixed = np.dot(kernel[np.ix_(free, fixed)], correction)
+        gram = kernel[np.ix_(free, free)] + mixed + mixed.T + np.dot(
+            correction.T, np.dot(kernel[np.ix_(fixed, fixed)], correction))
+        sign = 1. if np.trace(gram) >= 0. else -1.
+        gram *= sign
+        try:
+            factor = linalg.cho_factor(gram)
+        except linalg.LinAlgError:
+            return None
+        rcond = linalg.lapack.dpocon(factor[0],
+                                     np.abs(gram).sum(axis=0).max(),
+                                     uplo='L' if factor[1] else 'U')[0]
+        if rcond * max_condition < 1.:
+            return None
+
+        # the rows of the null space basis of the points kept
+        position = np.empty(n_points, dtype=int)
+        position[pivots] = np.arange(n_points)
+        position = position[keep]
+        rhs = np.zeros((n_points - 4, position.shape[0]))
+        is_free = position >= 4
+        rhs[position[is_free] - 4, np.flatnonzero(is_free)] = 1.
+        rhs[:, ~is_free] = correction[position[~is_free]].T
+        solution = linalg.cho_solve(factor, rhs)
+        cardinal = np.empty((n_points, solution.shape[1]))
+        cardinal[free] = solution
+        cardinal[fixed] = np.dot(correction, solution)
+        return sign * cardinal.T
@@ -29,9 +29,21 @@ computed value than those lying closer to the node.
     :math:`\\mathrm{x}_i` and :math:`p` is a power parameter, typically equal to
     2.
 """
+import hashlib
+
 import numpy as np
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist
 
+from pygem.tiled import TiledExecutor
+
+# metrics of cdist equal to the minkowski distance of a given order
+_METRICS = {
+    1: ('cityblock', {}),
+    2: ('euclidean', {}),
+    np.inf: ('chebyshev', {}),
+}
+
 
 class IDW(object):
     """
@@ -46,6 +58,9 @@ class IDW(object):
         points of the mesh.
     :cvar numpy.ndarray modified_mesh_points: coordinates of the deformed
         points of the mesh.
+    :cvar scipy.spatial.cKDTree tree: the KD-tree of the original control
+        points, built by `perform_local` when first needed and rebuilt when
+        the control points change.
     :Example:
     >>> from pygem.idw import IDW
     >>> from pygem.params_idw import IDWParameters
@@ -69,36 +84,136 @@ class IDW(object):
         self.parameters = idw_parameters
         self.original_mesh_points = original_mesh_points
         self.modified_mesh_points = None
+        self.tree = None
+        self._tree_key = None
 
-    def perform(self):
+    def perform(self, chunk_size=None, executor=None):
         """
         This method performs the deformation of the mesh points. After the
-        execution it sets `self.modified_mesh_points`.
+        execution it sets `self.modified_mesh_points`. The points are deformed
+        in tiles, run in parallel by the `executor`: the distances of a tile
+        from the control points are computed by `cdist` in a buffer of its
+        thread, reused for the following tiles, and turned in place into the
+        weights, so the displacements of a tile are a single matrix product.
+        :param int chunk_size: number of points of a tile. Default is None,
+            that is about four millions of distances for each tile.
+        :param TiledExecutor executor: the executor of the tiles. Default is
+            None, that is a single thread.
         """
-
-        def distance(u, v):
-            """
-            Norm of u - v
-            """
-            return np.linalg.norm(u - v, ord=self.parameters.power)
+        executor = TiledExecutor() if executor is None else executor
+        control_points = np.asarray(self.parameters.original_control_points,
+                                    dtype=float)
+        mesh_points = np.asarray(self.original_mesh_points, dtype=float)
+        n_points = mesh_points.shape[0]
+        n_controls = control_points.shape[0]
+        if chunk_size is None:
+            chunk_size = max(1, 2**22 // n_controls)
 
         # Compute displacement of the control points
-        displ = (self.parameters.deformed_control_points -
-                 self.parameters.original_control_points)
+        displ = (np.asarray(self.parameters.deformed_control_points,
+                            dtype=float) - control_points)
+
+        # the norm of order `power`, with the faster metrics when possible
+        power = self.parameters.power
+        metric, options = _METRICS.get(power, ('minkowski', {'p': power}))
+
+        self.modified_mesh_points = np.empty(
+            (n_points, displ.shape[1]), dtype=float)
+
+        def kernel(start, stop):
+            points = mesh_points[start:stop]
+            weights = executor.buffer((stop - start, n_controls))
+            cdist(points, control_points, metric, out=weights, **options)
+
+            # Weights are set as the reciprocal of the distance if the
+            # distance is not zero, otherwise 1.0 where distance is zero.
+            hits = np.flatnonzero(weights.min(axis=1) == 0.)
+            exact = weights[hits] == 0.
+            with np.errstate(divide='ignore'):
+                np.reciprocal(weights, out=weights)
+            weights[hits] = exact
+
+            result = self.modified_mesh_points[start:stop]
+            np.dot(weights, displ, out=result)
+            result /= weights.sum(axis=1)[:, np.newaxis]
+            result += points
+
+        executor.run(kernel, n_points, chunk_size)
+
+    def perform_local(self, k=8, radius=None, chunk_size=2**16,
+                      executor=None):
+        """
+        This method performs the deformation of the mesh points using, for
+        each point, only its `k` nearest control points, optionally within
+        `radius`, found with a KD-tree on all the cores: by the `executor`,
+        or by the queries themselves if it has a single thread. The memory is
+        O(`chunk_size` `k`) and the cost O(`n_points` log `n_control_points`),
+        so it suits sets of many control points. After the execution it sets
+        `self.modified_mesh_points`; the points with no control point within
+        `radius` are not moved.
+        :param int k: the number of nearest control points of each point.
+            Default is 8.
+        :param float radius: the maximum distance of the control points used.
+            Default is None, that is no limit.
+        :param int chunk_size: number of points queried at once. Default is
+            65536.
+        :param TiledExecutor executor: the executor of the chunks. Default is
+            None, that is a single thread.
+        :raises ValueError: if the power is below 1, since the KD-tree needs
+            a norm; `perform` accepts it.
+        """
+        power = self.parameters.power
+        if not power >= 1:
+            raise ValueError(
+                'perform_local needs a power of at least 1, not {0!s}: the '
+                'KD-tree needs a norm. Use perform instead.'.format(power))
+        executor = TiledExecutor() if executor is None else executor
+        control_points = np.ascontiguousarray(
+            self.parameters.original_control_points, dtype=float)
+        mesh_points = np.asarray(self.original_mesh_points, dtype=float)
+        n_points = mesh_points.shape[0]
+        n_controls = control_points.shape[0]
+        k = min(k, n_controls)
+        key = (control_points.shape, hashlib.sha1(control_points).hexdigest())
+        if self.tree is None or self._tree_key != key:
+            self.tree = cKDTree(control_points)
+            self._tree_key = key
+
+        # Compute displacement of the control points, with a null one for the
+        # missing neighbours, whose index is `n_controls`
+        displ = (np.asarray(self.parameters.deformed_control_points,
+                            dtype=float) - control_points)
+        displ = np.vstack((displ, np.zeros((1, displ.shape[1]))))
+
+        self.modified_mesh_points = np.empty(
+            (n_points, displ.shape[1]), dtype=float)
+        workers = -1 if executor.n_threads == 1 else 1
 
-        # Compute the distance between the mesh points and the control points
-        dist = cdist(self.original_mesh_points,
-                     self.parameters.original_control_points, distance)
+        def kernel(start, stop):
+            points = mesh_points[start:stop]
+            dist, neighbours = self.tree.query(
+                points,
+                k=k,
+                p=power,
+                distance_upper_bound=np.inf if radius is None else radius,
+                workers=workers)
+            dist = dist.reshape(points.shape[0], k)
+            neighbours = neighbours.reshape(points.shape[0], k)
 
-        # Weights are set as the reciprocal of the distance if the distance is
-        # not zero, otherwise 1.0 where distance is zero.
-        weights = np.zeros(dist.shape)
-        for i, d in enumerate(dist):
-            weights[i] = 1. / d if d.all() else np.where(d == 0.0, 1.0, 0.0)
+            # Weights are set as the reciprocal of the distance if the
+            # distance is not zero, otherwise 1.0 where distance is zero; the
+            # missing neighbours are at infinite distance, so their weight is
+            # zero.
+            hits = np.flatnonzero(dist[:, 0] == 0.)
+            exact = dist[hits] == 0.
+            with np.errstate(divide='ignore'):
+                weights = np.reciprocal(dist, out=dist)
+            weights[hits] = exact
 
-        offset = np.array([
-            np.sum(displ * wi[:, np.newaxis] / np.sum(wi), axis=0)
-            for wi in weights
-        ])
+            result = self.modified_mesh_points[start:stop]
+            np.einsum('ij,ijk->ik', weights, displ[neighbours], out=result)
+            total = weights.sum(axis=1)[:, np.newaxis]
+            np.divide(result, total, out=result, where=total > 0.)
+            result += points
 
-        self.modified_mesh_points = self.original_mesh_points + offset
+        executor.run(kernel, n_points, chunk_size)
@@ -1,9 +1,6 @@
 """
 Derived module from filehandler.py to handle iges and igs files.
 """
-from OCC.IGESControl import (IGESControl_Reader, IGESControl_Writer,
-                             IGESControl_Controller_Init)
-from OCC.IFSelect import IFSelect_RetDone
 from pygem.nurbshandler import NurbsHandler
 
 
@@ -38,6 +35,9 @@ class IgesHandler(NurbsHandler):
         :return: shape: loaded shape
         :rtype: TopoDS_Shape
         """
+        from OCC.IGESControl import IGESControl_Reader
+        from OCC.IFSelect import IFSelect_RetDone
+
         self._check_filename_type(filename)
         self._check_extension(filename)
         reader = IGESControl_Reader()
@@ -58,6 +58,9 @@ class IgesHandler(NurbsHandler):
         :param string filename: name of the input file.
             It should have proper extension (.iges or .igs)
         """
+        from OCC.IGESControl import (IGESControl_Writer,
+                                     IGESControl_Controller_Init)
+
         self._check_filename_type(filename)
         self._check_extension(filename)
         IGESControl_Controller_Init()
@@ -1,8 +1,14 @@
 """
 Derived module from filehandler.py to handle LS-DYNA keyword (.k) files.
 """
-import numpy as np
+import io
+import os
+import shutil
 import pygem.filehandler as fh
+from pygem.sectionindex import SectionIndex, split_lines, copy_range
+
+# number of bytes compared to tell if a file is a copy of the input deck
+HEADER_SIZE = 512
 
 
 class KHandler(fh.FileHandler):
@@ -12,74 +18,277 @@ class KHandler(fh.FileHandler):
     :cvar string outfile: name of the output file where to write in.
     :cvar list extensions: extensions of the input/output files. It is equal
             to '.k'.
+    :cvar numpy.ndarray node_ids: the IDs of the nodes read by the parse
+            method.
+    :cvar SectionIndex index: the byte offsets of the keyword sections and
+            of the node lines of the input file.
     """
 
     def __init__(self):
         super(KHandler, self).__init__()
         self.extensions = ['.k']
+        self.node_ids = None
+        self.index = None
 
     def parse(self, filename):
         """
         Method to parse the file `filename`. It returns a matrix with all the
-        coordinates. It reads only the section *NODE of the k files.
+        coordinates. It reads only the section *NODE of the k files: the
+        blocks are located through the section index of the file and the
+        fixed-width coordinate fields of all the nodes are converted
+        together. The node IDs are stored in `self.node_ids`.
         :param string filename: name of the input file.
         :return: mesh_points: it is a `n_points`-by-3 matrix containing the
                 coordinates of the points of the mesh.
         :rtype: numpy.ndarray
         """
+        import numpy as np
         self._check_filename_type(filename)
         self._check_extension(filename)
         self.infile = filename
-        index = -9
-        mesh_points = []
-        with open(self.infile, 'r') as input_file:
-            for num, line in enumerate(input_file):
-                if line.startswith('*NODE'):
-                    index = num
-                if num == index + 1:
-                    if line.startswith('$'):
-                        index = num
-                    elif line.startswith('*'):
-                        index = -9
-                    else:
-                        l = []
-                        l.append(float(line[8:24]))
-                        l.append(float(line[24:40]))
-                        l.append(float(line[40:56]))
-                        mesh_points.append(l)
-                        index = num
-            mesh_points = np.array(mesh_points)
+        self.index = self._load_index(self.infile)
+        node_starts = self.index.arrays['node_starts']
+        blocks = [np.zeros((0, 56), dtype=np.uint8)]
+        with open(self.infile, 'rb') as input_file:
+            for start, end in self.index.find('*NODE'):
+                rows = node_starts[(node_starts >= start) & (node_starts < end)]
+                input_file.seek(start)
+                block = np.frombuffer(input_file.read(end - start),
+                                      dtype=np.uint8)
+                blocks.append(self._node_fields(block, rows - start))
+        fields = np.concatenate(blocks)
+        self.node_ids = np.ascontiguousarray(fields[:, :8]).view('S8')[:, 0].astype(
+            np.int64)
+        mesh_points = np.ascontiguousarray(fields[:, 8:]).view('S16').astype(
+            np.float64)
         return mesh_points
 
     def write(self, mesh_points, filename):
         """
         Writes a .k file, called filename, copying all the lines from
         self.filename but the coordinates. mesh_points is a matrix that
-        contains the new coordinates to write in the .k file.
+        contains the new coordinates to write in the .k file. The bytes
+        outside the *NODE sections are copied as they are.
         :param numpy.ndarray mesh_points: it is a `n_points`-by-3 matrix
                           containing the coordinates of the points of the mesh
         :param string filename: name of the output file.
         """
+        import numpy as np
+        from numpy.lib.stride_tricks import as_strided
         self._check_filename_type(filename)
         self._check_extension(filename)
         self._check_infile_instantiation()
         self.outfile = filename
-        index = -9
-        i = 0
-        with open(self.outfile, 'w') as output_file:
-            with open(self.infile, 'r') as input_file:
-                for num, line in enumerate(input_file):
-                    if line.startswith('*NODE'):
-                        index = num
-                    if num == index + 1:
-                        if line.startswith('$'):
-                            index = num
-                        elif line.startswith('*'):
-                            index = -9
-                        else:
-                            for j in range(0, 3):
-                                line = line[:8 + 16 * (j)] + '{:16.10f}'.format(
-                                    mesh_points[i][j]) + line[8 + 16 * (j + 1):]
-                            i += 1
-                            index = num
-                    output_file.write(line)
+        if self.index is None or self.index.filename != self.infile:
+            self.index = self._load_index(self.infile)
+        node_starts = self.index.arrays['node_starts']
+        if len(mesh_points) != node_starts.size:
+            raise ValueError(
+                'The k file has {0!s} nodes, {1!s} points were given.'.format(
+                    node_starts.size, len(mesh_points)))
+        fields = self._format_coordinates(mesh_points)
+
+        if os.path.isfile(self.outfile) and os.path.samefile(
+                self.infile, self.outfile):
+            with open(self.infile, 'rb') as input_file:
+                input_file = io.BytesIO(input_file.read())
+        else:
+            input_file = open(self.infile, 'rb')
+
+        position = 0
+        with input_file, open(self.outfile, 'wb') as output_file:
+            for start, end in self.index.find('*NODE'):
+                mask = (node_starts >= start) & (node_starts < end)
+                copy_range(input_file, output_file, position, start)
+                input_file.seek(start)
+                block = np.frombuffer(input_file.read(end - start),
+                                      dtype=np.uint8).copy()
+                lines = as_strided(block, shape=(max(block.size - 55, 0), 56),
+                                   strides=(1, 1))
+                lines[node_starts[mask] - start, 8:] = fields[mask]
+                output_file.write(block.tobytes())
+                position = end
+            copy_range(input_file, output_file, position, self.index.size)
+
+    def write_inplace(self, mesh_points, filename):
+        """
+        Writes the coordinates in the .k file called filename by overwriting
+        only their 16 character fields through a memory map; the rest of the
+        file is not touched. If filename is not a copy of self.infile, that is
+        if it does not exist, or its size, its first bytes or the IDs of the
+        nodes at the offsets of the index differ, self.infile is copied there
+        first: writing many variants of the same deck to the same filename
+        costs a number of bytes proportional to the nodes, not to the file.
+        With filename equal to self.infile the input file itself is patched.
+        :param numpy.ndarray mesh_points: it is a `n_points`-by-3 matrix
+                          containing the coordinates of the points of the mesh
+        :param string filename: name of the output file.
+        """
+        import numpy as np
+        from numpy.lib.stride_tricks import as_strided
+        self._check_infile_instantiation()
+        self._check_filename_type(filename)
+        self._check_extension(filename)
+        self.outfile = filename
+        if self.index is None or self.index.filename != self.infile:
+            self.index = self._load_index(self.infile)
+        node_starts = self.index.arrays['node_starts']
+        if len(mesh_points) != node_starts.size:
+            raise ValueError(
+                'The k file has {0!s} nodes, {1!s} points were given.'.format(
+                    node_starts.size, len(mesh_points)))
+        fields = self._format_coordinates(mesh_points)
+
+        patch_input = os.path.isfile(self.outfile) and os.path.samefile(
+            self.infile, self.outfile)
+        if not patch_input and not self._is_copy(self.outfile):
+            shutil.copyfile(self.infile, self.outfile)
+
+        if node_starts.size:
+            buffer = np.memmap(self.outfile, dtype=np.uint8, mode='r+')
+            lines = as_strided(buffer, shape=(buffer.size - 55, 56),
+                               strides=(1, 1))
+            lines[node_starts, 8:] = fields
+            buffer.flush()
+            del lines, buffer
+
+        if patch_input:
+            # the offsets did not move, the index is still valid
+            stat = os.stat(self.infile)
+            self.index.size, self.index.mtime = stat.st_size, stat.st_mtime
+            self.index.save()
+
+    def _is_copy(self, filename):
+        """
+        This private method tells if the file `filename` is a copy of
+        self.infile that differs at most in the coordinates of the nodes: it
+        has the same size, the same first bytes but the coordinates and the
+        same node IDs at the offsets of the index.
+        :param string filename: name of the file.
+        :rtype: bool
+        """
+        import numpy as np
+        if (not os.path.isfile(filename) or
+                os.path.getsize(filename) != self.index.size):
+            return False
+        if self.index.size == 0:
+            return True
+        node_starts = self.index.arrays['node_starts']
+        # the coordinates of the nodes among the first bytes may differ
+        header_size = min(HEADER_SIZE, self.index.size)
+        mask = np.ones(header_size, dtype=bool)
+        for start in node_starts[node_starts < header_size]:
+            mask[start + 8:start + 56] = False
+        fingerprints = []
+        for name in (self.infile, filename):
+            buffer = np.memmap(name, dtype=np.uint8, mode='r')
+            ids = self._node_fields(buffer, node_starts)[:, :8].copy()
+            fingerprints.append((buffer[:header_size][mask].tobytes(), ids))
+            del buffer
+        (header, ids), (other_header, other_ids) = fingerprints
+        return header == other_header and np.array_equal(ids, other_ids)
+
+    @classmethod
+    def _load_index(cls, filename):
+        """
+        This private class method returns the section index of the k file
+        `filename`, from its sidecar file if it is still valid, otherwise
+        building it and saving it for the next time.
+        :param string filename: name of the k file.
+        :return: index: the section index of the file.
+        :rtype: SectionIndex
+        """
+        import numpy as np
+        index = SectionIndex.load(filename)
+        if index is None or 'node_starts' not in index.arrays:
+            index = cls._build_index(
+                filename, np.fromfile(filename, dtype=np.uint8))
+            index.save()
+        return index
+
+    @staticmethod
+    def _build_index(filename, buffer):
+        """
+        This private static method indexes the keyword sections of a k file
+        and the byte offsets where the node lines start. Node lines are the
+        lines following a *NODE keyword up to the next keyword, except
+        comments ($) and blank lines.
+        :param string filename: name of the k file.
+        :param numpy.ndarray buffer: the bytes of the k file.
+        :return: index: the section index of the file.
+        :rtype: SectionIndex
+        """
+        import numpy as np
+        starts, lengths = split_lines(buffer)
+        first = np.where(lengths > 0,
+                         buffer[np.minimum(starts, max(buffer.size - 1, 0))], 0)
+
+        # the body of a keyword goes up to the next keyword, the keywords are
+        # few so they are named one by one; *NODE_SET and the other *NODE_...
+        # keywords are different sections
+        keyword_rows = np.flatnonzero(first == ord('*'))
+        next_rows = np.append(keyword_rows[1:], starts.size)
+        line_starts = np.append(starts, buffer.size)
+        names = []
+        in_node_block = np.zeros(starts.size, dtype=bool)
+        for row, next_row in zip(keyword_rows, next_rows):
+            keyword = buffer[starts[row]:starts[row] + lengths[row]].tobytes()
+            names.append(keyword.split()[0].upper().decode('ascii', 'replace'))
+            if names[-1] == '*NODE':
+                in_node_block[row + 1:next_row] = True
+
+        node_lines = in_node_block & (first != ord('$')) & (lengths > 0)
+        if np.any(lengths[node_lines] < 56):
+            raise ValueError(
+                'Node lines must have the three 16 character coordinates.')
+
+        index = SectionIndex(filename)
+        index.add_sections(
+            names,
+            np.column_stack((line_starts[keyword_rows + 1],
+                             line_starts[next_rows])),
+            next_rows - keyword_rows - 1)
+        index.arrays['node_starts'] = starts[node_lines]
+        return index
+
+    @staticmethod
+    def _node_fields(buffer, starts):
+        """
+        This private static method returns the first 56 characters (ID and
+        coordinates) of the node lines. The rows are picked from a sliding
+        window view of the file, without building an index per character.
+        :param numpy.ndarray buffer: the bytes of the k file.
+        :param numpy.ndarray starts: the offsets of the node lines.
+        :return: fields: `n_points`-by-56 array of characters.
+        :rtype: numpy.ndarray
+        """
+        import numpy as np
+        from numpy.lib.stride_tricks import as_strided
+        if buffer.size < 56:
+            return np.zeros((0, 56), dtype=np.uint8)
+        lines = as_strided(buffer, shape=(buffer.size - 55, 56), strides=(1, 1))
+        return lines[starts]
+
+    @staticmethod
+    def _format_coordinates(mesh_points, chunk_size=2**16):
+        """
+        This private static method formats the coordinates as the 16
+        character fields of the k files, `chunk_size` points at a time.
+        :param numpy.ndarray mesh_points: it is a `n_points`-by-3 matrix
+            containing the coordinates of the points of the mesh.
+        :param int chunk_size: number of points formatted at once.
+        :return: fields: `n_points`-by-48 array with the characters.
+        :rtype: numpy.ndarray
+        """
+        import numpy as np
+        mesh_points = np.asarray(mesh_points, dtype=np.float64)
+        fields = np.empty((mesh_points.shape[0], 48), dtype=np.uint8)
+        for start in range(0, mesh_points.shape[0], chunk_size):
+            chunk = mesh_points[start:start + chunk_size]
+            text = ('%16.10f' * chunk.size) % tuple(chunk.ravel().tolist())
+            if len(text) != 16 * chunk.size:
+                raise ValueError(
+                    'The coordinates do not fit the 16 character fields.')
+            fields[start:start + chunk.shape[0]] = np.frombuffer(
+                text.encode('ascii'), dtype=np.uint8).reshape(-1, 48)
+        return fields
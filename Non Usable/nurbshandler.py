@@ -5,32 +5,6 @@ File handling operations (reading/writing) must be implemented
 in derived classes.
 """
 import os
-import numpy as np
-from OCC.BRep import BRep_Tool, BRep_Builder, BRep_Tool_Curve
-from OCC.BRepAlgo import brepalgo_IsValid
-from OCC.BRepBuilderAPI import BRepBuilderAPI_MakeEdge
-from OCC.BRepBuilderAPI import BRepBuilderAPI_MakeFace
-from OCC.BRepBuilderAPI import BRepBuilderAPI_NurbsConvert
-from OCC.BRepBuilderAPI import BRepBuilderAPI_MakeWire
-from OCC.BRepBuilderAPI import BRepBuilderAPI_Sewing
-from OCC.BRepOffsetAPI import BRepOffsetAPI_FindContigousEdges
-from OCC.Display.SimpleGui import init_display
-from OCC.GeomConvert import geomconvert_SurfaceToBSplineSurface
-from OCC.GeomConvert import geomconvert_CurveToBSplineCurve
-from OCC.gp import gp_Pnt, gp_XYZ
-from OCC.Precision import precision_Confusion
-from OCC.ShapeAnalysis import ShapeAnalysis_WireOrder
-from OCC.ShapeFix import ShapeFix_ShapeTolerance, ShapeFix_Shell
-from OCC.StlAPI import StlAPI_Writer
-from OCC.TColgp import TColgp_Array1OfPnt, TColgp_Array2OfPnt
-from OCC.TopAbs import TopAbs_FACE, TopAbs_EDGE, TopAbs_WIRE
-from OCC.TopAbs import TopAbs_FORWARD, TopAbs_SHELL
-from OCC.TopExp import TopExp_Explorer, topexp
-from OCC.TopoDS import topods_Face, TopoDS_Compound, topods_Shell
-from OCC.TopoDS import topods_Edge, topods_Wire, topods, TopoDS_Shape
-from matplotlib import pyplot
-from mpl_toolkits import mplot3d
-from stl import mesh
 import pygem.filehandler as fh
 
 
@@ -95,6 +69,14 @@ class NurbsHandler(fh.FileHandler):
         :rtype: numpy.ndarray
 
         """
+        import numpy as np
+        from OCC.BRep import BRep_Tool
+        from OCC.BRepBuilderAPI import BRepBuilderAPI_NurbsConvert
+        from OCC.GeomConvert import geomconvert_SurfaceToBSplineSurface
+        from OCC.TopAbs import TopAbs_FACE
+        from OCC.TopExp import TopExp_Explorer
+        from OCC.TopoDS import topods_Face
+
         self.infile = filename
         self.shape = self.load_shape_from_file(filename)
 
@@ -159,6 +141,18 @@ class NurbsHandler(fh.FileHandler):
             and wires in the write function. If not given it uses
             `self.tolerance`.
         """
+        from OCC.BRep import BRep_Tool, BRep_Builder
+        from OCC.BRepBuilderAPI import (BRepBuilderAPI_MakeEdge,
+                                        BRepBuilderAPI_MakeFace,
+                                        BRepBuilderAPI_NurbsConvert,
+                                        BRepBuilderAPI_MakeWire)
+        from OCC.GeomConvert import geomconvert_SurfaceToBSplineSurface
+        from OCC.gp import gp_Pnt, gp_XYZ
+        from OCC.ShapeFix import ShapeFix_ShapeTolerance
+        from OCC.TopAbs import TopAbs_FACE, TopAbs_EDGE
+        from OCC.TopExp import TopExp_Explorer
+        from OCC.TopoDS import topods_Face, TopoDS_Compound, topods_Edge
+
         self._check_filename_type(filename)
         self._check_extension(filename)
         self._check_infile_instantiation()
@@ -243,6 +237,9 @@ class NurbsHandler(fh.FileHandler):
         1: 1 solid = 0 shell = n free faces
         2: 1 solid = n shell = n faces (1 shell = 1 face)
         """
+        from OCC.TopAbs import TopAbs_FACE, TopAbs_SHELL
+        from OCC.TopExp import TopExp_Explorer
+
         # read shells and faces
         shells_explorer = TopExp_Explorer(self.shape, TopAbs_SHELL)
         n_shells = 0
@@ -286,6 +283,16 @@ class NurbsHandler(fh.FileHandler):
         :rtype: tuple(numpy.ndarray, list)
 
         """
+        import numpy as np
+        from OCC.BRep import BRep_Tool, BRep_Tool_Curve
+        from OCC.BRepBuilderAPI import BRepBuilderAPI_NurbsConvert
+        from OCC.GeomConvert import (geomconvert_SurfaceToBSplineSurface,
+                                     geomconvert_CurveToBSplineCurve)
+        from OCC.TColgp import TColgp_Array1OfPnt, TColgp_Array2OfPnt
+        from OCC.TopAbs import TopAbs_EDGE, TopAbs_WIRE
+        from OCC.TopExp import TopExp_Explorer
+        from OCC.TopoDS import topods_Edge, topods_Wire, topods
+
         # get some Face - Edge - Vertex data map information
         mesh_points_edge = []
         face_exp_wire = TopExp_Explorer(topo_face, TopAbs_WIRE)
@@ -369,6 +376,10 @@ class NurbsHandler(fh.FileHandler):
         :rtype: a list of shells
 
         """
+        from OCC.TopAbs import TopAbs_FACE, TopAbs_SHELL
+        from OCC.TopExp import TopExp_Explorer
+        from OCC.TopoDS import topods
+
         self.infile = filename
         self.shape = self.load_shape_from_file(filename)
 
@@ -427,6 +438,13 @@ class NurbsHandler(fh.FileHandler):
         :rtype: TopoDS_Edge
 
         """
+        from OCC.BRep import BRep_Tool
+        from OCC.BRepBuilderAPI import (BRepBuilderAPI_MakeEdge,
+                                        BRepBuilderAPI_NurbsConvert)
+        from OCC.GeomConvert import geomconvert_CurveToBSplineCurve
+        from OCC.gp import gp_Pnt
+        from OCC.TopoDS import topods_Edge
+
         # convert Edge to Geom B-spline Curve
         nurbs_converter = BRepBuilderAPI_NurbsConvert(topo_edge)
         nurbs_converter.Perform(topo_edge)
@@ -466,6 +484,19 @@ class NurbsHandler(fh.FileHandler):
         :rtype: TopoDS_Shape
 
         """
+        import numpy as np
+        from OCC.BRep import BRep_Tool
+        from OCC.BRepBuilderAPI import (BRepBuilderAPI_MakeFace,
+                                        BRepBuilderAPI_NurbsConvert,
+                                        BRepBuilderAPI_MakeWire)
+        from OCC.GeomConvert import geomconvert_SurfaceToBSplineSurface
+        from OCC.gp import gp_Pnt
+        from OCC.Precision import precision_Confusion
+        from OCC.ShapeAnalysis import ShapeAnalysis_WireOrder
+        from OCC.ShapeFix import ShapeFix_ShapeTolerance
+        from OCC.TopAbs import TopAbs_EDGE, TopAbs_WIRE, TopAbs_FORWARD
+        from OCC.TopExp import TopExp_Explorer, topexp
+        from OCC.TopoDS import topods_Edge, topods_Wire, topods
 
         # convert Face to Geom B-spline Surface
         nurbs_converter = BRepBuilderAPI_NurbsConvert(topo_face)
@@ -573,6 +604,13 @@ class NurbsHandler(fh.FileHandler):
         :param sew_tolerance: tolerance for sewing
         :return: Topo_Shell
         """
+        from OCC.BRepAlgo import brepalgo_IsValid
+        from OCC.BRepBuilderAPI import BRepBuilderAPI_Sewing
+        from OCC.BRepOffsetAPI import BRepOffsetAPI_FindContigousEdges
+        from OCC.ShapeFix import ShapeFix_Shell
+        from OCC.TopAbs import TopAbs_FACE
+        from OCC.TopExp import TopExp_Explorer
+        from OCC.TopoDS import topods
 
         offsew = BRepOffsetAPI_FindContigousEdges(sew_tolerance)
         sew = BRepBuilderAPI_Sewing(sew_tolerance)
@@ -600,15 +638,13 @@ class NurbsHandler(fh.FileHandler):
         if shell_fixer.Perform():
             print("{} shells fixed! ".format(shell_fixer.NbShells()))
         else:
-            print "Shells not fixed! "
-
+            print("Shells not fixed! ")
         new_shell = shell_fixer.Shell()
 
         if brepalgo_IsValid(new_shell):
-            print "Shell valid! "
+            print("Shell valid! ")
         else:
-            print "Shell failed! "
-
+            print("Shell failed! ")
         return new_shell
 
     def write_shape(self, l_shells, filename, tol):
@@ -623,6 +659,12 @@ class NurbsHandler(fh.FileHandler):
         :return: None
 
         """
+        from OCC.BRep import BRep_Builder
+        from OCC.TopAbs import TopAbs_FACE, TopAbs_FORWARD, TopAbs_SHELL
+        from OCC.TopExp import TopExp_Explorer
+        from OCC.TopoDS import (TopoDS_Compound, topods_Shell, topods,
+                                TopoDS_Shape)
+
         self.outfile = filename
         # global compound containing multiple shells
         global_compound_builder = BRep_Builder()
@@ -663,8 +705,7 @@ class NurbsHandler(fh.FileHandler):
                 global_compound_builder.Add(global_comp, new_shell)
 
                 print("Shell {0} of type {1} Processed ".format(ishell, itype))
-                print "=============================================="
-
+                print("==============================================")
                 ishell += 1
                 shape_shells_explorer.Next()
 
@@ -695,8 +736,7 @@ class NurbsHandler(fh.FileHandler):
             global_compound_builder.Add(global_comp, new_shell)
 
             print("Shell {0} of type {1} Processed ".format(0, itype))
-            print "=============================================="
-
+            print("==============================================")
         self.write_shape_to_file(global_comp, self.outfile)
 
     def write_shape_to_file(self, shape, filename):
@@ -722,6 +762,12 @@ class NurbsHandler(fh.FileHandler):
             chosen geometry
         :rtype: matplotlib.pyplot.figure
         """
+        import numpy as np
+        from OCC.StlAPI import StlAPI_Writer
+        from matplotlib import pyplot
+        from mpl_toolkits import mplot3d
+        from stl import mesh
+
         if plot_file is None:
             shape = self.shape
             plot_file = self.infile
@@ -779,6 +825,8 @@ class NurbsHandler(fh.FileHandler):
 
         :param string show_file: the filename you want to show.
         """
+        from OCC.Display.SimpleGui import init_display
+
         if show_file is None:
             shape = self.shape
         else:
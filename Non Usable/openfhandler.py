@@ -1,10 +1,16 @@
 """
 Derived module from filehandler.py to handle OpenFOAM files.
 """
-import numpy as np
+import re
 import pygem.filehandler as fh
 
 
+_HEADER = re.compile(br'FoamFile\s*\{([^}]*)\}')
+_ENTRY = re.compile(br'(\w+)\s+("[^"]*"|[^;]*);')
+_COUNT = re.compile(br'(?m)^\s*(\d+)\s*\(')
+_LIST_END = re.compile(br'\)\s*\)')
+
+
 class OpenFoamHandler(fh.FileHandler):
     """
     OpenFOAM mesh file handler class.
@@ -12,75 +18,163 @@ class OpenFoamHandler(fh.FileHandler):
     :cvar string outfile: name of the output file where to write in.
     :cvar list extensions: extensions of the input/output files. It
         is equal to [''] since openFOAM files do not have extension.
+    :cvar dict header: the entries of the FoamFile header of the parsed
+        file, e.g. `format` and `arch`.
     """
 
     def __init__(self):
         super(OpenFoamHandler, self).__init__()
         self.extensions = ['']
+        self.header = {}
 
     def parse(self, filename):
         """
         Method to parse the `filename`. It returns a matrix with all
-        the coordinates.
+        the coordinates. The number of points is read after the FoamFile
+        header and the list is converted at once: the ascii format is
+        read with a single `numpy.fromstring` after removing the
+        parentheses, the binary format directly from the bytes according
+        to the `arch` entry of the header.
         :param string filename: name of the input file.
-        
+
         :return: mesh_points: it is a `n_points`-by-3 matrix containing
             the coordinates of the points of the mesh
         :rtype: numpy.ndarray
-        .. todo::
-            - specify when it works
         """
+        import numpy as np
         self._check_filename_type(filename)
         self._check_extension(filename)
 
         self.infile = filename
 
-        nrow = 0
-        i = 0
-        with open(self.infile, 'r') as input_file:
-            for line in input_file:
-                nrow += 1
-                if nrow == 19:
-                    n_points = int(line)
-                    mesh_points = np.zeros(shape=(n_points, 3))
-                if 20 < nrow < 21 + n_points:
-                    line = line[line.index("(") + 1:line.rindex(")")]
-                    j = 0
-                    for number in line.split():
-                        mesh_points[i][j] = float(number)
-                        j += 1
-                    i += 1
-
-        return mesh_points
+        with open(self.infile, 'rb') as input_file:
+            buffer = input_file.read()
+        self.header, n_points, start, end = self._locate_points(buffer)
+
+        if self.header.get('format') == 'binary':
+            mesh_points = np.frombuffer(
+                buffer,
+                dtype=self._scalar_type(self.header),
+                count=3 * n_points,
+                offset=start).astype(np.float64)
+        else:
+            mesh_points = np.fromstring(
+                buffer[start:end].translate(None, b'()'), sep=' ')
+            if mesh_points.size != 3 * n_points:
+                raise ValueError(
+                    'The file has {0!s} coordinates instead of {1!s}.'.format(
+                        mesh_points.size, 3 * n_points))
+
+        return mesh_points.reshape(n_points, 3)
 
     def write(self, mesh_points, filename):
         """
         Writes a openFOAM file, called filename, copying all the
         lines from self.filename but the coordinates. mesh_points
         is a matrix that contains the new coordinates to write in
-        the openFOAM file.
+        the openFOAM file. The coordinates are written in the format
+        (ascii or binary) of self.filename.
         :param numpy.ndarray mesh_points: it is a `n_points`-by-3
             matrix containing the coordinates of the points of the mesh.
         :param string filename: name of the output file.
-        .. todo:: DOCS
         """
+        import numpy as np
         self._check_filename_type(filename)
         self._check_extension(filename)
         self._check_infile_instantiation()
 
         self.outfile = filename
 
-        n_points = mesh_points.shape[0]
-        nrow = 0
-        i = 0
-        with open(self.infile, 'r') as input_file, open(self.outfile,
-                                                        'w') as output_file:
-            for line in input_file:
-                nrow += 1
-                if 20 < nrow < 21 + n_points:
-                    output_file.write('(' + str(mesh_points[i][0]) + ' ' + str(
-                        mesh_points[i][1]) + ' ' + str(mesh_points[i][2]) + ')')
-                    output_file.write('\n')
-                    i += 1
-                else:
-                    output_file.write(line)
+        with open(self.infile, 'rb') as input_file:
+            buffer = input_file.read()
+        header, n_points, start, end = self._locate_points(buffer)
+        if mesh_points.shape[0] != n_points:
+            raise ValueError(
+                'The openFOAM file has {0!s} points, {1!s} were given.'.format(
+                    n_points, mesh_points.shape[0]))
+
+        with open(self.outfile, 'wb') as output_file:
+            output_file.write(buffer[:start])
+            if header.get('format') == 'binary':
+                output_file.write(
+                    np.asarray(mesh_points, dtype=self._scalar_type(
+                        header)).tobytes())
+            else:
+                output_file.write(b'\n')
+                self._write_ascii(output_file, mesh_points)
+            output_file.write(buffer[end:])
+
+    @staticmethod
+    def _locate_points(buffer):
+        """
+        This private static method reads the FoamFile header and finds the
+        list of points: the number of points, the offset after its opening
+        parenthesis and the offset of its closing parenthesis.
+        :param bytes buffer: the content of the file.
+        :return: header, n_points, start, end: the header entries, the
+            number of points and the bounds of the list content.
+        :rtype: dict, int, int, int
+        """
+        import numpy as np
+        header = {}
+        position = 0
+        match = _HEADER.search(buffer)
+        if match:
+            for key, value in _ENTRY.findall(match.group(1)):
+                header[key.decode('ascii')] = value.strip().strip(
+                    b'"').decode('ascii')
+            position = match.end()
+
+        match = _COUNT.search(buffer, position)
+        if match is None:
+            raise ValueError('The number of points was not found.')
+        n_points = int(match.group(1))
+        start = match.end()
+
+        if header.get('format') == 'binary':
+            end = start + 3 * n_points * np.dtype(
+                OpenFoamHandler._scalar_type(header)).itemsize
+        elif n_points == 0:
+            end = buffer.index(b')', start)
+        else:
+            match = _LIST_END.search(buffer, start)
+            if match is None:
+                raise ValueError('The list of points is not closed.')
+            end = match.end() - 1
+        if end > len(buffer):
+            raise ValueError('The list of points is truncated.')
+        return header, n_points, start, end
+
+    @staticmethod
+    def _scalar_type(header):
+        """
+        This private static method returns the type of the binary scalars
+        described by the `arch` entry of the header, e.g.
+        "LSB;label=32;scalar=64".
+        :param dict header: the FoamFile header entries.
+        :return: dtype: the numpy type of the scalars.
+        :rtype: numpy.dtype
+        """
+        import numpy as np
+        arch = header.get('arch', 'LSB;label=32;scalar=64')
+        byteorder = '>' if arch.startswith('MSB') else '<'
+        match = re.search(r'scalar=(\d+)', arch)
+        bits = int(match.group(1)) if match else 64
+        return np.dtype('{0}f{1}'.format(byteorder, bits // 8))
+
+    @staticmethod
+    def _write_ascii(output_file, mesh_points, chunk_size=2**16):
+        """
+        This private static method writes the points as `(x y z)` lines,
+        `chunk_size` points at a time.
+        :param file output_file: file opened for binary writing.
+        :param numpy.ndarray mesh_points: it is a `n_points`-by-3 matrix
+            containing the coordinates of the points of the mesh.
+        :param int chunk_size: number of points formatted at once.
+        """
+        import numpy as np
+        mesh_points = np.asarray(mesh_points, dtype=np.float64)
+        for start in range(0, mesh_points.shape[0], chunk_size):
+            chunk = mesh_points[start:start + chunk_size]
+            output_file.write((('(%s %s %s)\n' * chunk.shape[0]) % tuple(
+                chunk.ravel().tolist())).encode('ascii'))
@@ -47,10 +47,50 @@ The module is analogous to the freeform one.
     Wendland :math:`C^2` basis and Polyharmonic splines all defined and
     implemented below.
 """
+import hashlib
+import warnings
+from collections import OrderedDict
+
 import numpy as np
 
+from scipy import linalg, sparse
+from scipy.sparse import linalg as sparse_linalg
+from scipy.spatial import cKDTree
 from scipy.spatial.distance import cdist
 
+from pygem.hmatrix import ClusterTree, HMatrix
+from pygem.tiled import TiledExecutor
+
+# bases that vanish beyond the radius, the only ones allowed by the sparse
+# backend
+_COMPACT_BASES = ('beckert_wendland_c2_basis',)
+# bases with a positive definite interpolation matrix, factorized with
+# Cholesky
+_DEFINITE_BASES = ('gaussian_spline', 'inv_multi_quadratic_biharmonic_spline',
+                   'beckert_wendland_c2_basis')
+# maximum number of bytes of the factorizations kept by the cache of the RBF
+# class
+_CACHE_BYTES = 2**30
+# local systems of the approximate cardinal functions more ill conditioned
+# than this mark a flat basis, preconditioned by a Nystrom approximation
+_FLAT_CONDITION = 1e10
+# tolerance of the hierarchical matrices of a flat basis: its weights are
+# large and oscillating, so they amplify the errors of the low rank blocks,
+# and a tighter tolerance does not let the adaptive cross approximation stop
+_FLAT_TOLERANCE = 1e-12
+# leaf size of the cluster trees of the mesh points: the evaluation blocks
+# are rectangular, and larger leaves halve the partial cross approximations
+_EVALUATION_LEAF = 512
+# number of random vectors of the Nystrom approximation
+_SKETCH_SIZE = 800
+# eigenvalues of the Nystrom approximation kept, relative to the largest one;
+# the smaller ones are dominated by the rounding errors of the sketch
+_SKETCH_RCOND = 1e-10
+# iterations of GMRES between two restarts, and maximum number of restarts;
+# GMRES stops earlier when a cycle does not halve the residual
+_GMRES_RESTART = 100
+_GMRES_CYCLES = 20
+
 
 class RBF(object):
     """
@@ -59,6 +99,38 @@ class RBF(object):
     :param RBFParameters rbf_parameters: parameters of the RBF.
     :param numpy.ndarray original_mesh_points: coordinates of the original
         points of the mesh.
+    :param string backend: 'dense' to use all the pairs of points,
+        'sparse' to use only the pairs closer than the radius, found with a
+        KD-tree, for bases with compact support, or 'hierarchical' to
+        approximate the far field of bases with global support with a
+        hierarchical matrix. Default is 'dense'.
+    :param string solver: the solver of the sparse system, 'direct' or 'cg'.
+        Default is 'direct'.
+    :param float tolerance: the relative tolerance of the approximate
+        solutions: of the conjugate gradient of the 'sparse' backend with
+        `solver` 'cg', and of the low rank approximations and of GMRES of the
+        'hierarchical' backend; it is not used by the direct solvers. The
+        iterative solvers stop when the residual of the system, relative to
+        the right hand side, is below the tolerance: this bounds the
+        residual, not the error, which is up to the condition number times
+        larger, e.g. a relative error of 3e-6 was measured with the
+        tolerance 1e-6. For a flat basis, e.g. a multiquadric with a
+        radius comparable with the size of the domain, GMRES may stop above
+        the tolerance with a RuntimeWarning, and away from the control
+        points the interpolant is ill posed, so it may differ from the dense
+        one much more. Default is 1e-6.
+    :param float selection_tolerance: if not None, the control points are
+        selected greedily, one at a time where the displacement error of the
+        interpolation is the largest, until the error at all the control
+        points is below this tolerance; only the selected points are used.
+        Default is None, that is all the control points are used.
+    :param int max_selected: the maximum number of control points selected.
+        Default is None, that is no limit.
+    :param bool cache: if True the factorization of the interpolation system
+        is kept by the class, up to one gigabyte of factorizations, and
+        reused by the following RBF with the same original control points,
+        basis and backend, e.g. in a design loop where only the deformed
+        control points change. Default is False.
     :cvar RBFParameters parameters: parameters of the RBF.
     :cvar numpy.ndarray original_mesh_points: coordinates of the original points
         of the mesh.  The shape is `n_points`-by-3.
@@ -66,11 +138,26 @@ class RBF(object):
         deformed mesh.  The shape is `n_points`-by-3.
     :cvar dict bases: a dictionary that associates the names of the basis
         functions implemented to the actual implementation.
-    :cvar numpy.matrix weights: the matrix formed by the weights corresponding
+    :cvar numpy.ndarray weights: the matrix formed by the weights corresponding
         to the a-priori selected N control points, associated to the basis
         functions and c and Q terms that describe the polynomial of order one
         p(x) = c + Qx.  The shape is (n_control_points+1+3)-by-3. It is computed
         internally.
+    :cvar string backend: 'dense', 'sparse' or 'hierarchical'.
+    :cvar string solver: the solver of the sparse system.
+    :cvar float tolerance: the tolerance of the iterative solvers and of the
+        hierarchical backend.
+    :cvar numpy.ndarray selected: the indices of the selected control points,
+        or None if all the control points are used.
+    :cvar numpy.ndarray control_points: the original control points used by
+        the interpolation, all of them or only the selected ones.
+    :cvar bool cache: if the factorization is cached by the class.
+    :cvar RBFFactorization factorization: the factorization of the
+        interpolation system; with `cache` it is shared by all the RBF with
+        the same original control points, basis and backend.
+    :cvar evaluation: the matrix of the basis functions evaluated at the mesh
+        points, computed by `prepare_evaluation`, dense, sparse or
+        hierarchical.
     :Example:
     >>> import pygem.radial as rbf
     >>> import pygem.params as rbfp
@@ -91,10 +178,22 @@ class RBF(object):
     >>> new_mesh_points = radial_trans.modified_mesh_points
     """
 
-    def __init__(self, rbf_parameters, original_mesh_points):
+    def __init__(self,
+                 rbf_parameters,
+                 original_mesh_points,
+                 backend='dense',
+                 solver='direct',
+                 tolerance=1e-6,
+                 selection_tolerance=None,
+                 max_selected=None,
+                 cache=False):
         self.parameters = rbf_parameters
         self.original_mesh_points = original_mesh_points
         self.modified_mesh_points = None
+        self.backend = backend
+        self.solver = solver
+        self.tolerance = tolerance
+        self.cache = cache
 
         self.bases = {
             'gaussian_spline':
@@ -121,40 +220,81 @@ class RBF(object):
                 correct or not implemented. Check the documentation for
                 all the available functions.""")
 
-        self.weights = self._get_weights(
-            self.parameters.original_control_points,
-            self.parameters.deformed_control_points)
+        if backend not in ('dense', 'sparse', 'hierarchical'):
+            raise ValueError(
+                'The backend must be \'dense\', \'sparse\' or '
+                '\'hierarchical\', not {0!s}.'.format(backend))
+        if backend == 'sparse' and self.parameters.basis not in _COMPACT_BASES:
+            raise ValueError(
+                'The sparse backend needs a basis with compact support: '
+                '{0!s}.'.format(', '.join(_COMPACT_BASES)))
+        if solver not in ('direct', 'cg'):
+            raise ValueError(
+                'The solver must be \'direct\' or \'cg\', not {0!s}.'.format(
+                    solver))
+
+        self.evaluation = None
+        self.selected = None
+        self.control_points = np.asarray(
+            self.parameters.original_control_points, dtype=float)
+        deformed_control_points = np.asarray(
+            self.parameters.deformed_control_points, dtype=float)
+        if selection_tolerance is not None:
+            self.selected = self._select_control_points(
+                self.control_points, deformed_control_points,
+                selection_tolerance, max_selected)
+            self.control_points = self.control_points[self.selected]
+            deformed_control_points = deformed_control_points[self.selected]
+        self.factorization = self._factorize(self.control_points)
+        self.weights = self.factorization.solve(deformed_control_points)
+
+    # factorizations of the interpolation systems, shared by the instances
+    # created with cache=True
+    _factorizations = OrderedDict()
+
+    @classmethod
+    def clear_cache(cls):
+        """
+        Removes all the factorizations cached by the class.
+        """
+        cls._factorizations.clear()
 
     @staticmethod
-    def gaussian_spline(X, r):
+    def gaussian_spline(X, r, out=None):
         """
         It implements the following formula:
         .. math::
             \\varphi(\\boldsymbol{x}) = e^{-\\frac{\\boldsymbol{x}^2}{r^2}}
         :param numpy.ndarray X: the vector x in the formula above.
         :param float r: the parameter r in the formula above.
+        :param numpy.ndarray out: array where the result is stored, it can be
+            `X` itself. Default is None.
         :return: result: the result of the formula above.
         :rtype: float
         """
-        result = np.exp(-(X * X) / (r * r))
-        return result
+        result = np.multiply(X, X, out=out)
+        result /= -(r * r)
+        return np.exp(result, out=result)
 
     @staticmethod
-    def multi_quadratic_biharmonic_spline(X, r):
+    def multi_quadratic_biharmonic_spline(X, r, out=None):
         """
         It implements the following formula:
         .. math::
             \\varphi(\\boldsymbol{x}) = \\sqrt{\\boldsymbol{x}^2 + r^2}
         :param numpy.ndarray X: the vector x in the formula above.
         :param float r: the parameter r in the formula above.
+        :param numpy.ndarray out: array where the result is stored, it can be
+            `X` itself. Default is None.
         :return: result: the result of the formula above.
         :rtype: float
         """
-        result = np.sqrt((X * X) + (r * r))
-        return result
+        result = np.multiply(X, X, out=out)
+        result += r * r
+        return np.sqrt(result, out=result)
 
     @staticmethod
-    def inv_multi_quadratic_biharmonic_spline(X, r):
+    def inv_multi_quadratic_biharmonic_spline(X, r, out=None):
         """
         It implements the following formula:
         .. math::
@@ -162,14 +302,18 @@ class RBF(object):
             (\\boldsymbol{x}^2 + r^2 )^{-\\frac{1}{2}}
         :param numpy.ndarray X: the vector x in the formula above.
         :param float r: the parameter r in the formula above.
+        :param numpy.ndarray out: array where the result is stored, it can be
+            `X` itself. Default is None.
         :return: result: the result of the formula above.
         :rtype: float
         """
-        result = 1.0 / (np.sqrt((X * X) + (r * r)))
-        return result
+        result = np.multiply(X, X, out=out)
+        result += r * r
+        np.sqrt(result, out=result)
+        return np.divide(1.0, result, out=result)
 
     @staticmethod
-    def thin_plate_spline(X, r):
+    def thin_plate_spline(X, r, out=None):
         """
         It implements the following formula:
         .. math::
@@ -178,16 +322,20 @@ class RBF(object):
             \\ln\\frac{\\boldsymbol{x}}{r}
         :param numpy.ndarray X: the vector x in the formula above.
         :param float r: the parameter r in the formula above.
+        :param numpy.ndarray out: array where the result is stored, it can be
+            `X` itself. Default is None.
         :return: result: the result of the formula above.
         :rtype: float
         """
-        arg = X / r
-        result = arg * arg
-        result = np.where(arg > 0, result * np.log(arg), result)
+        arg = np.divide(X, r, out=out)
+        logarithm = np.zeros_like(arg)
+        np.log(arg, out=logarithm, where=arg > 0)
+        result = np.multiply(arg, arg, out=arg)
+        result *= logarithm
         return result
 
     @staticmethod
-    def beckert_wendland_c2_basis(X, r):
+    def beckert_wendland_c2_basis(X, r, out=None):
         """
         It implements the following formula:
         .. math::
@@ -196,16 +344,20 @@ class RBF(object):
             \\left( 4 \\frac{ \\boldsymbol{x} }{r} + 1 \\right)
         :param numpy.ndarray X: the vector x in the formula above.
         :param float r: the parameter r in the formula above.
+        :param numpy.ndarray out: array where the result is stored, it can be
+            `X` itself. Default is None.
         :return: result: the result of the formula above.
         :rtype: float
         """
-        arg = X / r
-        first = np.where((1 - arg) > 0, np.power((1 - arg), 4), 0)
+        arg = np.divide(X, r, out=out)
         second = (4 * arg) + 1
-        result = first * second
-        return result
+        first = np.subtract(1, arg, out=arg)
+        np.maximum(first, 0, out=first)
+        np.power(first, 4, out=first)
+        first *= second
+        return first
 
-    def polyharmonic_spline(self, X, r):
+    def polyharmonic_spline(self, X, r, out=None):
         """
         It implements the following formula:
         .. math::
@@ -226,23 +378,27 @@ class RBF(object):
                 \\end{cases}
         :param numpy.ndarray X: the vector x in the formula above.
         :param float r: the parameter r in the formula above.
+        :param numpy.ndarray out: array where the result is stored, it can be
+            `X` itself. Default is None.
         :return: result: the result of the formula above.
         :rtype: float
         """
 
         k = self.parameters.power
-        r_sc = X / r
+        r_sc = np.divide(X, r, out=out)
 
         # k odd
         if k & 1:
-            return np.power(r_sc, k)
+            return np.power(r_sc, k, out=r_sc)
 
-        print(r_sc)
         # k even
         result = np.where(r_sc < 1,
                           np.power(r_sc, k - 1) * np.log(np.power(r_sc, r_sc)),
                           np.power(r_sc, k) * np.log(r_sc))
-        return result
+        if out is None:
+            return result
+        out[...] = result
+        return out
 
     def _get_weights(self, X, Y):
         """
@@ -257,32 +413,671 @@ class RBF(object):
             coordinates of the interpolation control points after the
             deformation.
         :return: weights: the matrix with the weights and the polynomial terms.
-        :rtype: numpy.matrix
-        """
-        n_points, dim = X.shape
-        H = np.zeros((n_points + 3 + 1, n_points + 3 + 1))
-        H[:n_points, :n_points] = self.basis(
-            cdist(X, X), self.parameters.radius)
-        H[n_points, :n_points] = 1.0
-        H[:n_points, n_points] = 1.0
-        H[:n_points, -3:] = X
-        H[-3:, :n_points] = X.T
-
-        rhs = np.zeros((n_points + 3 + 1, dim))
-        rhs[:n_points, :] = Y
-        weights = np.linalg.solve(H, rhs)
-        return weights
+        :rtype: numpy.ndarray
+        """
+        return self._factorize(X).solve(Y)
+
+    def _select_control_points(self, X, Y, tolerance, max_points=None):
+        """
+        This private method selects greedily the control points: it starts
+        from four points spanning a tetrahedron, so that the polynomial term
+        is determined, and it adds one point at a time where the displacement
+        error of the current interpolation is the largest. The inverse of the
+        interpolation system is updated with a rank-one correction when a
+        point is added, and the interpolation error at all the control points
+        with the new cardinal function, so each step costs
+        O(`n_control_points` `n_selected`). The inverse drives only the
+        selection: the rank-one updates accumulate rounding errors, so the
+        interpolation system of the selected points is factorized again,
+        which costs a small fraction of the selection.
+        :param numpy.ndarray X: it is an n_control_points-by-3 array with the
+            coordinates of the original interpolation control points before the
+            deformation.
+        :param numpy.ndarray Y: it is an n_control_points-by-3 array with the
+            coordinates of the interpolation control points after the
+            deformation.
+        :param float tolerance: the selection stops when the displacement
+            error at all the control points is below this tolerance.
+        :param int max_points: the maximum number of selected points. Default
+            is None, that is no limit.
+        :return: selected: the sorted indices of the selected points.
+        :rtype: numpy.ndarray
+        """
+        n_points = X.shape[0]
+        max_points = n_points if max_points is None else min(
+            max(max_points, 4), n_points)
+        radius = self.parameters.radius
+
+        # the farthest point from the affine hull of the selected ones
+        selected = [int(np.argmax(np.sum((X - X.mean(axis=0))**2, axis=1)))]
+        for __ in range(3):
+            offsets = X - X[selected[0]]
+            if len(selected) > 1:
+                hull = np.linalg.qr((X[selected[1:]] - X[selected[0]]).T)[0]
+                offsets -= np.dot(np.dot(offsets, hull), hull.T)
+            selected.append(int(np.argmax(np.sum(offsets**2, axis=1))))
+
+        # rows of [P Phi]^T at all the control points and inverse of the
+        # system, grown when needed; the unknowns are ordered as [c Q] and
+        # then the weights of the selected points
+        capacity = 4 + min(max_points, 256)
+        rows = np.empty((capacity, n_points))
+        rows[0] = 1.
+        rows[1:4] = X.T
+        rows[4:8] = self.basis(cdist(X[selected], X), radius)
+        size = 8
+        system = np.zeros((size, size))
+        system[4:] = rows[:size, selected].T
+        system[:4, 4:] = system[4:, :4].T
+        inverse = np.empty((capacity, capacity))
+        try:
+            inverse[:size, :size] = linalg.inv(system)
+        except linalg.LinAlgError:
+            raise ValueError(
+                'The control points are coplanar, the polynomial term is not '
+                'determined.')
+        solution = np.dot(inverse[:size, 4:size], Y[selected])
+        residual = Y - np.dot(rows[:size].T, solution)
+
+        while len(selected) < max_points:
+            errors = np.sqrt(np.sum(residual**2, axis=1))
+            errors[selected] = 0.
+            new = int(np.argmax(errors))
+            if errors[new] <= tolerance:
+                break
+
+            if size == capacity:
+                capacity = min(2 * capacity, max_points + 4)
+                rows = np.vstack(
+                    (rows, np.empty((capacity - size, n_points))))
+                grown = np.empty((capacity, capacity))
+                grown[:size, :size] = inverse[:size, :size]
+                inverse = grown
+            row = rows[size]
+            self.basis(cdist(X[new:new + 1], X), radius, out=row[np.newaxis])
+            border = rows[:size, new]
+            projection = np.dot(inverse[:size, :size], border)
+            pivot = row[new] - np.dot(border, projection)
+            if abs(pivot) <= 1e-12 * max(
+                    abs(row[new]), abs(np.dot(border, projection))):
+                # the new point is numerically dependent on the selected ones
+                break
+            # cardinal function of the new point, zero at the selected ones
+            cardinal = row - np.dot(projection, rows[:size])
+            cardinal /= pivot
+            residual -= np.outer(cardinal, residual[new])
+
+            projection /= pivot
+            inverse[:size, :size] += np.outer(projection * pivot, projection)
+            inverse[:size, size] = -projection
+            inverse[size, :size] = -projection
+            inverse[size, size] = 1. / pivot
+            size += 1
+            selected.append(new)
+        return np.sort(selected)
 
-    def perform(self):
+    def _factorize(self, X):
+        """
+        This private method returns the factorization of the interpolation
+        system of the original control points `X`. With `self.cache` the
+        factorizations are cached by the class, the least recently used ones
+        are dropped beyond one gigabyte, so in a design loop where only the
+        deformed control points change the system is factorized once.
+        :param numpy.ndarray X: it is an n_control_points-by-3 array with the
+            coordinates of the original interpolation control points before the
+            deformation.
+        :return: factorization: the factorization of the system.
+        :rtype: RBFFactorization
+        """
+        X = np.ascontiguousarray(X, dtype=float)
+        key = (self.backend, self.solver, self.tolerance, self.parameters.basis,
+               float(self.parameters.radius),
+               getattr(self.parameters, 'power', None), X.shape,
+               hashlib.sha1(X).hexdigest())
+        cache = RBF._factorizations
+        if self.cache and key in cache:
+            cache[key] = cache.pop(key)
+            return cache[key]
+
+        n_points = X.shape[0]
+        polynomial = np.hstack((np.ones((n_points, 1)), X))
+        if self.backend == 'sparse':
+            tree = cKDTree(X)
+            pairs = tree.sparse_distance_matrix(
+                tree, self.parameters.radius, output_type='ndarray')
+            basis = sparse.csc_matrix(
+                (self.basis(pairs['v'], self.parameters.radius),
+                 (pairs['i'], pairs['j'])),
+                shape=(n_points, n_points))
+            basis.eliminate_zeros()
+            method = 'splu' if self.solver == 'direct' else 'cg'
+        elif self.backend == 'hierarchical':
+            tree = ClusterTree(X)
+            # the projected system is much smaller than the basis matrix, so
+            # the latter is approximated more accurately than the solution
+            basis = HMatrix(tree, tree, self._kernel, 1e-3 * self.tolerance)
+            method = 'gmres'
+        else:
+            basis = self.basis(cdist(X, X), self.parameters.radius)
+            method = ('cholesky' if self.parameters.basis in _DEFINITE_BASES
+                      else 'lu')
+
+        factorization = RBFFactorization(basis, polynomial, method,
+                                         self.tolerance)
+        if self.cache and factorization.nbytes <= _CACHE_BYTES:
+            cache[key] = factorization
+            while sum(cached.nbytes
+                      for cached in cache.values()) > _CACHE_BYTES:
+                cache.popitem(last=False)
+        return factorization
+
+    def prepare_evaluation(self, chunk_size=None):
+        """
+        This method computes and stores in `self.evaluation` the basis
+        functions evaluated at the mesh points, so that `deform` needs only a
+        matrix product. The matrix is dense, `n_points`-by-`n_control_points`,
+        unless the backend is sparse or hierarchical.
+        :param int chunk_size: number of points evaluated at once. Default is
+            None, that is about four millions of distances at once.
+        """
+        control_points = self.control_points
+        mesh_points = np.asarray(self.original_mesh_points, dtype=float)
+        n_points = mesh_points.shape[0]
+        n_controls = control_points.shape[0]
+
+        if self.backend == 'sparse':
+            chunk_size = 2**16 if chunk_size is None else chunk_size
+            control_tree = cKDTree(control_points)
+            blocks = []
+            for start in range(0, n_points, chunk_size):
+                points = mesh_points[start:start + chunk_size]
+                blocks.append(
+                    self._sparse_evaluation(points, control_tree, n_controls))
+            self.evaluation = sparse.vstack(blocks, format='csr')
+            return
+        if self.backend == 'hierarchical':
+            self.evaluation = HMatrix(
+                ClusterTree(mesh_points, _EVALUATION_LEAF),
+                ClusterTree(control_points), self._kernel,
+                self._evaluation_tolerance())
+            return
+
+        if chunk_size is None:
+            chunk_size = max(1, 2**22 // n_controls)
+        self.evaluation = np.empty((n_points, n_controls))
+        for start in range(0, n_points, chunk_size):
+            dist = self.evaluation[start:start + chunk_size]
+            cdist(mesh_points[start:start + chunk_size], control_points,
+                  out=dist)
+            self.basis(dist, self.parameters.radius, out=dist)
+
+    def deform(self, deformed_control_points):
+        """
+        This method deforms the mesh points for new positions of the control
+        points, reusing the factorization of the system and the evaluation
+        matrix of `prepare_evaluation`, which is computed here if missing. More
+        sets of positions are solved together as a single right hand side.
+        When the control points were selected, only the positions of the
+        selected ones are used.
+        :param numpy.ndarray deformed_control_points: the deformed control
+            points, `n_control_points`-by-3 or, for `n_sets` sets of positions,
+            `n_sets`-by-`n_control_points`-by-3.
+        :return: modified_mesh_points: the deformed points, `n_points`-by-3
+            or `n_sets`-by-`n_points`-by-3.
+        :rtype: numpy.ndarray
+        """
+        if self.evaluation is None:
+            self.prepare_evaluation()
+        deformed_control_points = np.asarray(deformed_control_points,
+                                             dtype=float)
+        batch = deformed_control_points.ndim == 3
+        if not batch:
+            deformed_control_points = deformed_control_points[np.newaxis]
+        if self.selected is not None:
+            deformed_control_points = deformed_control_points[:, self.selected]
+        n_sets, n_controls, dim = deformed_control_points.shape
+
+        rhs = np.transpose(deformed_control_points, (1, 0, 2)).reshape(
+            n_controls, n_sets * dim)
+        weights = self.factorization.solve(rhs)
+        mesh_points = np.asarray(self.original_mesh_points, dtype=float)
+        result = self.evaluation.dot(weights[:n_controls])
+        # polynomial term c + Qx
+        result += weights[n_controls]
+        result += np.dot(mesh_points, weights[n_controls + 1:])
+        result = np.transpose(
+            result.reshape(mesh_points.shape[0], n_sets, dim), (1, 0, 2))
+        return result if batch else result[0]
+
+    def perform(self, chunk_size=None, executor=None):
         """
         This method performs the deformation of the mesh points. After the
-        execution it sets `self.modified_mesh_points`.
-        """
-        n_points = self.original_mesh_points.shape[0]
-        dist = self.basis(
-            cdist(self.original_mesh_points,
-                  self.parameters.original_control_points),
-            self.parameters.radius)
-        identity = np.ones((n_points, 1))
-        H = np.bmat([[dist, identity, self.original_mesh_points]])
-        self.modified_mesh_points = np.asarray(np.dot(H, self.weights))
+        execution it sets `self.modified_mesh_points`. The points are deformed
+        in tiles, run in parallel by the `executor`: the distances of a tile
+        from the control points are computed in a buffer of its thread,
+        reused for the following tiles, and the basis is applied in place, so
+        the memory does not grow with the number of points.
+        :param int chunk_size: number of points of a tile. Default is None,
+            that is about four millions of distances for each tile.
+        :param TiledExecutor executor: the executor of the tiles. Default is
+            None, that is a single thread.
+        """
+        executor = TiledExecutor() if executor is None else executor
+        if self.backend == 'sparse':
+            self._perform_sparse(2**16 if chunk_size is None else chunk_size,
+                                 executor)
+            return
+        if self.backend == 'hierarchical':
+            self._perform_hierarchical(
+                2**16 if chunk_size is None else chunk_size, executor)
+            return
+
+        control_points = self.control_points
+        mesh_points = np.asarray(self.original_mesh_points, dtype=float)
+        weights = np.asarray(self.weights)
+        n_points = mesh_points.shape[0]
+        n_controls = control_points.shape[0]
+        if chunk_size is None:
+            chunk_size = max(1, 2**22 // n_controls)
+
+        self.modified_mesh_points = np.empty((n_points, weights.shape[1]))
+
+        def kernel(start, stop):
+            points = mesh_points[start:stop]
+            dist = executor.buffer((stop - start, n_controls))
+            cdist(points, control_points, out=dist)
+            self.basis(dist, self.parameters.radius, out=dist)
+            result = self.modified_mesh_points[start:stop]
+            np.dot(dist, weights[:n_controls], out=result)
+            # polynomial term c + Qx
+            result += weights[n_controls]
+            result += np.dot(points, weights[n_controls + 1:])
+
+        executor.run(kernel, n_points, chunk_size)
+
+    def _perform_sparse(self, chunk_size, executor):
+        """
+        This private method deforms the mesh points with the sparse backend:
+        for each tile of points a KD-tree finds the control points closer than
+        the radius and the basis is evaluated only on these pairs.
+        :param int chunk_size: number of points of a tile.
+        :param TiledExecutor executor: the executor of the tiles.
+        """
+        control_points = self.control_points
+        mesh_points = np.asarray(self.original_mesh_points, dtype=float)
+        weights = np.asarray(self.weights)
+        n_points = mesh_points.shape[0]
+        n_controls = control_points.shape[0]
+        control_tree = cKDTree(control_points)
+
+        self.modified_mesh_points = np.empty((n_points, weights.shape[1]))
+
+        def kernel(start, stop):
+            points = mesh_points[start:stop]
+            basis = self._sparse_evaluation(points, control_tree, n_controls)
+            result = self.modified_mesh_points[start:stop]
+            result[:] = basis.dot(weights[:n_controls])
+            # polynomial term c + Qx
+            result += weights[n_controls]
+            result += np.dot(points, weights[n_controls + 1:])
+
+        executor.run(kernel, n_points, chunk_size)
+
+    def _perform_hierarchical(self, chunk_size, executor):
+        """
+        This private method deforms the mesh points with the hierarchical
+        backend: for each tile of points the basis functions of the control
+        points are approximated by a hierarchical matrix.
+        :param int chunk_size: number of points of a tile.
+        :param TiledExecutor executor: the executor of the tiles.
+        """
+        mesh_points = np.asarray(self.original_mesh_points, dtype=float)
+        weights = np.asarray(self.weights)
+        n_points = mesh_points.shape[0]
+        n_controls = self.control_points.shape[0]
+        control_tree = ClusterTree(self.control_points)
+        tolerance = self._evaluation_tolerance()
+
+        self.modified_mesh_points = np.empty((n_points, weights.shape[1]))
+
+        def kernel(start, stop):
+            points = mesh_points[start:stop]
+            basis = HMatrix(
+                ClusterTree(points, _EVALUATION_LEAF), control_tree,
+                self._kernel, tolerance, store_near=False)
+            result = self.modified_mesh_points[start:stop]
+            result[:] = basis.dot(weights[:n_controls])
+            # polynomial term c + Qx
+            result += weights[n_controls]
+            result += np.dot(points, weights[n_controls + 1:])
+
+        executor.run(kernel, n_points, chunk_size)
+
+    def _evaluation_tolerance(self):
+        """
+        This private method returns the tolerance of the hierarchical matrix
+        of the basis functions evaluated at the mesh points: the one of the
+        system for a flat basis, whose large weights amplify the errors of
+        the approximation, the one of the RBF otherwise.
+        :rtype: float
+        """
+        if self.factorization.flat:
+            return self.factorization.factor.tolerance
+        return self.tolerance
+
+    def _kernel(self, points, control_points):
+        """
+        This private method returns the matrix of the basis functions of
+        `control_points` evaluated at `points`.
+        :param numpy.ndarray points: the points where the basis functions are
+            evaluated.
+        :param numpy.ndarray control_points: the centers of the basis
+            functions.
+        :rtype: numpy.ndarray
+        """
+        dist = cdist(points, control_points)
+        return self.basis(dist, self.parameters.radius, out=dist)
+
+    def _sparse_evaluation(self, points, control_tree, n_controls):
+        """
+        This private method returns the sparse matrix of the basis functions
+        of the control points evaluated at `points`, computed only on the
+        pairs closer than the radius.
+        :param numpy.ndarray points: the points where the basis functions are
+            evaluated.
+        :param scipy.spatial.cKDTree control_tree: the KD-tree of the original
+            control points.
+        :param int n_controls: the number of control points.
+        :return: basis: the `n_points`-by-`n_controls` matrix.
+        :rtype: scipy.sparse.csr_matrix
+        """
+        pairs = cKDTree(points).sparse_distance_matrix(
+            control_tree, self.parameters.radius, output_type='ndarray')
+        values = pairs['v']
+        self.basis(values, self.parameters.radius, out=values)
+        return sparse.csr_matrix(
+            (values, (pairs['i'], pairs['j'])),
+            shape=(points.shape[0], n_controls))
+
+
+def _nbytes(value):
+    """
+    Returns the approximate number of bytes of an array, of a sparse matrix,
+    of a sparse LU factorization, of a HMatrix or of a tuple of them.
+    :rtype: int
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, tuple):
+        return sum(_nbytes(item) for item in value)
+    if sparse.issparse(value):
+        return value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    if isinstance(value, HMatrix):
+        return 8 * value.memory()
+    if isinstance(value, sparse_linalg.SuperLU):
+        return 12 * (value.L.nnz + value.U.nnz)
+    return 0
+
+
+class RBFFactorization(object):
+    """
+    Class that handles the factorization of the interpolation system of the
+    RBF for fixed original control points,
+    .. math::
+        \\begin{bmatrix} \\Phi & P \\\\ P^T & 0 \\end{bmatrix}
+        \\begin{bmatrix} W \\\\ [c\\ Q]^T \\end{bmatrix} =
+        \\begin{bmatrix} Y \\\\ 0 \\end{bmatrix}
+    where :math:`P = [1\\ X]`. When the basis matrix :math:`\\Phi` is
+    positive definite, or sparse, only :math:`\\Phi` is factorized and the
+    polynomial terms are found with the 4-by-4 Schur complement
+    :math:`P^T \\Phi^{-1} P`; otherwise the whole system is LU factorized.
+    With a hierarchical basis the weights are found with GMRES in the space
+    orthogonal to the polynomials, :math:`P^T W = 0`, and the polynomial
+    terms by least squares. GMRES is preconditioned by the approximate
+    cardinal functions of overlapping clusters or, for flat bases whose
+    local systems are too ill conditioned, by a randomized Nystrom
+    approximation of the dominant eigenvectors of the basis matrix. When the
+    system is so ill conditioned that GMRES stagnates above the tolerance,
+    e.g. for a multiquadric with a radius comparable with the size of the
+    domain, the best solution found is returned with a RuntimeWarning.
+    :param basis: the `n_points`-by-`n_points` matrix of the basis functions,
+        a numpy.ndarray, a scipy.sparse.csc_matrix or a HMatrix.
+    :param numpy.ndarray polynomial: the `n_points`-by-4 matrix :math:`P`.
+    :param string method: 'cholesky' or 'lu' for a dense basis, 'splu' or 'cg'
+        for a sparse one, 'gmres' for a hierarchical one.
+    :param float tolerance: the relative tolerance of the iterative solvers
+        on the residual of the system. Default is 1e-12.
+    :cvar string method: the method actually used; 'cholesky' falls back to
+        'lu' when the matrix is numerically not positive definite.
+    :cvar bool flat: True if the hierarchical basis is flat; its matrix is
+        then rebuilt, and should be evaluated, with the tolerance
+        `_FLAT_TOLERANCE`. The given matrix is never modified.
+    """
+
+    def __init__(self, basis, polynomial, method, tolerance=1e-12):
+        self.polynomial = polynomial
+        self.method = method
+        self.tolerance = tolerance
+        self.flat = False
+        n_points = polynomial.shape[0]
+
+        if method == 'gmres':
+            self.factor = basis
+            self.orthonormal, self.triangular = np.linalg.qr(polynomial)
+            self.preconditioner = basis.cardinal_preconditioner(
+                max_condition=_FLAT_CONDITION)
+            self.eigenvectors = self.eigenvalues = None
+            if self.preconditioner is None:
+                self.flat = True
+                if basis.tolerance > _FLAT_TOLERANCE:
+                    self.factor = HMatrix(basis.row_tree, basis.column_tree,
+                                          basis.kernel, _FLAT_TOLERANCE)
+                self.eigenvectors, self.eigenvalues = self._nystrom(
+                    _SKETCH_SIZE)
+            return
+
+        if method == 'cholesky':
+            try:
+                self.factor = linalg.cho_factor(basis)
+            except linalg.LinAlgError:
+                self.method = method = 'lu'
+        elif method == 'splu':
+            self.factor = sparse_linalg.splu(
+                basis,
+                permc_spec='MMD_AT_PLUS_A',
+                diag_pivot_thresh=0.,
+                options=dict(SymmetricMode=True))
+        elif method == 'cg':
+            self.factor = basis
+            self.inverse_diagonal = 1. / basis.diagonal()
+
+        if method == 'lu':
+            H = np.zeros((n_points + 4, n_points + 4))
+            H[:n_points, :n_points] = basis
+            H[:n_points, n_points:] = polynomial
+            H[n_points:, :n_points] = polynomial.T
+            self.factor = linalg.lu_factor(H)
+            return
+
+        self.basis_polynomial = self._solve_basis(polynomial)
+        self.schur = linalg.lu_factor(
+            np.dot(polynomial.T, self.basis_polynomial))
+
+    @property
+    def nbytes(self):
+        """
+        The approximate number of bytes of the factorization.
+        :rtype: int
+        """
+        return sum(_nbytes(value) for value in self.__dict__.values())
+
+    def _solve_basis(self, rhs):
+        """
+        Solves the system of the basis matrix :math:`\\Phi`.
+        :param numpy.ndarray rhs: the `n_points`-by-`m` right hand side.
+        :return: solution: the `n_points`-by-`m` solution.
+        :rtype: numpy.ndarray
+        """
+        if self.method == 'cholesky':
+            return linalg.cho_solve(self.factor, rhs)
+        if self.method == 'splu':
+            return self.factor.solve(rhs)
+
+        preconditioner = sparse_linalg.LinearOperator(
+            self.factor.shape, matvec=lambda v: self.inverse_diagonal * v)
+        solution = np.empty_like(rhs)
+        for i in range(rhs.shape[1]):
+            solution[:, i], info = sparse_linalg.cg(
+                self.factor,
+                rhs[:, i],
+                rtol=self.tolerance,
+                M=preconditioner)
+            if info != 0:
+                raise RuntimeError('The conjugate gradient did not converge.')
+        return solution
+
+    def solve(self, Y):
+        """
+        Returns the weights and the polynomial terms for the deformed control
+        points `Y`.
+        :param numpy.ndarray Y: the `n_points`-by-`m` deformed control
+            points; more sets of points are stacked as columns.
+        :return: weights: the (`n_points`+1+3)-by-`m` matrix with the weights
+            and the polynomial terms.
+        :rtype: numpy.ndarray
+        """
+        Y = np.asarray(Y, dtype=float)
+        n_points = self.polynomial.shape[0]
+        if self.method == 'lu':
+            rhs = np.zeros((n_points + 4, Y.shape[1]))
+            rhs[:n_points] = Y
+            return linalg.lu_solve(self.factor, rhs)
+        if self.method == 'gmres':
+            return self._solve_gmres(Y)
+
+        solution = self._solve_basis(Y)
+        terms = linalg.lu_solve(self.schur,
+                                np.dot(self.polynomial.T, solution))
+        weights = np.empty((n_points + 4, Y.shape[1]))
+        weights[:n_points] = solution - np.dot(self.basis_polynomial, terms)
+        weights[n_points:] = terms
+        return weights
+
+    def _project(self, x):
+        """
+        Projects `x` on the space orthogonal to the polynomials.
+        :param numpy.ndarray x: the `n_points`-by-`m` matrix.
+        :rtype: numpy.ndarray
+        """
+        return x - np.dot(self.orthonormal, np.dot(self.orthonormal.T, x))
+
+    def _nystrom(self, size):
+        """
+        Returns the randomized Nystrom approximation
+        :math:`U \\Lambda U^T` of the basis matrix in the space orthogonal to
+        the polynomials, where it is definite, from its product with `size`
+        random vectors. The eigenvalues are signed as the basis matrix.
+        :param int size: the number of random vectors.
+        :return: eigenvectors, eigenvalues: the `n_points`-by-`rank` matrix
+            :math:`U` and the `rank` eigenvalues, in decreasing magnitude.
+        :rtype: numpy.ndarray, numpy.ndarray
+        """
+        n_points = self.polynomial.shape[0]
+        size = min(size, n_points - 4)
+        random = np.random.RandomState(0)
+        sketch = np.linalg.qr(
+            self._project(random.standard_normal((n_points, size))))[0]
+        product = self._project(self.factor.dot(sketch))
+        gram = np.dot(sketch.T, product)
+        sign = 1. if np.trace(gram) >= 0. else -1.
+        # the eigenvalues of the gram matrix below the rounding errors and
+        # the errors of the low rank blocks are noise, and are dropped
+        values, vectors = linalg.eigh(sign * (gram + gram.T) / 2.)
+        noise = max(np.finfo(float).eps, self.factor.tolerance) * \
+            np.abs(values).max()
+        valid = values > noise
+        scaled = np.dot(sign * product, vectors[:, valid] / np.sqrt(
+            values[valid]))
+        eigenvectors, singular = linalg.svd(scaled, full_matrices=False)[:2]
+        eigenvalues = singular**2
+        keep = eigenvalues > max(_SKETCH_RCOND * eigenvalues[0], noise)
+        return eigenvectors[:, keep], sign * eigenvalues[keep]
+
+    def _precondition(self, x):
+        """
+        Applies the preconditioner to `x`: the approximate cardinal functions
+        or, for a flat basis, the inverse of the Nystrom approximation on its
+        eigenvectors and the smallest of its eigenvalues on the rest.
+        :param numpy.ndarray x: the `n_points`-by-`m` matrix, orthogonal to
+            the polynomials.
+        :rtype: numpy.ndarray
+        """
+        if self.eigenvectors is None:
+            return self._project(self.preconditioner.dot(x))
+        # the rest is scaled by the inverse of a small eigenvalue, so it is
+        # projected again against the rounding errors
+        coefficients = np.dot(self.eigenvectors.T, x)
+        rest = x - np.dot(self.eigenvectors, coefficients)
+        return np.dot(self.eigenvectors, coefficients /
+                      self.eigenvalues[:, np.newaxis]) + self._project(
+                          rest / self.eigenvalues[-1])
+
+    def _solve_gmres(self, Y):
+        """
+        Solves the system with GMRES, for a hierarchical basis. The columns
+        of `Y` are solved together, as a block diagonal system, so that each
+        iteration needs a single product with the hierarchical matrix. The
+        system is preconditioned on the right, so that GMRES minimizes the
+        actual residual; it is restarted until the residual is below the
+        tolerance, or stagnates.
+        :param numpy.ndarray Y: the `n_points`-by-`m` deformed control
+            points.
+        :return: weights: the (`n_points`+1+3)-by-`m` matrix with the weights
+            and the polynomial terms.
+        :rtype: numpy.ndarray
+        """
+        n_points, n_columns = Y.shape
+
+        def stacked(function):
+            return lambda x: np.ravel(
+                function(x.reshape(n_columns, n_points).T).T)
+
+        precondition = stacked(self._precondition)
+        product = stacked(
+            lambda x: self._project(self.factor.dot(self._project(x))))
+        size = n_points * n_columns
+        operator = sparse_linalg.LinearOperator(
+            (size, size), matvec=lambda x: product(precondition(x)))
+        rhs = np.ravel(self._project(Y).T)
+        norm = np.linalg.norm(rhs)
+        preconditioned = np.zeros(size)
+        residual = norm
+        for _ in range(_GMRES_CYCLES):
+            if residual <= self.tolerance * norm:
+                break
+            # the residual estimated by GMRES is slightly optimistic
+            preconditioned = sparse_linalg.gmres(operator,
+                                                 rhs,
+                                                 x0=preconditioned,
+                                                 rtol=0.5 * self.tolerance,
+                                                 restart=_GMRES_RESTART,
+                                                 maxiter=1)[0]
+            previous = residual
+            residual = np.linalg.norm(rhs - operator.matvec(preconditioned))
+            if residual > 0.5 * previous:
+                break
+        if residual > self.tolerance * norm:
+            warnings.warn(
+                'GMRES stopped at the relative residual {0:.1e}, above the '
+                'tolerance {1:.1e}: the interpolation system is too ill '
+                'conditioned for the hierarchical backend.'.format(
+                    residual / norm, self.tolerance), RuntimeWarning)
+
+        weights = np.empty((n_points + 4, n_columns))
+        # the product of the operator is with the projected weights
+        weights[:n_points] = self._project(
+            precondition(preconditioned).reshape(n_columns, n_points).T)
+        residual = Y - self.factor.dot(weights[:n_points])
+        weights[n_points:] = linalg.solve_triangular(
+            self.triangular, np.dot(self.orthonormal.T, residual))
+        return weights
@@ -0,0 +1,173 @@
+"""
+Module with the registry of the mesh file handlers. The handlers are found by
+extension or, when the extension is missing or unknown, by the first bytes of
+the file; their modules are imported only when a handler is requested. The
+`morph` function chains the parse, the deformation and the write of a file.
+"""
+import importlib
+import os
+import re
+from collections import OrderedDict
+from timeit import default_timer as timer
+
+import numpy as np
+
+# name: (module, class, extensions)
+_HANDLERS = OrderedDict()
+# (name, test on the first bytes of the file)
+_SIGNATURES = []
+# parameters class name: (module, class)
+_DEFORMERS = {
+    'FFDParameters': ('pygem.freeform', 'FFD'),
+    'RBFParameters': ('pygem.radial', 'RBF'),
+    'IDWParameters': ('pygem.idw', 'IDW'),
+}
+# number of bytes read to recognize a file
+HEADER_SIZE = 512
+
+
+def register(name, module, class_name, extensions, signature=None):
+    """
+    Registers a file handler.
+
+    :param string name: the name of the format, e.g. 'stl'.
+    :param string module: the module of the handler, imported only when the
+        handler is requested.
+    :param string class_name: the name of the handler class.
+    :param list extensions: the extensions of the files of this format.
+    :param callable signature: a function that takes the first bytes of a
+        file and tells if they belong to this format. Default is None.
+    """
+    _HANDLERS[name] = (module, class_name, list(extensions))
+    if signature is not None:
+        _SIGNATURES.append((name, signature))
+
+
+def _is_binary_stl(header, size):
+    """
+    Returns True if the size of the file matches the number of triangles
+    written in the header of a binary stl.
+    """
+    if len(header) < 84:
+        return False
+    return size == 84 + 50 * int(np.frombuffer(header[80:84], dtype='<u4')[0])
+
+
+register('k', 'pygem.khandler', 'KHandler', ['.k'],
+         lambda header, size: re.search(br'(?im)^\*KEYWORD', header) is not
+         None)
+register('unv', 'pygem.unvhandler', 'UnvHandler', ['.unv'],
+         lambda header, size: header.lstrip(b'\r\n').startswith(b'    -1'))
+register('openfoam', 'pygem.openfhandler', 'OpenFoamHandler', [''],
+         lambda header, size: b'FoamFile' in header)
+register('vtk', 'pygem.vtkhandler', 'VtkHandler', ['.vtk'],
+         lambda header, size: header.startswith(b'# vtk DataFile'))
+register('stl', 'pygem.stlhandler', 'StlHandler', ['.stl'],
+         lambda header, size: header.lstrip().startswith(b'solid') or
+         _is_binary_stl(header, size))
+register('step', 'pygem.stephandler', 'StepHandler', ['.step', '.stp'],
+         lambda header, size: header.startswith(b'ISO-10303-21'))
+register('iges', 'pygem.igshandler', 'IgesHandler', ['.iges', '.igs'],
+         lambda header, size: header[72:73] == b'S')
+
+
+def detect(filename):
+    """
+    Returns the name of the format of `filename`: from the extension if it
+    belongs to a single format, otherwise from the first bytes of the file
+    and, as a last resort, from the extension of files without a header.
+
+    :param string filename: the name of the file.
+    :return: name: the name of the format.
+    :rtype: string
+    """
+    __, extension = os.path.splitext(filename)
+    candidates = [
+        name for name, (__, __, extensions) in _HANDLERS.items()
+        if extension.lower() in extensions
+    ]
+    if len(candidates) == 1 and extension:
+        return candidates[0]
+
+    if os.path.isfile(filename):
+        with open(filename, 'rb') as input_file:
+            header = input_file.read(HEADER_SIZE)
+        size = os.path.getsize(filename)
+        for name, signature in _SIGNATURES:
+            if signature(header, size):
+                return name
+    if candidates:
+        return candidates[0]
+    raise ValueError(
+        'The format of the file {0!s} is not recognized.'.format(filename))
+
+
+def get_handler(filename):
+    """
+    Returns a new instance of the handler of `filename`, importing its
+    module if needed.
+
+    :param string filename: the name of the file.
+    :return: handler: the file handler.
+    :rtype: FileHandler
+    """
+    module, class_name, __ = _HANDLERS[detect(filename)]
+    return getattr(importlib.import_module(module), class_name)()
+
+
+def get_deformer(parameters, mesh_points):
+    """
+    Returns the deformation matching the class of the `parameters`, e.g. an
+    FFD for FFDParameters, importing its module if needed.
+
+    :param parameters: the parameters of the deformation.
+    :param numpy.ndarray mesh_points: the points to deform.
+    :return: deformer: the object with the perform method.
+    """
+    name = type(parameters).__name__
+    if name not in _DEFORMERS:
+        raise TypeError(
+            'No deformation is associated to {0!s}.'.format(name))
+    module, class_name = _DEFORMERS[name]
+    return getattr(importlib.import_module(module), class_name)(parameters,
+                                                                mesh_points)
+
+
+def morph(infile, outfile, deformer):
+    """
+    Reads the points of `infile`, deforms them and writes `outfile`, which
+    has the same format of `infile`. The arrays are passed from a stage to
+    the next one as they are.
+
+    :param string infile: the name of the input file.
+    :param string outfile: the name of the output file.
+    :param deformer: a function that takes the `n_points`-by-3 array of the
+        points and returns the deformed ones, or the parameters of an FFD,
+        RBF or IDW deformation.
+    :return: timings: the time in seconds taken by each stage: 'parse',
+        'deform' and 'write'.
+    :rtype: collections.OrderedDict
+    """
+    timings = OrderedDict()
+    start = timer()
+    handler = get_handler(infile)
+    if os.path.splitext(outfile)[1].lower() not in handler.extensions:
+        raise ValueError(
+            'The output file {0!s} must have the format of {1!s}.'.format(
+                outfile, infile))
+    mesh_points = handler.parse(infile)
+    timings['parse'] = timer() - start
+
+    start = timer()
+    if callable(deformer):
+        mesh_points = deformer(mesh_points)
+    else:
+        deformation = get_deformer(deformer, mesh_points)
+        deformation.perform()
+        mesh_points = deformation.modified_mesh_points
+    timings['deform'] = timer() - start
+
+    start = timer()
+    handler.write(np.asarray(mesh_points), outfile)
+    timings['write'] = timer() - start
+    return timings
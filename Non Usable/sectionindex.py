@@ -0,0 +1,189 @@
+"""
+Module with the byte offset index of the sections of a mesh file, so that the
+handlers can seek straight to the blocks they need and copy everything else in
+bulk.
+"""
+import os
+import tempfile
+import zipfile
+
+
+class SectionIndex(object):
+    """
+    Byte offset index of the sections of a file. The index is saved next to
+    the file as a sidecar and it is valid as long as the size and the
+    modification time of the file do not change.
+
+    :param string filename: name of the indexed file.
+    :cvar string filename: name of the indexed file.
+    :cvar int size: size in bytes of the indexed file.
+    :cvar float mtime: modification time of the indexed file.
+    :cvar list names: name of each section, e.g. '*NODE' or '2411'.
+    :cvar numpy.ndarray bounds: `n_sections`-by-2 array with the byte
+        offsets of the beginning and the end of the body of each section.
+    :cvar numpy.ndarray line_counts: number of lines of each section body.
+    :cvar dict arrays: additional arrays specific to a file format, e.g. the
+        byte offsets of the node lines of a k file.
+    """
+
+    def __init__(self, filename):
+        import numpy as np
+        stat = os.stat(filename)
+        self.filename = filename
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+        self.names = []
+        self.bounds = np.zeros((0, 2), dtype=np.int64)
+        self.line_counts = np.zeros(0, dtype=np.int64)
+        self.arrays = {}
+
+    @property
+    def sidecar(self):
+        """
+        The name of the file where the index is saved.
+
+        :rtype: string
+        """
+        return self.filename + '.idx.npz'
+
+    def add_sections(self, names, bounds, line_counts):
+        """
+        Appends sections to the index.
+
+        :param list names: names of the sections.
+        :param numpy.ndarray bounds: `n_sections`-by-2 array with the byte
+            offsets of the beginning and the end of the section bodies.
+        :param numpy.ndarray line_counts: number of lines of each body.
+        """
+        import numpy as np
+        self.names.extend(names)
+        self.bounds = np.vstack((self.bounds, np.reshape(bounds, (-1, 2))))
+        self.line_counts = np.append(self.line_counts, line_counts)
+
+    def find(self, name):
+        """
+        Returns the bounds of the sections called `name`.
+
+        :param string name: name of the section.
+        :return: bounds: `n`-by-2 array with the byte offsets of the
+            beginning and the end of the section bodies.
+        :rtype: numpy.ndarray
+        """
+        import numpy as np
+        mask = np.array([section == name for section in self.names], dtype=bool)
+        return self.bounds[mask.reshape(-1)]
+
+    def save(self):
+        """
+        Saves the index to the sidecar file. The index is written to a
+        temporary file in the same directory and then renamed, so that a
+        reader never sees a partial sidecar. Directories where we can not
+        write are silently skipped: the index is just rebuilt next time.
+        """
+        import numpy as np
+        directory = os.path.dirname(os.path.abspath(self.sidecar))
+        try:
+            descriptor, temporary = tempfile.mkstemp(
+                suffix='.tmp', prefix='.idx', dir=directory)
+        except (IOError, OSError):
+            return
+        try:
+            with os.fdopen(descriptor, 'wb') as output_file:
+                np.savez(
+                    output_file,
+                    size=self.size,
+                    mtime=self.mtime,
+                    names=np.array(self.names, dtype=str),
+                    bounds=self.bounds,
+                    line_counts=self.line_counts,
+                    **self.arrays)
+            os.replace(temporary, self.sidecar)
+        except (IOError, OSError):
+            try:
+                os.remove(temporary)
+            except OSError:
+                pass
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Loads the index of `filename` from its sidecar file.
+
+        :param string filename: name of the indexed file.
+        :return: index: the saved index, or None if there is no sidecar, if
+            it is corrupted or if the file changed after the index was saved.
+        :rtype: SectionIndex
+        """
+        import numpy as np
+        index = cls(filename)
+        if not os.path.isfile(index.sidecar):
+            return None
+        try:
+            with np.load(index.sidecar) as data:
+                if (int(data['size']) != index.size or
+                        float(data['mtime']) != index.mtime):
+                    return None
+                index.names = [str(name) for name in data['names']]
+                index.bounds = data['bounds'].reshape(-1, 2)
+                index.line_counts = data['line_counts']
+                index.arrays = dict((key, data[key]) for key in data.files
+                                    if key not in ('size', 'mtime', 'names',
+                                                   'bounds', 'line_counts'))
+        except (IOError, OSError, KeyError, ValueError, EOFError,
+                zipfile.BadZipFile):
+            return None
+        return index
+
+
+def split_lines(buffer):
+    """
+    Finds the lines of a file.
+
+    :param numpy.ndarray buffer: the bytes of the file.
+    :return: starts, lengths: the byte offset of the first character of
+        each line and its length, without the line ending.
+    :rtype: numpy.ndarray, numpy.ndarray
+    """
+    import numpy as np
+    ends = np.flatnonzero(buffer == ord('\n'))
+    if buffer.size and buffer[-1] != ord('\n'):
+        ends = np.append(ends, buffer.size)
+    starts = np.zeros(ends.size, dtype=np.int64)
+    starts[1:] = ends[:-1] + 1
+    # do not count the carriage return of dos line endings
+    has_cr = (ends > starts) & (buffer[np.maximum(ends - 1, 0)] == ord('\r'))
+    return starts, ends - starts - has_cr
+
+
+def copy_range(input_file, output_file, start, end, chunk_size=2**24):
+    """
+    Copies the bytes from `start` to `end` of `input_file` at the current
+    position of `output_file`, with os.sendfile when the platform has it.
+
+    :param file input_file: file opened for binary reading.
+    :param file output_file: file opened for binary writing.
+    :param int start: offset of the first byte to copy.
+    :param int end: offset after the last byte to copy.
+    :param int chunk_size: size of the blocks when copying through Python.
+    """
+    start, end = int(start), int(end)
+    output_file.flush()
+    if hasattr(os, 'sendfile'):
+        try:
+            while start < end:
+                sent = os.sendfile(output_file.fileno(), input_file.fileno(),
+                                   start, end - start)
+                if sent == 0:
+                    break
+                start += sent
+        except OSError:
+            pass
+        output_file.seek(0, os.SEEK_END)
+    input_file.seek(start)
+    while start < end:
+        chunk = input_file.read(min(chunk_size, end - start))
+        if not chunk:
+            break
+        output_file.write(chunk)
+        start += len(chunk)
+
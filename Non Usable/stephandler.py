@@ -1,10 +1,6 @@
 """
 Derived module from nurbshandler.py to handle step and stp files.
 """
-from OCC.IFSelect import IFSelect_RetDone
-from OCC.Interface import Interface_Static_SetCVal
-from OCC.STEPControl import STEPControl_Writer, STEPControl_Reader
-from OCC.STEPControl import STEPControl_AsIs
 from pygem.nurbshandler import NurbsHandler
 
 
@@ -41,6 +37,9 @@ class StepHandler(NurbsHandler):
         :return: shape: loaded shape
         :rtype: TopoDS_Shape
         """
+        from OCC.IFSelect import IFSelect_RetDone
+        from OCC.STEPControl import STEPControl_Reader
+
         self._check_filename_type(filename)
         self._check_extension(filename)
         reader = STEPControl_Reader()
@@ -64,6 +63,9 @@ class StepHandler(NurbsHandler):
         :param string filename: name of the input file.
             It should have proper extension (.step or .stp)
         """
+        from OCC.Interface import Interface_Static_SetCVal
+        from OCC.STEPControl import STEPControl_Writer, STEPControl_AsIs
+
         self._check_filename_type(filename)
         self._check_extension(filename)
         step_writer = STEPControl_Writer()
@@ -1,12 +1,21 @@
 """
 Derived module from filehandler.py to handle STereoLithography files.
 """
-import numpy as np
-from mpl_toolkits import mplot3d
-import matplotlib.pyplot as plt
-import mpl_toolkits.mplot3d as a3
+import os
+import re
 import pygem.filehandler as fh
-import vtk
+
+# fields of a facet of a binary file, a numpy dtype
+_BINARY_FACET = [('normal', '<f4', (3,)), ('vertices', '<f4', (3, 3)),
+                 ('attribute', '<u2')]
+
+_ASCII_FACET = (' facet normal %.16e %.16e %.16e\n'
+                '  outer loop\n'
+                '   vertex %.16e %.16e %.16e\n'
+                '   vertex %.16e %.16e %.16e\n'
+                '   vertex %.16e %.16e %.16e\n'
+                '  endloop\n'
+                ' endfacet\n')
 
 
 class StlHandler(fh.FileHandler):
@@ -17,47 +26,73 @@ class StlHandler(fh.FileHandler):
     :cvar string outfile: name of the output file where to write in.
     :cvar list extensions: extensions of the input/output files. It is equal to
         ['.stl'].
+    :cvar numpy.ndarray faces: `n_faces`-by-3 array with the indices of the
+        points of each triangle. It is set by the parse method.
     """
 
     def __init__(self):
         super(StlHandler, self).__init__()
         self.extensions = ['.stl']
+        self.faces = None
 
-    def parse(self, filename):
+    def parse(self, filename, weld=True):
         """
         Method to parse the `filename`. It returns a matrix with all the
-        coordinates.
+        coordinates. The file is read without VTK: binary files through a
+        structured dtype, ascii files with a vectorized tokenizer. The
+        connectivity of the triangles is stored in `self.faces`.
 
         :param string filename: name of the input file.
-        
+        :param bool weld: if True coincident vertices are merged, as the VTK
+            reader does, and `self.faces` refers to the merged points. If
+            False every triangle keeps its own three vertices. Default is
+            True.
+
         :return: mesh_points: it is a `n_points`-by-3 matrix containing the
             coordinates of the points of the mesh
         :rtype: numpy.ndarray
         """
+        import numpy as np
         self._check_filename_type(filename)
         self._check_extension(filename)
 
         self.infile = filename
 
-        reader = vtk.vtkSTLReader()
-        reader.SetFileName(self.infile)
-        reader.Update()
-        data = reader.GetOutput()
-
-        n_points = data.GetNumberOfPoints()
-        mesh_points = np.zeros([n_points, 3])
-
-        for i in range(n_points):
-            mesh_points[i][0], mesh_points[i][1], mesh_points[i][
-                2] = data.GetPoint(i)
+        if self._is_binary(self.infile):
+            vertices = self._read_binary(self.infile)
+        else:
+            vertices = self._read_ascii(self.infile)
+        vertices = vertices.reshape(-1, 3)
+
+        if weld:
+            # merge equal points keeping the order of first appearance, as
+            # vtkSTLReader does: sort, flag the first of each run of equal
+            # points, then renumber the runs by their first appearance
+            order = np.lexsort(vertices.T[::-1])
+            sorted_vertices = vertices[order]
+            first_in_run = np.ones(order.size, dtype=bool)
+            first_in_run[1:] = np.any(
+                sorted_vertices[1:] != sorted_vertices[:-1], axis=1)
+            run = np.cumsum(first_in_run) - 1
+            first = order[first_in_run]
+            rank = np.empty_like(first)
+            rank[np.argsort(first)] = np.arange(first.size)
+            inverse = np.empty_like(order)
+            inverse[order] = rank[run]
+            mesh_points = vertices[np.sort(first)].astype(np.float64)
+            self.faces = inverse.reshape(-1, 3)
+        else:
+            mesh_points = vertices.astype(np.float64)
+            self.faces = np.arange(vertices.shape[0]).reshape(-1, 3)
 
         return mesh_points
 
     def write(self, mesh_points, filename, write_bin=False):
         """
-        Writes a stl file, called filename, copying all the lines from
-        self.filename but the coordinates. mesh_points is a matrix that contains
-        the new coordinates to write in the stl file.
+        Writes a stl file, called filename, with the triangles of
+        self.infile and the coordinates in mesh_points. mesh_points is a
+        matrix that contains the new coordinates to write in the stl file.
+        The facet normals are computed from the new coordinates.
 
         :param numpy.ndarray mesh_points: it is a `n_points`-by-3 matrix
             containing the coordinates of the points of the mesh.
@@ -65,35 +100,119 @@ class StlHandler(fh.FileHandler):
         :param boolean write_bin: flag to write in the binary format. Default is
             False.
         """
+        import numpy as np
         self._check_filename_type(filename)
         self._check_extension(filename)
         self._check_infile_instantiation()
 
         self.outfile = filename
 
-        reader = vtk.vtkSTLReader()
-        reader.SetFileName(self.infile)
-        reader.Update()
-        data = reader.GetOutput()
+        vertices = np.asarray(mesh_points)[self.faces]
+        normals = np.cross(vertices[:, 1] - vertices[:, 0],
+                           vertices[:, 2] - vertices[:, 0])
+        norm = np.linalg.norm(normals, axis=1)
+        normals /= np.where(norm > 0., norm, 1.)[:, np.newaxis]
 
-        points = vtk.vtkPoints()
+        if write_bin:
+            self._write_binary(self.outfile, vertices, normals)
+        else:
+            self._write_ascii(self.outfile, vertices, normals)
 
-        for i in range(data.GetNumberOfPoints()):
-            points.InsertNextPoint(mesh_points[i, :])
+    @staticmethod
+    def _is_binary(filename):
+        """
+        This private static method checks if `filename` is a binary stl: the
+        size of a binary file is fixed by the number of triangles stored in
+        its header.
 
-        data.SetPoints(points)
+        :param string filename: file to check.
+        :rtype: bool
+        """
+        import numpy as np
+        with open(filename, 'rb') as input_file:
+            header = input_file.read(84)
+        if len(header) < 84:
+            return False
+        n_faces = int(np.frombuffer(header[80:], dtype='<u4')[0])
+        return os.path.getsize(filename) == 84 + n_faces * np.dtype(
+            _BINARY_FACET).itemsize
+
+    @staticmethod
+    def _read_binary(filename):
+        """
+        This private static method reads the triangles of a binary stl file.
 
-        writer = vtk.vtkSTLWriter()
-        writer.SetFileName(self.outfile)
+        :param string filename: name of the input file.
+        :return: vertices: the `n_faces`-by-3-by-3 array of the vertices.
+        :rtype: numpy.ndarray
+        """
+        import numpy as np
+        with open(filename, 'rb') as input_file:
+            input_file.seek(80)
+            n_faces = np.fromfile(input_file, dtype='<u4', count=1)[0]
+            facets = np.fromfile(input_file, dtype=_BINARY_FACET, count=n_faces)
+        return facets['vertices']
+
+    @staticmethod
+    def _read_ascii(filename):
+        """
+        This private static method reads the triangles of an ascii stl file:
+        the text following the `vertex` keyword at the beginning of a line is
+        gathered and converted with a single call.
 
-        writer.SetInputData(data)
+        :param string filename: name of the input file.
+        :return: vertices: the `n_faces`-by-3-by-3 array of the vertices.
+        :rtype: numpy.ndarray
+        """
+        import numpy as np
+        with open(filename, 'rb') as input_file:
+            vertex_fields = re.findall(br'^\s*vertex\s+([^\n]*)',
+                                       input_file.read(), re.M)
+        coordinates = np.fromstring(b' '.join(vertex_fields), sep=' ')
+        if coordinates.size != 3 * len(vertex_fields):
+            raise ValueError(
+                'The vertices of {0!s} do not have three coordinates each.'.
+                format(filename))
+        return coordinates.reshape(-1, 3, 3)
+
+    @staticmethod
+    def _write_binary(filename, vertices, normals):
+        """
+        This private static method writes the triangles to a binary stl file.
 
-        if write_bin:
-            writer.SetFileTypeToBinary()
-        else:
-            writer.SetFileTypeToASCII()
+        :param string filename: name of the output file.
+        :param numpy.ndarray vertices: `n_faces`-by-3-by-3 array of vertices.
+        :param numpy.ndarray normals: `n_faces`-by-3 array of facet normals.
+        """
+        import numpy as np
+        facets = np.zeros(vertices.shape[0], dtype=_BINARY_FACET)
+        facets['normal'] = normals
+        facets['vertices'] = vertices
+        with open(filename, 'wb') as output_file:
+            output_file.write(b'binary stl'.ljust(80, b' '))
+            np.array([facets.size], dtype='<u4').tofile(output_file)
+            facets.tofile(output_file)
+
+    @staticmethod
+    def _write_ascii(filename, vertices, normals, chunk_size=2**16):
+        """
+        This private static method writes the triangles to an ascii stl file,
+        formatting `chunk_size` facets at a time.
 
-        writer.Write()
+        :param string filename: name of the output file.
+        :param numpy.ndarray vertices: `n_faces`-by-3-by-3 array of vertices.
+        :param numpy.ndarray normals: `n_faces`-by-3 array of facet normals.
+        :param int chunk_size: number of facets formatted at once.
+        """
+        import numpy as np
+        values = np.hstack((normals, vertices.reshape(-1, 9)))
+        with open(filename, 'w') as output_file:
+            output_file.write('solid ascii\n')
+            for start in range(0, values.shape[0], chunk_size):
+                chunk = values[start:start + chunk_size]
+                output_file.write(
+                    _ASCII_FACET * chunk.shape[0] % tuple(chunk.ravel().tolist()))
+            output_file.write('endsolid\n')
 
     def plot(self, plot_file=None, save_fig=False):
         """
@@ -108,33 +227,27 @@ class StlHandler(fh.FileHandler):
             geometry
         :rtype: matplotlib.pyplot.figure
         """
+        import numpy as np
+        import matplotlib.pyplot as plt
+        import mpl_toolkits.mplot3d as a3
+
         if plot_file is None:
             plot_file = self.infile
         else:
             self._check_filename_type(plot_file)
 
-        # Read the source file.
-        reader = vtk.vtkSTLReader()
-        reader.SetFileName(plot_file)
-        reader.Update()
-
-        data = reader.GetOutput()
-        points = data.GetPoints()
-        ncells = data.GetNumberOfCells()
+        # Read the source file: the vertices of each triangle
+        if self._is_binary(plot_file):
+            vtx = self._read_binary(plot_file)
+        else:
+            vtx = self._read_ascii(plot_file)
 
-        # for each cell it contains the indeces of the points that define the cell
         figure = plt.figure()
         axes = a3.Axes3D(figure)
-        vtx = np.zeros((ncells, 3, 3))
-        for i in range(0, ncells):
-            for j in range(0, 3):
-                cell = data.GetCell(i).GetPointId(j)
-                vtx[i][j][0], vtx[i][j][1], vtx[i][j][2] = points.GetPoint(
-                    int(cell))
-            tri = a3.art3d.Poly3DCollection([vtx[i]])
-            tri.set_color('b')
-            tri.set_edgecolor('k')
-            axes.add_collection3d(tri)
+        tri = a3.art3d.Poly3DCollection(vtx)
+        tri.set_color('b')
+        tri.set_edgecolor('k')
+        axes.add_collection3d(tri)
 
         ## Get the limits of the axis and center the geometry
         max_dim = np.array(
@@ -169,6 +282,8 @@ class StlHandler(fh.FileHandler):
 
         :param string show_file: the vtk filename you want to show.
         """
+        import vtk
+
         if show_file is None:
             show_file = self.infile
         else:
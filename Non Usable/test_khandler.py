@@ -0,0 +1,216 @@
+""" Tests of the LS-DYNA keyword file handler """
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from pygem.khandler import KHandler
+from pygem.sectionindex import SectionIndex
+
+POINTS = np.array([[0., 0., 0.], [1.5, -2.25, 3.], [-0.125, 4., 1e3],
+                   [7., 8., 9.]])
+
+
+def node_line(label, point, tail='       0       0'):
+    return '%8d%16.10f%16.10f%16.10f%s' % ((label, ) + tuple(point) + (tail, ))
+
+
+DECK = '\n'.join([
+    '*KEYWORD',
+    '$ a comment before the nodes',
+    '*NODE',
+    '$    nid               x               y               z      tc      rc',
+    node_line(1, POINTS[0]),
+    '',
+    node_line(2, POINTS[1]),
+    '*NODE_SET',
+    '       1',
+    '*ELEMENT_SOLID',
+    '       1       1       1       2       3       4       4       4       4'
+    '       4',
+    '*node',
+    node_line(3, POINTS[2], tail=''),
+    '$ a comment between the nodes',
+    node_line(4, POINTS[3]),
+    '*END',
+    '',
+])
+
+
+class KHandlerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def deck(self, content=DECK, name='deck.k', newline='\n'):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'wb') as output_file:
+            output_file.write(content.replace('\n', newline).encode('ascii'))
+        return filename
+
+    def read(self, filename):
+        with open(filename, 'rb') as input_file:
+            return input_file.read()
+
+    def assertOnlyCoordinatesChanged(self, original, modified):
+        original_lines = self.read(original).splitlines(True)
+        modified_lines = self.read(modified).splitlines(True)
+        self.assertEqual(len(original_lines), len(modified_lines))
+        for before, after in zip(original_lines, modified_lines):
+            self.assertEqual(before[:8], after[:8])
+            self.assertEqual(before[56:], after[56:])
+
+
+class TestKHandler(KHandlerTestCase):
+
+    def test_parse(self):
+        handler = KHandler()
+        mesh_points = handler.parse(self.deck())
+        np.testing.assert_array_equal(mesh_points, POINTS)
+        np.testing.assert_array_equal(handler.node_ids, [1, 2, 3, 4])
+
+    def test_parse_crlf(self):
+        mesh_points = KHandler().parse(self.deck(newline='\r\n'))
+        np.testing.assert_array_equal(mesh_points, POINTS)
+
+    def test_parse_no_nodes(self):
+        filename = self.deck('*KEYWORD\n*END\n')
+        self.assertEqual(KHandler().parse(filename).shape, (0, 3))
+
+    def test_parse_short_node_line(self):
+        filename = self.deck('*NODE\n       1             0.0\n*END\n')
+        with self.assertRaises(ValueError):
+            KHandler().parse(filename)
+
+    def test_write(self):
+        original = self.deck()
+        handler = KHandler()
+        handler.parse(original)
+        output = os.path.join(self.directory, 'output.k')
+        handler.write(POINTS + 1., output)
+        np.testing.assert_array_equal(KHandler().parse(output), POINTS + 1.)
+        self.assertOnlyCoordinatesChanged(original, output)
+
+    def test_write_crlf(self):
+        original = self.deck(newline='\r\n')
+        handler = KHandler()
+        handler.parse(original)
+        output = os.path.join(self.directory, 'output.k')
+        handler.write(POINTS - 1., output)
+        np.testing.assert_array_equal(KHandler().parse(output), POINTS - 1.)
+        self.assertOnlyCoordinatesChanged(original, output)
+        self.assertEqual(self.read(output).count(b'\r\n'),
+                         self.read(original).count(b'\r\n'))
+
+    def test_write_same_file(self):
+        original = self.deck()
+        handler = KHandler()
+        handler.parse(original)
+        handler.write(POINTS * 2., original)
+        np.testing.assert_array_equal(KHandler().parse(original), POINTS * 2.)
+
+    def test_write_wrong_number_of_points(self):
+        handler = KHandler()
+        handler.parse(self.deck())
+        with self.assertRaises(ValueError):
+            handler.write(POINTS[:3], os.path.join(self.directory, 'output.k'))
+
+    def test_write_too_wide_coordinates(self):
+        handler = KHandler()
+        handler.parse(self.deck())
+        with self.assertRaises(ValueError):
+            handler.write(POINTS * 1e10, os.path.join(self.directory,
+                                                      'output.k'))
+
+    def test_write_inplace(self):
+        original = self.deck()
+        handler = KHandler()
+        handler.parse(original)
+        output = os.path.join(self.directory, 'output.k')
+        for shift in (1., 2.):
+            handler.write_inplace(POINTS + shift, output)
+            np.testing.assert_array_equal(KHandler().parse(output),
+                                          POINTS + shift)
+            self.assertOnlyCoordinatesChanged(original, output)
+
+    def test_write_inplace_equals_write(self):
+        original = self.deck(newline='\r\n')
+        handler = KHandler()
+        handler.parse(original)
+        written = os.path.join(self.directory, 'written.k')
+        patched = os.path.join(self.directory, 'patched.k')
+        handler.write(POINTS / 3., written)
+        handler.write_inplace(POINTS / 3., patched)
+        self.assertEqual(self.read(written), self.read(patched))
+
+
+class TestKHandlerIndex(KHandlerTestCase):
+
+    def test_sidecar_reused(self):
+        filename = self.deck()
+        KHandler().parse(filename)
+        self.assertTrue(os.path.isfile(filename + '.idx.npz'))
+        with mock.patch.object(KHandler, '_build_index') as build:
+            mesh_points = KHandler().parse(filename)
+        build.assert_not_called()
+        np.testing.assert_array_equal(mesh_points, POINTS)
+
+    def test_stale_sidecar_rebuilt(self):
+        filename = self.deck()
+        KHandler().parse(filename)
+        with open(filename, 'r+b') as output_file:
+            content = output_file.read()
+            output_file.seek(0)
+            output_file.write(b'$ a new first line\n' + content)
+        np.testing.assert_array_equal(KHandler().parse(filename), POINTS)
+
+    def test_corrupted_sidecar_rebuilt(self):
+        filename = self.deck()
+        KHandler().parse(filename)
+        with open(filename + '.idx.npz', 'r+b') as output_file:
+            output_file.truncate(20)
+        np.testing.assert_array_equal(KHandler().parse(filename), POINTS)
+        self.assertIsNotNone(SectionIndex.load(filename))
+
+    def test_write_inplace_input_keeps_sidecar(self):
+        filename = self.deck()
+        handler = KHandler()
+        handler.parse(filename)
+        handler.write_inplace(POINTS + 1., filename)
+        self.assertIsNotNone(SectionIndex.load(filename))
+        with mock.patch.object(KHandler, '_build_index') as build:
+            mesh_points = KHandler().parse(filename)
+        build.assert_not_called()
+        np.testing.assert_array_equal(mesh_points, POINTS + 1.)
+
+    def test_write_inplace_copies_once(self):
+        handler = KHandler()
+        handler.parse(self.deck())
+        output = os.path.join(self.directory, 'output.k')
+        with mock.patch('shutil.copyfile', wraps=shutil.copyfile) as copy:
+            handler.write_inplace(POINTS + 1., output)
+            handler.write_inplace(POINTS + 2., output)
+        self.assertEqual(copy.call_count, 1)
+        np.testing.assert_array_equal(KHandler().parse(output), POINTS + 2.)
+
+    def test_write_inplace_replaces_other_deck(self):
+        handler = KHandler()
+        handler.parse(self.deck())
+        # same size and header, different node IDs
+        other = self.deck(DECK.replace(node_line(2, POINTS[1]),
+                                       node_line(5, POINTS[1])),
+                          name='output.k')
+        handler.write_inplace(POINTS + 1., other)
+        parsed = KHandler()
+        np.testing.assert_array_equal(parsed.parse(other), POINTS + 1.)
+        np.testing.assert_array_equal(parsed.node_ids, [1, 2, 3, 4])
+
+
+if __name__ == '__main__':
+    unittest.main()
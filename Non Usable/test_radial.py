@@ -0,0 +1,138 @@
+""" Tests of the hierarchical backend of the RBF against the dense one """
+import unittest
+import warnings
+
+import numpy as np
+
+from pygem.radial import RBF
+
+TOLERANCES = [1e-4, 1e-6, 1e-8]
+
+
+class Parameters(object):
+
+    def __init__(self, basis, radius, original_control_points):
+        self.basis = basis
+        self.radius = radius
+        self.power = 2
+        self.original_control_points = original_control_points
+        self.deformed_control_points = original_control_points + 0.02 * np.sin(
+            4. * original_control_points)
+
+
+def _parameters(basis, radius, n_controls=2000):
+    random = np.random.RandomState(0)
+    parameters = Parameters(basis, radius, random.uniform(size=(n_controls,
+                                                                3)))
+    return parameters, random.uniform(size=(500, 3))
+
+
+def _residual(rbf):
+    """ Interpolation residual at the control points, with the exact basis """
+    X = rbf.control_points
+    n_controls = X.shape[0]
+    weights = rbf.weights
+    interpolated = (rbf._kernel(X, X).dot(weights[:n_controls]) +
+                    weights[n_controls] + X.dot(weights[n_controls + 1:]))
+    return np.abs(interpolated - rbf.parameters.deformed_control_points).max()
+
+
+class TestHierarchicalRBF(unittest.TestCase):
+
+    def assertCloseToDense(self, basis, radius, n_controls=2000):
+        parameters, mesh_points = _parameters(basis, radius, n_controls)
+        dense = RBF(parameters, mesh_points)
+        dense.perform()
+        for tolerance in TOLERANCES:
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                hierarchical = RBF(parameters,
+                                   mesh_points,
+                                   backend='hierarchical',
+                                   tolerance=tolerance)
+                hierarchical.perform()
+            factorization = hierarchical.factorization
+            self.assertEqual(factorization.method, 'gmres')
+            self.assertFalse(factorization.flat)
+            self.assertIsNotNone(factorization.preconditioner)
+            # the displacements are about 0.02
+            np.testing.assert_allclose(hierarchical.modified_mesh_points,
+                                       dense.modified_mesh_points,
+                                       rtol=0,
+                                       atol=0.2 * tolerance)
+
+    def assertFlat(self, basis, radius, tolerance, attainable):
+        parameters, mesh_points = _parameters(basis, radius)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            hierarchical = RBF(parameters,
+                               mesh_points,
+                               backend='hierarchical',
+                               tolerance=tolerance)
+        factorization = hierarchical.factorization
+        self.assertEqual(factorization.method, 'gmres')
+        self.assertTrue(factorization.flat)
+        self.assertIsNone(factorization.preconditioner)
+        self.assertIsNotNone(factorization.eigenvectors)
+        stagnated = [
+            warning for warning in caught
+            if issubclass(warning.category, RuntimeWarning)
+        ]
+        self.assertEqual(len(stagnated), 0 if attainable else 1)
+        if attainable:
+            # the flat interpolant is ill posed away from the control points,
+            # so only the residual is compared
+            self.assertLess(_residual(hierarchical), 0.2 * tolerance)
+
+    def test_thin_plate_spline(self):
+        self.assertCloseToDense('thin_plate_spline', 0.5)
+
+    def test_multi_quadratic(self):
+        self.assertCloseToDense('multi_quadratic_biharmonic_spline', 0.1)
+
+    def test_small_thin_plate_spline(self):
+        self.assertCloseToDense('thin_plate_spline', 0.5, n_controls=500)
+
+    def test_flat_multi_quadratic(self):
+        self.assertFlat('multi_quadratic_biharmonic_spline', 0.5, 1e-4, True)
+        self.assertFlat('multi_quadratic_biharmonic_spline', 0.5, 1e-6, True)
+
+    def test_flat_multi_quadratic_stagnation(self):
+        self.assertFlat('multi_quadratic_biharmonic_spline', 0.5, 1e-8, False)
+
+    def test_flatter_multi_quadratic(self):
+        self.assertFlat('multi_quadratic_biharmonic_spline', 1.0, 1e-4, True)
+        self.assertFlat('multi_quadratic_biharmonic_spline', 1.0, 1e-8, False)
+
+    def test_cached_factorization_not_modified(self):
+        parameters, mesh_points = _parameters(
+            'multi_quadratic_biharmonic_spline', 0.5)
+        RBF.clear_cache()
+        try:
+            first = RBF(parameters,
+                        mesh_points,
+                        backend='hierarchical',
+                        tolerance=1e-4,
+                        cache=True)
+            first.perform()
+            factor = first.factorization.factor
+            state = dict(first.factorization.__dict__)
+            second = RBF(parameters,
+                         mesh_points,
+                         backend='hierarchical',
+                         tolerance=1e-4,
+                         cache=True)
+            second.perform()
+        finally:
+            RBF.clear_cache()
+        self.assertIs(second.factorization, first.factorization)
+        self.assertIs(second.factorization.factor, factor)
+        self.assertEqual(second.factorization.__dict__.keys(), state.keys())
+        for key, value in state.items():
+            self.assertIs(second.factorization.__dict__[key], value)
+        np.testing.assert_array_equal(second.modified_mesh_points,
+                                      first.modified_mesh_points)
+
+
+if __name__ == '__main__':
+    unittest.main()
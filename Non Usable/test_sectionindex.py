@@ -0,0 +1,65 @@
+""" Tests of the byte offset index of the sections of a mesh file """
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from pygem.sectionindex import SectionIndex
+
+
+class TestSectionIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'mesh.k')
+        with open(self.filename, 'w') as output_file:
+            output_file.write('*NODE\n       1             0.0\n*END\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _index(self):
+        index = SectionIndex(self.filename)
+        index.add_sections(['*NODE'], [[6, 30]], [1])
+        index.arrays['offsets'] = np.array([6], dtype=np.int64)
+        return index
+
+    def test_round_trip(self):
+        self._index().save()
+        index = SectionIndex.load(self.filename)
+        self.assertEqual(index.names, ['*NODE'])
+        np.testing.assert_array_equal(index.find('*NODE'), [[6, 30]])
+        np.testing.assert_array_equal(index.line_counts, [1])
+        np.testing.assert_array_equal(index.arrays['offsets'], [6])
+
+    def test_save_leaves_no_temporary_file(self):
+        self._index().save()
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['mesh.k', 'mesh.k.idx.npz'])
+
+    def test_truncated_sidecar(self):
+        index = self._index()
+        index.save()
+        with open(index.sidecar, 'rb') as input_file:
+            content = input_file.read()
+        for size in (0, 10, len(content) // 2, len(content) - 1):
+            with open(index.sidecar, 'wb') as output_file:
+                output_file.write(content[:size])
+            self.assertIsNone(SectionIndex.load(self.filename))
+
+    def test_garbage_sidecar(self):
+        with open(self._index().sidecar, 'wb') as output_file:
+            output_file.write(b'PK\x03\x04 not a zip file')
+        self.assertIsNone(SectionIndex.load(self.filename))
+
+    def test_changed_file(self):
+        self._index().save()
+        with open(self.filename, 'a') as output_file:
+            output_file.write('\n')
+        self.assertIsNone(SectionIndex.load(self.filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,163 @@
+""" Tests of the Universal file handler """
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from pygem.unvhandler import UnvHandler
+
+POINTS = np.array([[0., 0., 0.], [1.5, -2.25, 3.], [-0.125, 4., 1e3],
+                   [7., 8., 9.]])
+
+
+def node_records(labels, points, exponent='E'):
+    lines = []
+    for label, point in zip(labels, points):
+        lines.append('%10d%10d%10d%10d' % (label, 1, 1, 11))
+        lines.append(''.join('%25.16E' % value
+                             for value in point).replace('E', exponent))
+    return lines
+
+
+def dataset(number, lines):
+    return ['    -1', '%6d' % number] + lines + ['    -1']
+
+
+ELEMENTS = [
+    # a triangle, a beam with its additional record, a tetrahedron
+    '%10d%10d%10d%10d%10d%10d' % (1, 91, 1, 1, 7, 3),
+    '%10d%10d%10d' % (1, 2, 3),
+    '%10d%10d%10d%10d%10d%10d' % (2, 21, 1, 1, 7, 2),
+    '%10d%10d%10d' % (0, 1, 1),
+    '%10d%10d' % (1, 4),
+    '%10d%10d%10d%10d%10d%10d' % (3, 111, 1, 1, 7, 4),
+    '%10d%10d%10d%10d' % (1, 2, 3, 4),
+    '%10d%10d%10d%10d%10d%10d' % (4, 21, 1, 1, 7, 2),
+    '%10d%10d%10d' % (0, 1, 1),
+    '%10d%10d' % (2, 3),
+]
+
+UNV = '\n'.join(
+    dataset(164, ['         1Meter (newton)               2',
+                  '    1.0000000000000000E+00    1.0000000000000000E+00'
+                  '    1.0000000000000000E+00']) +
+    dataset(2411, node_records([1, 2], POINTS[:2], exponent='D')) +
+    dataset(2412, ELEMENTS) +
+    dataset(2411, node_records([3, 4], POINTS[2:])) + [''])
+
+
+class TestUnvHandler(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def unv(self, content=UNV, name='mesh.unv', newline='\n'):
+        filename = os.path.join(self.directory, name)
+        with open(filename, 'wb') as output_file:
+            output_file.write(content.replace('\n', newline).encode('ascii'))
+        return filename
+
+    def read(self, filename):
+        with open(filename, 'rb') as input_file:
+            return input_file.read()
+
+    def test_parse_nodes(self):
+        handler = UnvHandler()
+        np.testing.assert_array_equal(handler.parse(self.unv()), POINTS)
+        np.testing.assert_array_equal(handler.node_labels, [1, 2, 3, 4])
+
+    def test_parse_crlf(self):
+        handler = UnvHandler()
+        mesh_points = handler.parse(self.unv(newline='\r\n'))
+        np.testing.assert_array_equal(mesh_points, POINTS)
+        self.assertEqual(sorted(handler.elements), [21, 91, 111])
+
+    def test_parse_elements(self):
+        handler = UnvHandler()
+        handler.parse(self.unv())
+        self.assertEqual(sorted(handler.elements), [21, 91, 111])
+        np.testing.assert_array_equal(handler.elements[91]['labels'], [1])
+        np.testing.assert_array_equal(handler.elements[91]['connectivity'],
+                                      [[1, 2, 3]])
+        np.testing.assert_array_equal(handler.elements[21]['labels'], [2, 4])
+        np.testing.assert_array_equal(handler.elements[21]['connectivity'],
+                                      [[1, 4], [2, 3]])
+        np.testing.assert_array_equal(handler.elements[111]['connectivity'],
+                                      [[1, 2, 3, 4]])
+
+    def test_parse_uniform_elements(self):
+        content = '\n'.join(
+            dataset(2411, node_records([1, 2, 3, 4], POINTS)) +
+            dataset(2412, ELEMENTS[:2] + ELEMENTS[:2]) + [''])
+        handler = UnvHandler()
+        handler.parse(self.unv(content))
+        np.testing.assert_array_equal(handler.elements[91]['connectivity'],
+                                      [[1, 2, 3], [1, 2, 3]])
+
+    def test_parse_only_beams(self):
+        content = '\n'.join(
+            dataset(2411, node_records([1, 2, 3, 4], POINTS)) +
+            dataset(2412, ELEMENTS[2:5] + ELEMENTS[7:]) + [''])
+        handler = UnvHandler()
+        handler.parse(self.unv(content))
+        np.testing.assert_array_equal(handler.elements[21]['connectivity'],
+                                      [[1, 4], [2, 3]])
+
+    def test_parse_incomplete_elements(self):
+        content = '\n'.join(
+            dataset(2411, node_records([1], POINTS[:1])) +
+            dataset(2412, ELEMENTS[:1]) + [''])
+        with self.assertRaises(ValueError):
+            UnvHandler().parse(self.unv(content))
+
+    def test_parse_unterminated_dataset(self):
+        with self.assertRaises(ValueError):
+            UnvHandler().parse(self.unv(UNV.rstrip('\n').rsplit('\n', 1)[0]))
+
+    def test_write(self):
+        original = self.unv(newline='\r\n')
+        handler = UnvHandler()
+        handler.parse(original)
+        output = os.path.join(self.directory, 'output.unv')
+        handler.write(POINTS / 3., output)
+        parsed = UnvHandler()
+        np.testing.assert_array_equal(parsed.parse(output), POINTS / 3.)
+        np.testing.assert_array_equal(parsed.node_labels, [1, 2, 3, 4])
+        for descriptor, group in handler.elements.items():
+            np.testing.assert_array_equal(
+                parsed.elements[descriptor]['connectivity'],
+                group['connectivity'])
+        original_lines = self.read(original).splitlines(True)
+        output_lines = self.read(output).splitlines(True)
+        self.assertEqual(len(original_lines), len(output_lines))
+        self.assertTrue(all(line.endswith(b'\r\n') for line in output_lines))
+        # only the coordinate lines differ
+        changed = [
+            i for i, (before, after) in enumerate(
+                zip(original_lines, output_lines)) if before != after
+        ]
+        self.assertEqual(len(changed), 4)
+
+    def test_write_same_file(self):
+        original = self.unv()
+        handler = UnvHandler()
+        handler.parse(original)
+        handler.write(POINTS + 1., original)
+        np.testing.assert_array_equal(UnvHandler().parse(original),
+                                      POINTS + 1.)
+
+    def test_write_wrong_number_of_points(self):
+        handler = UnvHandler()
+        handler.parse(self.unv())
+        with self.assertRaises(ValueError):
+            handler.write(POINTS[:3], os.path.join(self.directory,
+                                                   'output.unv'))
+
+
+if __name__ == '__main__':
+    unittest.main()
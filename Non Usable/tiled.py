@@ -0,0 +1,106 @@
+"""
+Module with the tiled execution of the deformations: the mesh points are split
+in tiles, deformed independently by a pool of threads, each one writing its
+part of the preallocated output. NumPy, SciPy and BLAS release the GIL in the
+heavy kernels, so the tiles run in parallel; the threads of BLAS are capped
+while the tiles run, so that the cores are not oversubscribed.
+
+threadpoolctl is an optional dependency, needed only for the cap: without it
+more threads work as well, but BLAS keeps its own threads. The executors have
+a single thread by default, since the scaling with more threads depends on
+the machine and on the BLAS; benchmark_threads.py measures it.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+
+class TiledExecutor(object):
+    """
+    Class that runs a kernel on the tiles of a set of points with a pool of
+    threads.
+    :param int n_threads: the number of threads, or None for one thread for
+        each core. Default is 1.
+    :param int blas_threads: the number of threads of BLAS while the tiles
+        run in parallel. Default is None, that is the cores left to each
+        thread, at least one.
+    :cvar int n_threads: the number of threads.
+    :cvar int blas_threads: the number of threads of BLAS, or None.
+    :Example:
+    >>> from pygem.tiled import TiledExecutor
+    >>> from pygem.radial import RBF
+    >>> radial_trans = RBF(rbf_parameters, original_mesh_points)
+    >>> radial_trans.perform(executor=TiledExecutor(n_threads=8))
+    """
+
+    def __init__(self, n_threads=1, blas_threads=None):
+        if n_threads is None:
+            n_threads = os.cpu_count() or 1
+        self.n_threads = int(n_threads)
+        if self.n_threads < 1:
+            raise ValueError('The number of threads must be positive.')
+        self.blas_threads = blas_threads
+        self._local = threading.local()
+
+    def run(self, kernel, n_points, tile_size):
+        """
+        Runs `kernel(start, stop)` on the tiles of `n_points` points; the
+        kernel writes the result of the points from `start` to `stop` in its
+        part of the output. The exceptions of the kernel are raised here.
+        With more than one thread the threads of BLAS are capped, if
+        threadpoolctl is installed.
+        :param callable kernel: the function that deforms a tile.
+        :param int n_points: the number of points.
+        :param int tile_size: the number of points of a tile.
+        """
+        tiles = [(start, min(start + tile_size, n_points))
+                 for start in range(0, n_points, tile_size)]
+        n_threads = min(self.n_threads, len(tiles))
+        if n_threads <= 1:
+            for start, stop in tiles:
+                kernel(start, stop)
+            return
+
+        with self._limit_blas(n_threads):
+            with ThreadPoolExecutor(n_threads) as pool:
+                futures = [
+                    pool.submit(kernel, start, stop) for start, stop in tiles
+                ]
+                for future in futures:
+                    future.result()
+
+    def buffer(self, shape):
+        """
+        Returns an uninitialized array private to the calling thread, which
+        is reused by the following calls of the same thread, e.g. for the
+        distances of a tile from the control points.
+        :param tuple shape: the shape of the array.
+        :rtype: numpy.ndarray
+        """
+        size = int(np.prod(shape))
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None or buffer.size < size:
+            buffer = self._local.buffer = np.empty(size)
+        return buffer[:size].reshape(shape)
+
+    @contextmanager
+    def _limit_blas(self, n_threads):
+        """
+        This private method caps the threads of BLAS, while the context is
+        active, to `blas_threads` or to the cores left to each of the
+        `n_threads` threads. Without threadpoolctl it does nothing.
+        :param int n_threads: the number of threads running the tiles.
+        """
+        try:
+            from threadpoolctl import threadpool_limits
+        except ImportError:
+            yield
+            return
+        limit = self.blas_threads
+        if limit is None:
+            limit = max(1, (os.cpu_count() or 1) // n_threads)
+        with threadpool_limits(limits=limit, user_api='blas'):
+            yield
@@ -1,8 +1,15 @@
 """
 Derived module from filehandler.py to handle Universal (unv) files.
 """
-import numpy as np
+import io
+import os
 import pygem.filehandler as fh
+from pygem.sectionindex import SectionIndex, split_lines, copy_range
+
+# Fortran double precision exponents
+_EXPONENTS = bytes.maketrans(b'Dd', b'EE')
+# finite element descriptors of the beams, which have an additional record
+_BEAMS = (11, 21, 22, 23, 24)
 
 
 class UnvHandler(fh.FileHandler):
@@ -13,17 +20,30 @@ class UnvHandler(fh.FileHandler):
     :cvar string outfile: name of the output file where to write in.
     :cvar list extensions: extensions of the input/output files.
         It is equal to ['.unv'].
+    :cvar SectionIndex index: the byte offsets of the datasets of the input
+        file.
+    :cvar numpy.ndarray node_labels: the labels of the nodes read by the
+        parse method.
+    :cvar dict elements: the elements read by the parse method, grouped by
+        finite element descriptor: each value is a dict with the `labels`
+        and the `connectivity` (`n_elements`-by-`n_nodes` node labels).
     """
 
     def __init__(self):
         super(UnvHandler, self).__init__()
         self.extensions = ['.unv']
+        self.index = None
+        self.node_labels = None
+        self.elements = {}
 
     def parse(self, filename):
         """
         Method to parse the file `filename`. It returns a matrix with
-        all the coordinates. It reads only the section 2411 of the unv
-        files and it assumes there are only triangles.
+        all the coordinates of the section 2411 of the unv files. The
+        node labels are stored in `self.node_labels` and the elements of
+        the section 2412 in `self.elements`. The sections are located
+        through the dataset index of the file and each of them is
+        converted at once.
 
         :param string filename: name of the input file.
 
@@ -31,31 +51,32 @@ class UnvHandler(fh.FileHandler):
             the coordinates of the points of the mesh.
         :rtype: numpy.ndarray
         """
+        import numpy as np
         self._check_filename_type(filename)
         self._check_extension(filename)
 
         self.infile = filename
+        self.index = self._load_index(self.infile)
 
-        index = -9
-        mesh_points = []
-        with open(self.infile, 'r') as input_file:
-            for num, line in enumerate(input_file):
-                if line.startswith('  2411'):
-                    index = num
-                if num == index + 2:
-                    if line.startswith('    -1'):
-                        break
-                    else:
-                        line = line.replace('D', 'E')
-                        l = []
-                        for t in line.split():
-                            try:
-                                l.append(float(t))
-                            except ValueError:
-                                pass
-                        mesh_points.append(l)
-                        index = num
-            mesh_points = np.array(mesh_points)
+        nodes = [np.zeros((0, 7))]
+        self.elements = {}
+        with open(self.infile, 'rb') as input_file:
+            for start, end in self.index.find('2411'):
+                input_file.seek(start)
+                nodes.append(self._read_nodes(input_file.read(end - start)))
+            for start, end in self.index.find('2412'):
+                input_file.seek(start)
+                for descriptor, group in self._read_elements(
+                        input_file.read(end - start)).items():
+                    if descriptor in self.elements:
+                        group = dict(
+                            (key, np.concatenate(
+                                (self.elements[descriptor][key], value)))
+                            for key, value in group.items())
+                    self.elements[descriptor] = group
+        nodes = np.concatenate(nodes)
+        self.node_labels = nodes[:, 0].astype(np.int64)
+        mesh_points = np.ascontiguousarray(nodes[:, 4:])
 
         return mesh_points
 
@@ -64,34 +85,206 @@ class UnvHandler(fh.FileHandler):
         Writes a unv file, called filename, copying all the lines from
         `self.filename` but the coordinates. mesh_points is a matrix
         that contains the new coordinates to write in the unv file.
+        The datasets different from 2411 are copied as they are, and so
+        are the record lines of the nodes.
 
         :param numpy.ndarray mesh_points: it is a `n_points`-by-3 matrix
             containing the coordinates of the points of the mesh
         :param string filename: name of the output file.
         """
+        import numpy as np
         self._check_filename_type(filename)
         self._check_extension(filename)
         self._check_infile_instantiation()
 
         self.outfile = filename
+        if self.index is None or self.index.filename != self.infile:
+            self.index = self._load_index(self.infile)
+        sections = self.index.find('2411')
+        n_points = np.sum(self.index.line_counts[np.array(
+            [name == '2411' for name in self.index.names], dtype=bool)] // 2)
+        if len(mesh_points) != n_points:
+            raise ValueError(
+                'The unv file has {0!s} nodes, {1!s} points were given.'.format(
+                    n_points, len(mesh_points)))
+
+        if os.path.isfile(self.outfile) and os.path.samefile(
+                self.infile, self.outfile):
+            with open(self.infile, 'rb') as input_file:
+                input_file = io.BytesIO(input_file.read())
+        else:
+            input_file = open(self.infile, 'rb')
 
-        index = -9
         i = 0
-        with open(self.outfile, 'w') as output_file:
-            with open(self.infile, 'r') as input_file:
-                for num, line in enumerate(input_file):
-                    if line.startswith('  2411'):
-                        index = num
-                    if num == index + 2:
-                        if line.startswith('    -1'):
-                            index = -9
-                            output_file.write(line)
-                        else:
-                            for j in range(0, 3):
-                                output_file.write(3 * ' ' + '{:.16E}'.format(
-                                    mesh_points[i][j]))
-                            output_file.write('\n')
-                            i += 1
-                            index = num
-                    else:
-                        output_file.write(line)
+        position = 0
+        with input_file, open(self.outfile, 'wb') as output_file:
+            for start, end in sections:
+                copy_range(input_file, output_file, position, start)
+                input_file.seek(start)
+                records = input_file.read(end - start).splitlines(True)[0::2]
+                self._write_nodes(output_file, records,
+                                  mesh_points[i:i + len(records)])
+                i += len(records)
+                position = end
+            copy_range(input_file, output_file, position, self.index.size)
+
+    @staticmethod
+    def _read_nodes(body):
+        """
+        This private static method converts the body of a 2411 dataset.
+
+        :param bytes body: the lines of the dataset between the dataset
+            number and the closing delimiter.
+
+        :return: nodes: `n_points`-by-7 array with the label, the three
+            coordinate systems and color, and the three coordinates.
+        :rtype: numpy.ndarray
+        """
+        import numpy as np
+        values = np.fromstring(body.translate(_EXPONENTS), sep=' ')
+        if values.size % 7:
+            raise ValueError('The dataset 2411 has incomplete node records.')
+        return values.reshape(-1, 7)
+
+    @staticmethod
+    def _read_elements(body):
+        """
+        This private static method converts the body of a 2412 dataset.
+        When all the elements have the same descriptor and number of
+        nodes the records are reshaped at once, otherwise they are walked
+        one by one.
+
+        :param bytes body: the lines of the dataset between the dataset
+            number and the closing delimiter.
+
+        :return: elements: dict with a key for each finite element
+            descriptor, whose value is a dict with the element `labels`
+            and the `connectivity`.
+        :rtype: dict
+        """
+        import numpy as np
+        values = np.fromstring(body, dtype=np.int64, sep=' ')
+        if values.size == 0:
+            return {}
+        descriptor, n_nodes = values[1], values[5]
+        if descriptor not in _BEAMS and values.size % (6 + n_nodes) == 0:
+            records = values.reshape(-1, 6 + n_nodes)
+            if np.all(records[:, 1] == descriptor) and np.all(
+                    records[:, 5] == n_nodes):
+                return {
+                    int(descriptor): {
+                        'labels': records[:, 0].copy(),
+                        'connectivity': records[:, 6:].copy()
+                    }
+                }
+
+        groups = {}
+        position = 0
+        while position < values.size:
+            label, descriptor, n_nodes = values[position], values[
+                position + 1], values[position + 5]
+            position += 9 if descriptor in _BEAMS else 6
+            group = groups.setdefault(int(descriptor), ([], []))
+            group[0].append(label)
+            group[1].append(values[position:position + n_nodes])
+            position += n_nodes
+        if position != values.size:
+            raise ValueError('The dataset 2412 has incomplete element records.')
+        return dict((descriptor, {
+            'labels': np.array(labels, dtype=np.int64),
+            'connectivity': np.array(connectivity, dtype=np.int64)
+        }) for descriptor, (labels, connectivity) in groups.items())
+
+    @staticmethod
+    def _write_nodes(output_file, records, mesh_points, chunk_size=2**16):
+        """
+        This private static method writes the nodes of a 2411 dataset: each
+        record line as it is followed by the new coordinates, `chunk_size`
+        nodes at a time.
+
+        :param file output_file: file opened for binary writing.
+        :param list records: the record lines of the nodes, with their line
+            endings.
+        :param numpy.ndarray mesh_points: it is a `n_points`-by-3 matrix
+            containing the coordinates of the nodes.
+        :param int chunk_size: number of nodes formatted at once.
+        """
+        import numpy as np
+        ending = b'\r\n' if records and records[0].endswith(b'\r\n') else b'\n'
+        line = '%s' + 3 * '   %.16E' + ending.decode('ascii')
+        mesh_points = np.asarray(mesh_points, dtype=np.float64)
+        for start in range(0, len(records), chunk_size):
+            chunk = mesh_points[start:start + chunk_size]
+            values = [None] * (4 * chunk.shape[0])
+            values[0::4] = [
+                record.decode('latin-1')
+                for record in records[start:start + chunk.shape[0]]
+            ]
+            values[1::4] = chunk[:, 0].tolist()
+            values[2::4] = chunk[:, 1].tolist()
+            values[3::4] = chunk[:, 2].tolist()
+            output_file.write(
+                ((line * chunk.shape[0]) % tuple(values)).encode('latin-1'))
+
+    @classmethod
+    def _load_index(cls, filename):
+        """
+        This private class method returns the dataset index of the unv file
+        `filename`, from its sidecar file if it is still valid, otherwise
+        building it and saving it for the next time.
+
+        :param string filename: name of the unv file.
+
+        :return: index: the dataset index of the file.
+        :rtype: SectionIndex
+        """
+        import numpy as np
+        index = SectionIndex.load(filename)
+        if index is None:
+            index = cls._build_index(
+                filename, np.fromfile(filename, dtype=np.uint8))
+            index.save()
+        return index
+
+    @staticmethod
+    def _build_index(filename, buffer):
+        """
+        This private static method indexes the datasets of a unv file. Every
+        dataset is enclosed by two delimiter lines (-1 in the columns 5-6)
+        and its first line is the number of the dataset: the body of the
+        section goes from the following line to the closing delimiter.
+
+        :param string filename: name of the unv file.
+        :param numpy.ndarray buffer: the bytes of the unv file.
+
+        :return: index: the dataset index of the file.
+        :rtype: SectionIndex
+        """
+        import numpy as np
+        starts, lengths = split_lines(buffer)
+        line_starts = np.append(starts, buffer.size)
+        candidates = np.flatnonzero(lengths >= 6)
+        windows = buffer[starts[candidates, None] + np.arange(6)]
+        candidates = candidates[np.all(
+            windows == np.frombuffer(b'    -1', dtype=np.uint8), axis=1)]
+        delimiters = [
+            row for row in candidates
+            if not buffer[starts[row] + 6:starts[row] + lengths[row]].tobytes(
+            ).strip()
+        ]
+        if len(delimiters) % 2:
+            raise ValueError('The unv file has an unterminated dataset.')
+
+        opening = np.array(delimiters[0::2], dtype=np.int64)
+        closing = np.array(delimiters[1::2], dtype=np.int64)
+        names = [
+            buffer[starts[row + 1]:starts[row + 1] + lengths[row + 1]].tobytes(
+            ).decode('ascii', 'replace').strip() for row in opening
+        ]
+        index = SectionIndex(filename)
+        index.add_sections(
+            names,
+            np.column_stack((line_starts[np.minimum(opening + 2, closing)],
+                             line_starts[closing])),
+            np.maximum(closing - opening - 2, 0))
+        return index
@@ -1,10 +1,6 @@
 """
 Derived module from filehandler.py to handle vtk files.
 """
-import numpy as np
-import matplotlib.pyplot as plt
-import mpl_toolkits.mplot3d as a3
-import vtk
 import pygem.filehandler as fh
 
 
@@ -16,11 +12,23 @@ class VtkHandler(fh.FileHandler):
     :cvar string outfile: name of the output file where to write in.
     :cvar list extensions: extensions of the input/output files. It
         is equal to ['.vtk'].
+    :cvar bool deep_copy: if True (default) the points returned by parse
+        and the ones given to write are copied. If False they are shared
+        with VTK without copies: the array returned by parse is a view of
+        the points of the parsed dataset and the array given to write backs
+        the points written.
+    :cvar numpy.dtype points_dtype: the type of the coordinates of the
+        parsed file, float or double; write uses the same one. Default is
+        float64, for files not parsed yet.
     """
 
     def __init__(self):
+        import numpy as np
         super(VtkHandler, self).__init__()
         self.extensions = ['.vtk']
+        self.deep_copy = True
+        self.points_dtype = np.dtype(np.float64)
+        self._data = None
 
     def parse(self, filename):
         """
@@ -37,24 +45,23 @@ class VtkHandler(fh.FileHandler):
 
             - specify when it works
         """
+        import numpy as np
+        from vtk.util.numpy_support import vtk_to_numpy
+
         self._check_filename_type(filename)
         self._check_extension(filename)
 
         self.infile = filename
+        self._data = self._read_dataset(self.infile)
 
-        reader = vtk.vtkDataSetReader()
-        reader.SetFileName(self.infile)
-        reader.ReadAllVectorsOn()
-        reader.ReadAllScalarsOn()
-        reader.Update()
-        data = reader.GetOutput()
-
-        n_points = data.GetNumberOfPoints()
-        mesh_points = np.zeros([n_points, 3])
+        points = self._data.GetPoints()
+        if points is None:
+            return np.zeros([0, 3])
 
-        for i in range(n_points):
-            mesh_points[i][0], mesh_points[i][1], mesh_points[i][
-                2] = data.GetPoint(i)
+        mesh_points = vtk_to_numpy(points.GetData())
+        self.points_dtype = mesh_points.dtype
+        if self.deep_copy:
+            mesh_points = np.array(mesh_points, dtype=np.float64)
 
         return mesh_points
 
@@ -63,30 +70,37 @@ class VtkHandler(fh.FileHandler):
         Writes a vtk file, called filename, copying all the
         structures from self.filename but the coordinates.
         `mesh_points` is a matrix that contains the new coordinates
-        to write in the vtk file.
+        to write in the vtk file. The dataset kept by the parse method
+        is reused, so the input file is not read again, and the points
+        are written with the type of the parsed ones.
 
         :param numpy.ndarray mesh_points: it is a `n_points`-by-3
             matrix containing the coordinates of the points of the
             mesh
         :param string filename: name of the output file.
         """
+        import numpy as np
+        import vtk
+        from vtk.util.numpy_support import numpy_to_vtk
+
         self._check_filename_type(filename)
         self._check_extension(filename)
         self._check_infile_instantiation()
 
         self.outfile = filename
 
-        reader = vtk.vtkDataSetReader()
-        reader.SetFileName(self.infile)
-        reader.ReadAllVectorsOn()
-        reader.ReadAllScalarsOn()
-        reader.Update()
-        data = reader.GetOutput()
+        if self._data is None:
+            self._data = self._read_dataset(self.infile)
 
-        points = vtk.vtkPoints()
-        for i in range(data.GetNumberOfPoints()):
-            points.InsertNextPoint(mesh_points[i, :])
+        # a shallow copy shares everything but the points we are replacing
+        data = self._data.NewInstance()
+        data.ShallowCopy(self._data)
 
+        points = vtk.vtkPoints()
+        points.SetData(
+            numpy_to_vtk(
+                np.ascontiguousarray(mesh_points, dtype=self.points_dtype),
+                deep=self.deep_copy))
         data.SetPoints(points)
 
         writer = vtk.vtkDataSetWriter()
@@ -94,6 +108,24 @@ class VtkHandler(fh.FileHandler):
         writer.SetInputData(data)
         writer.Write()
 
+    @staticmethod
+    def _read_dataset(filename):
+        """
+        This private static method reads the vtk file `filename`.
+
+        :param string filename: name of the input file.
+        :return: data: the dataset read.
+        :rtype: vtk.vtkDataSet
+        """
+        import vtk
+
+        reader = vtk.vtkDataSetReader()
+        reader.SetFileName(filename)
+        reader.ReadAllVectorsOn()
+        reader.ReadAllScalarsOn()
+        reader.Update()
+        return reader.GetOutput()
+
     def plot(self, plot_file=None, save_fig=False):
         """
         Method to plot a vtk file. If `plot_file` is not given it
@@ -107,6 +139,12 @@ class VtkHandler(fh.FileHandler):
             the chosen geometry
         :rtype: matplotlib.pyplot.figure
         """
+        import numpy as np
+        import matplotlib.pyplot as plt
+        import mpl_toolkits.mplot3d as a3
+        import vtk
+        from vtk.util.numpy_support import vtk_to_numpy
+
         if plot_file is None:
             plot_file = self.infile
         else:
@@ -118,22 +156,20 @@ class VtkHandler(fh.FileHandler):
         reader.Update()
 
         data = reader.GetOutput()
-        points = data.GetPoints()
+        points = vtk_to_numpy(data.GetPoints().GetData())
         ncells = data.GetNumberOfCells()
 
         # for each cell it contains the indeces of the points that define the cell
+        cells = np.array([[data.GetCell(i).GetPointId(j) for j in range(0, 3)]
+                          for i in range(0, ncells)])
+        vtx = points[cells]
+
         figure = plt.figure()
         axes = a3.Axes3D(figure)
-        vtx = np.zeros((ncells, 3, 3))
-        for i in range(0, ncells):
-            for j in range(0, 3):
-                cell = data.GetCell(i).GetPointId(j)
-                vtx[i][j][0], vtx[i][j][1], vtx[i][j][2] = points.GetPoint(
-                    int(cell))
-            tri = a3.art3d.Poly3DCollection([vtx[i]])
-            tri.set_color('b')
-            tri.set_edgecolor('k')
-            axes.add_collection3d(tri)
+        tri = a3.art3d.Poly3DCollection(vtx)
+        tri.set_color('b')
+        tri.set_edgecolor('k')
+        axes.add_collection3d(tri)
 
         ## Get the limits of the axis and center the geometry
         max_dim = np.array(
@@ -168,6 +204,8 @@ class VtkHandler(fh.FileHandler):
 
         :param string show_file: the vtk filename you want to show.
         """
+        import vtk
+
         if show_file is None:
             show_file = self.infile
         else:
@@ -0,0 +1,206 @@
+""" Streaming letter statistics for ciphertext triage """
+import os
+import sys
+import numpy as np
+
+# the cipher folders are plain script folders, not packages
+_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(_root, 'Affine '), os.path.join(_root, 'Vigenere')]
+from affine import WORDS, gcd
+from vigenere import l
+
+ALPHABET = "".join(WORDS)
+if ALPHABET != l:
+    raise ImportError("Affine and Vigenere do not share the same alphabet")
+
+# relative letter frequencies of English text, a to z
+ENGLISH = np.array([
+    8.167, 1.492, 2.782, 4.253, 12.702, 2.228, 2.015, 6.094, 6.966, 0.153,
+    0.772, 4.025, 2.406, 6.749, 7.507, 1.929, 0.095, 5.987, 6.327, 9.056,
+    2.758, 0.978, 2.360, 0.150, 1.974, 0.074]) / 100.
+
+ENGLISH_IC = np.sum(ENGLISH * ENGLISH)    # about 0.066
+RANDOM_IC = 1. / len(ALPHABET)    # about 0.038
+MONO_IC = (ENGLISH_IC + RANDOM_IC) / 2.    # above it the letters still follow one alphabet
+COLUMN_LETTERS = 20    # fewer letters per column give too noisy a periodic index
+
+
+class FrequencyProfiler(object):
+    """
+    Unigram, bigram and periodic letter counts, updated chunk by chunk.
+
+    Memory does not depend on the amount of text: the counts are
+    len(ALPHABET) + len(ALPHABET)**2 + maxPeriod * (maxPeriod + 1) / 2 * len(ALPHABET),
+    one row of letter counts per period and residue. The periodic counts are
+    cubic in the alphabet size for the default maxPeriod = len(ALPHABET);
+    a smaller maxPeriod keeps them below the bigram counts.
+    A profiler created with start = n continues a stream whose first n letters
+    are counted elsewhere, so profiles of pieces of the stream merge exactly in
+    any order: the letters at the edges of the pieces not yet joined are kept,
+    and the bigram across an edge is counted when the neighbouring piece arrives.
+    """
+
+    def __init__(self, maxPeriod=len(ALPHABET), start=0):
+        size = len(ALPHABET)
+        self.maxPeriod = maxPeriod
+        self.start = start
+        self.position = start    # stream position of the next letter
+        self.heads = {}    # stream position -> first letter of a piece whose previous letter is missing
+        self.tails = {}    # stream position -> last letter of a piece ending there, whose next letter is missing
+        self.unigrams = np.zeros(size, dtype=np.int64)
+        self.bigrams = np.zeros((size, size), dtype=np.int64)
+        # row period * (period - 1) / 2 + column counts the letters at positions = column (mod period)
+        self.periodic = np.zeros((maxPeriod * (maxPeriod + 1) // 2, size), dtype=np.int64)
+
+    @property
+    def first(self):
+        """ First letter of the stream counted, -1 if it is missing """
+        return self.heads.get(self.start, -1)
+
+    @property
+    def last(self):
+        """ Last letter of the stream counted, -1 if it is missing """
+        return self.tails.get(self.position, -1)
+
+    def columns(self, period):
+        """ Letter counts of the period columns, a period x len(ALPHABET) view """
+        offset = period * (period - 1) // 2
+        return self.periodic[offset:offset + period]
+
+    def update(self, chunk):
+        """ Count the letters of chunk (str or bytes), anything else is skipped """
+        size = len(ALPHABET)
+        if not isinstance(chunk, bytes):
+            chunk = chunk.encode('ascii', 'ignore')
+        letters = np.frombuffer(chunk.lower(), dtype=np.uint8) - np.uint8(ord(ALPHABET[0]))
+        letters = letters[letters < size].astype(np.intp)
+        if not len(letters):
+            return self
+
+        self.unigrams += np.bincount(letters, minlength=size)
+        self.bigrams += np.bincount(letters[:-1] * size + letters[1:], minlength=size * size).reshape(size, size)
+        positions = np.arange(self.position, self.position + len(letters))
+        for period in range(1, self.maxPeriod + 1):
+            cells = (positions % period) * size + letters
+            self.columns(period)[:] += np.bincount(cells, minlength=period * size).reshape(period, size)
+
+        self._join({self.position: int(letters[0])}, {self.position + len(letters): int(letters[-1])})
+        self.position += len(letters)
+        return self
+
+    def _join(self, heads, tails):
+        """ Add the edges of other pieces, counting the bigrams across the edges that meet """
+        for position, letter in heads.items():
+            if position in self.tails:    # bigram across the boundary of adjacent pieces
+                self.bigrams[self.tails.pop(position), letter] += 1
+            else:
+                self.heads[position] = letter
+        for position, letter in tails.items():
+            if position in self.heads:
+                self.bigrams[letter, self.heads.pop(position)] += 1
+            else:
+                self.tails[position] = letter
+
+    def merge(self, other):
+        """
+        Add the counts of other, the profile of another piece of the stream, e.g. from another
+        process. The pieces need not be adjacent: the bigrams across a gap are counted when the
+        profile of the missing piece is merged.
+        """
+        if other.maxPeriod != self.maxPeriod:
+            raise ValueError("Profiles with different maxPeriod can not be merged")
+        self.unigrams += other.unigrams
+        self.bigrams += other.bigrams
+        self.periodic += other.periodic
+        self._join(other.heads, other.tails)
+        self.start = min(self.start, other.start)
+        self.position = max(self.position, other.position)
+        return self
+
+    def save(self, filename):
+        state = np.array([self.maxPeriod, self.start, self.position])
+        heads = np.array(sorted(self.heads.items()), dtype=np.int64).reshape(-1, 2)
+        tails = np.array(sorted(self.tails.items()), dtype=np.int64).reshape(-1, 2)
+        np.savez(filename, unigrams=self.unigrams, bigrams=self.bigrams, periodic=self.periodic,
+                 state=state, heads=heads, tails=tails)
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename) as data:
+            maxPeriod, start, position = [int(value) for value in data['state']]
+            profiler = cls(maxPeriod, start)
+            profiler.position = position
+            profiler.heads = dict((int(key), int(value)) for key, value in data['heads'])
+            profiler.tails = dict((int(key), int(value)) for key, value in data['tails'])
+            profiler.unigrams[:] = data['unigrams']
+            profiler.bigrams[:] = data['bigrams']
+            profiler.periodic[:] = data['periodic']
+        return profiler
+
+    def count(self):
+        return int(self.unigrams.sum())
+
+    @staticmethod
+    def coincidence(counts):
+        """ Index of coincidence of the counts along the last axis """
+        total = counts.sum(axis=-1)
+        pairs = (counts * (counts - 1)).sum(axis=-1)
+        return np.where(total > 1, pairs / np.maximum(total * (total - 1), 1.), np.nan)
+
+    def indexOfCoincidence(self):
+        return float(self.coincidence(self.unigrams))
+
+    def periodicIndex(self):
+        """ Mean index of coincidence of the columns, for every period from 1 to maxPeriod """
+        index = np.full(self.maxPeriod + 1, np.nan)
+        for period in range(1, self.maxPeriod + 1):
+            columns = self.coincidence(self.columns(period))
+            if not np.isnan(columns).all():
+                index[period] = np.nanmean(columns)
+        return index
+
+    def guessPeriod(self):
+        """ Shortest period scoring close to the best one (multiples of the key length score alike) """
+        index = self.periodicIndex()[:max(self.count() // COLUMN_LETTERS, 1) + 1]
+        if np.isnan(index[1:]).all():
+            return None
+        candidates = np.flatnonzero(index >= max(MONO_IC, 0.9 * np.nanmax(index)))
+        if len(candidates):
+            return int(candidates[0])
+        return int(np.nanargmax(index))
+
+    def affineFit(self):
+        """ Best Affine keys (a, b) against English frequencies and their chi squared per letter """
+        size = len(ALPHABET)
+        expected = ENGLISH * max(self.count(), 1)
+        plain = np.arange(size)
+        best = None
+        for keyA in [a for a in range(1, size) if gcd(a, size) == 1]:
+            # row b holds the ciphertext letter of every plaintext letter for the keys (keyA, b)
+            crypted = (keyA * plain[None, :] + plain[:, None]) % size
+            chi = (((self.unigrams[crypted] - expected) ** 2) / expected).sum(axis=1)
+            keyB = int(np.argmin(chi))
+            if best is None or chi[keyB] < best[1]:
+                best = ((keyA, keyB), float(chi[keyB]))
+        return best[0], best[1] / max(self.count(), 1)
+
+    def guessFamily(self):
+        """
+        Fast guess from the counts already collected: ('plaintext', None),
+        ('affine', (a, b)), ('substitution', None), ('vigenere', period) or
+        ('unknown', None).
+        """
+        if self.count() < 2 * len(ALPHABET):
+            return 'unknown', None
+        index = self.periodicIndex()
+        period = self.guessPeriod()
+        # columns of a Vigenere key length are clearly more monoalphabetic than the whole text
+        if period is not None and period > 1 and index[period] >= max(MONO_IC, 1.1 * index[1]):
+            return 'vigenere', period
+        if index[1] >= MONO_IC:
+            keys, chi = self.affineFit()
+            # English under those keys, allowing for the sampling noise of short texts
+            if chi < 0.1 + (len(ALPHABET) - 1.) / self.count():
+                return ('plaintext', None) if keys == (1, 0) else ('affine', keys)
+            return 'substitution', None
+        return 'unknown', None
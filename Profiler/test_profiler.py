@@ -0,0 +1,74 @@
+""" Tests of the streaming letter statistics """
+import itertools
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from profiler import FrequencyProfiler
+
+TEXT = "the quick brown fox jumps over the lazy dog " * 20
+
+
+class TestFrequencyProfiler(unittest.TestCase):
+
+    def pieces(self, cut):
+        head = FrequencyProfiler().update(TEXT[:cut])
+        tail = FrequencyProfiler(start=head.position).update(TEXT[cut:])
+        return head, tail
+
+    def assertSameCounts(self, profiler, expected):
+        np.testing.assert_array_equal(profiler.unigrams, expected.unigrams)
+        np.testing.assert_array_equal(profiler.bigrams, expected.bigrams)
+        np.testing.assert_array_equal(profiler.periodic, expected.periodic)
+        self.assertEqual((profiler.start, profiler.position, profiler.first, profiler.last),
+                         (expected.start, expected.position, expected.first, expected.last))
+
+    def test_merge_in_stream_order(self):
+        head, tail = self.pieces(101)
+        self.assertSameCounts(head.merge(tail), FrequencyProfiler().update(TEXT))
+
+    def test_merge_in_reverse_order(self):
+        head, tail = self.pieces(101)
+        self.assertSameCounts(tail.merge(head), FrequencyProfiler().update(TEXT))
+
+    def test_merge_with_a_gap(self):
+        cuts = [0, 97, 211, len(TEXT)]
+        starts = [len(TEXT[:cut].replace(' ', '')) for cut in cuts]
+        expected = FrequencyProfiler().update(TEXT)
+        for order in itertools.permutations(range(3)):
+            a, b, c = [FrequencyProfiler(start=starts[i]).update(TEXT[cuts[i]:cuts[i + 1]]) for i in order]
+            self.assertSameCounts(a.merge(b).merge(c), expected)
+
+    def test_gap_survives_save_and_load(self):
+        cuts = [0, 97, 211, len(TEXT)]
+        starts = [len(TEXT[:cut].replace(' ', '')) for cut in cuts]
+        a, b, c = [FrequencyProfiler(start=starts[i]).update(TEXT[cuts[i]:cuts[i + 1]]) for i in range(3)]
+        handle, filename = tempfile.mkstemp(suffix='.npz')
+        os.close(handle)
+        try:
+            a.merge(c).save(filename)
+            merged = FrequencyProfiler.load(filename).merge(b)
+        finally:
+            os.remove(filename)
+        self.assertSameCounts(merged, FrequencyProfiler().update(TEXT))
+
+    def test_periodic_shape(self):
+        profiler = FrequencyProfiler(maxPeriod=5)
+        self.assertEqual(profiler.periodic.shape, (15, 26))
+        self.assertEqual(profiler.columns(4).shape, (4, 26))
+
+    def test_save_and_load(self):
+        profiler = FrequencyProfiler().update(TEXT)
+        handle, filename = tempfile.mkstemp(suffix='.npz')
+        os.close(handle)
+        try:
+            profiler.save(filename)
+            self.assertSameCounts(FrequencyProfiler.load(filename), profiler)
+        finally:
+            os.remove(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+""" Vigenere throughput benchmark: vectorized table engine against per character loops """
+from vigenere import CypherTable
+from string import ascii_lowercase as l
+from timeit import default_timer as timer
+import numpy as np
+import random
+
+def randomText(length):
+	return "".join(random.choice(l) for i in range(length))
+
+def naiveRunningKey(cross, string, bookText):
+	book = [c for c in bookText.lower() if c in l]
+	cipheredString = ""
+	for i in range(len(string)):
+		cipheredString += cross(string[i], book[i])
+	return cipheredString
+
+def naivePipeline(table, string, keys):
+	for key in keys:
+		string = table.encrypt(string, key)
+	return string
+
+def naiveAutokeyEncrypt(table, string, key):
+	key += string
+	encryptedString = ""
+	for i in range(len(string)):
+		encryptedString += table.cross(string[i], key[i])
+	return encryptedString
+
+def naiveAutokeyDecrypt(table, string, key):
+	decryptedString = ""
+	for i in range(len(string)):
+		letter = table.decross(string[i], key[i])
+		decryptedString += letter
+		key += letter
+	return decryptedString
+
+def measure(function, *args):
+	""" Best of three runs, in seconds """
+	best = None
+	for i in range(3):
+		start = timer()
+		result = function(*args)
+		elapsed = timer() - start
+		best = elapsed if best is None else min(best, elapsed)
+	return best, result
+
+def variantBenchmark(table):
+	key = "lemon"
+	keys = ["lemon", "orange", "kiwi"]
+	print("%-22s %10s %12s %12s %9s" % ("variant", "letters", "loop (MB/s)", "numpy (MB/s)", "speedup"))
+	for length in (1000, 10000, 100000):
+		text = randomText(length)
+		bookText = randomText(length)
+		autokeyText = table.encryptAutokey(text, key)
+		cases = [
+			("running key encrypt", (naiveRunningKey, table.cross, text, bookText), (table.encryptRunningKey, text, bookText)),
+			("running key decrypt", (naiveRunningKey, table.decross, text, bookText), (table.decryptRunningKey, text, bookText)),
+			("pipeline encrypt", (naivePipeline, table, text, keys), (table.encryptPipeline, text, keys)),
+			("autokey encrypt", (naiveAutokeyEncrypt, table, text, key), (table.encryptAutokey, text, key)),
+			("autokey decrypt", (naiveAutokeyDecrypt, table, autokeyText, key), (table.decryptAutokey, autokeyText, key)),
+		]
+		for name, naive, vectorized in cases:
+			naiveTime, naiveResult = measure(*naive)
+			vectorTime, vectorResult = measure(*vectorized)
+			if naiveResult != vectorResult:
+				raise AssertionError(name + " does not match the per character loop")
+			print("%-22s %10d %12.2f %12.2f %8.0fx" % (name, length, length / naiveTime / 1e6,
+				length / vectorTime / 1e6, naiveTime / vectorTime))
+
+
+def batchBenchmark(table):
+	""" Thread pool batch mode on many small messages, about 8 MB per batch """
+	key = "lemon"
+	print("\n%-10s %9s %8s %12s %9s" % ("message", "messages", "threads", "MB/s", "scaling"))
+	for length in (10, 100, 1000, 10000):
+		count = 8000000 // length
+		letters = (np.random.randint(0, len(l), count * length) + ord(l[0])).astype(np.uint8).tobytes().decode("ascii")
+		messages = [letters[i * length:(i + 1) * length] for i in range(count)]
+		serialTime = None
+		for threads in (1, 2, 4, 8, 16):
+			elapsed, result = measure(table.encryptBatch, messages, key, threads)
+			if result[-1] != table.encrypt(messages[-1], key):
+				raise AssertionError("batch mode does not match encrypt")
+			serialTime = serialTime or elapsed
+			print("%-10d %9d %8d %12.2f %8.2fx" % (length, count, threads, count * length / elapsed / 1e6, serialTime / elapsed))
+
+def main():
+	table = CypherTable()
+	variantBenchmark(table)
+	batchBenchmark(table)
+
+
+if __name__ == "__main__": main()
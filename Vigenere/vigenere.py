@@ -1,22 +1,27 @@
 """ Cypher matrix handler """
 
 from string import ascii_lowercase as l
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
 class CypherTable:
         
 	def __init__(self):
 		self.matrix = [l[i:]+l[:i] for i in range(len(l))]
+		# numeric tabula recta: table[row][column] is the index of the crossed letter
+		shift = np.arange(len(l))
+		self.table = ((shift[:, None] + shift[None, :]) % len(l)).astype(np.uint8)
+		self.detable = ((shift[:, None] - shift[None, :]) % len(l)).astype(np.uint8)
 
 	def cross(self, b, a):
-   		val1 = self.matrix[0].index(a)	
+		val1 = self.matrix[0].index(a)	
 		new_letter = [i for i in self.matrix if i[0] == b][0][val1]	
-   		return new_letter
+		return new_letter
 
 	def decross(self, b, a):
-   		val1 = self.matrix[0].index(a)	
-   		val2 = self.matrix[0].index(b)	
-   		new_letter = [i for i in self.matrix if i[val1] == b][0][0]	
-   		return new_letter
+		val1 = self.matrix[0].index(a)	
+		new_letter = [i for i in self.matrix if i[val1] == b][0][0]	
+		return new_letter
 
 	def __str__(self):
 		return "\n".join('|'.join(row) for row in self.matrix)		
@@ -38,3 +43,117 @@ class CypherTable:
 		for i in range(len(string)):
 			decryptedString += self.decross(string[i], key[i])
 		return decryptedString
+
+	def toIndices(self, string):
+		""" Letters to table indices (0 - 25) as an uint8 array """
+		indices = np.frombuffer(string.encode('ascii'), dtype=np.uint8) - np.uint8(ord(l[0]))
+		if indices.size and indices.max() >= len(l):    # non letters wrap around past 25
+			raise ValueError("Only lowercase letters can be ciphered")
+		return indices
+
+	def fromIndices(self, indices):
+		""" Table indices back to letters """
+		return (indices.astype(np.uint8) + np.uint8(ord(l[0]))).tobytes().decode('ascii')
+
+	def crossArray(self, text, key):
+		""" Vectorized cross over aligned arrays of indices """
+		return self.table[text, key]
+
+	def decrossArray(self, text, key):
+		""" Vectorized decross over aligned arrays of indices """
+		return self.detable[text, key]
+
+	def keyStream(self, key, length):
+		""" Repeating keyword stretched (or cut) to length """
+		if not key:
+			raise ValueError("The key can not be empty")
+		return np.resize(self.toIndices(key), length)
+
+	def runningKey(self, bookText, length):
+		""" Running keystream taken from a book text, non letters are skipped """
+		book = np.frombuffer(bookText.lower().encode('ascii', 'ignore'), dtype=np.uint8) - np.uint8(ord(l[0]))
+		book = book[book < len(l)]
+		if len(book) < length:
+			raise ValueError("The running key is shorter than the message")
+		return book[:length]
+
+	def encryptRunningKey(self, string, bookText):
+		text = self.toIndices(string)
+		return self.fromIndices(self.crossArray(text, self.runningKey(bookText, len(text))))
+
+	def decryptRunningKey(self, string, bookText):
+		text = self.toIndices(string)
+		return self.fromIndices(self.decrossArray(text, self.runningKey(bookText, len(text))))
+
+	def pipelineStream(self, keys, length):
+		""" Chained Vigenere stages add up to a single keystream """
+		stream = np.zeros(length, dtype=np.intp)
+		for key in keys:
+			stream += self.keyStream(key, length)
+		return stream % len(l)
+
+	def encryptPipeline(self, string, keys):
+		""" Encrypt with every key of keys in a row, as one table lookup """
+		text = self.toIndices(string)
+		return self.fromIndices(self.crossArray(text, self.pipelineStream(keys, len(text))))
+
+	def decryptPipeline(self, string, keys):
+		text = self.toIndices(string)
+		return self.fromIndices(self.decrossArray(text, self.pipelineStream(keys, len(text))))
+
+	def encryptAutokey(self, string, key):
+		""" Autokey: the keyword followed by the plaintext itself """
+		text = self.toIndices(string)
+		stream = np.concatenate((self.keyStream(key, len(key)), text))[:len(text)]
+		return self.fromIndices(self.crossArray(text, stream))
+
+	def decryptAutokey(self, string, key):
+		""" Autokey recurrence solved one key length block at a time """
+		text = self.toIndices(string)
+		stream = self.keyStream(key, len(key))
+		decrypted = np.empty_like(text)
+		for start in range(0, len(text), len(stream)):
+			block = text[start:start + len(stream)]
+			decrypted[start:start + len(block)] = self.decrossArray(block, stream[:len(block)])
+			stream = decrypted[start:start + len(block)]    # each plaintext block keys the next one
+		return self.fromIndices(decrypted)
+
+	def batchCross(self, messages, key, direction, threads):
+		""" Cipher many messages at once: they share one buffer, offsets mark where each one starts """
+		lengths = np.array([len(message) for message in messages], dtype=np.intp)
+		offsets = np.zeros(len(messages) + 1, dtype=np.intp)
+		np.cumsum(lengths, out=offsets[1:])
+		text = self.toIndices("".join(messages))
+		keyIndices = self.keyStream(key, len(key))
+		output = np.empty(len(text), dtype=np.uint8)	# shared, every worker fills its own slab
+
+		def work(first, last):
+			start, stop = offsets[first], offsets[last]
+			position = np.arange(start, stop) - np.repeat(offsets[first:last], lengths[first:last])
+			np.remainder(position, len(keyIndices), out=position)	# the key restarts with every message
+			slab = output[start:stop]
+			if direction > 0:
+				np.add(text[start:stop], keyIndices[position], out=slab)
+			else:
+				np.subtract(text[start:stop] + np.uint8(len(l)), keyIndices[position], out=slab)
+			np.remainder(slab, len(l), out=slab)
+
+		# slabs of roughly the same number of letters, cut at message boundaries
+		cuts = np.searchsorted(offsets, np.linspace(0, len(text), threads * 4 + 1))
+		cuts = np.unique(np.concatenate(([0], cuts, [len(messages)])))
+		if threads > 1:
+			with ThreadPoolExecutor(max_workers=threads) as pool:
+				list(pool.map(work, cuts[:-1], cuts[1:]))
+		else:
+			for first, last in zip(cuts[:-1], cuts[1:]):
+				work(first, last)
+		cipheredText = self.fromIndices(output)
+		return [cipheredText[offsets[i]:offsets[i + 1]] for i in range(len(messages))]
+
+	def encryptBatch(self, messages, key, threads=1):
+		""" Encrypt every message of messages with key, restarting the key for each one """
+		return self.batchCross(messages, key, 1, threads)
+
+	def decryptBatch(self, messages, key, threads=1):
+		""" Decrypt every message of messages with key, restarting the key for each one """
+		return self.batchCross(messages, key, -1, threads)